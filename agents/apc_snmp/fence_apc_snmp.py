@@ -20,6 +20,7 @@ sys.path.append("@FENCEAGENTSLIBDIR@")
 from fencing import *
 from fencing import fail_usage
 from fencing_snmp import FencingSnmp
+from fencing_cache import FencingCache
 
 ### CONSTANTS ###
 # oid defining fence device
@@ -34,6 +35,9 @@ port_id = None
 # Switch ID
 switch_id = None
 
+# Cache of device type and port indexes - see FencingCache
+cache = None
+
 # Classes describing Device params
 class TripplitePDU(object):
         # Rack PDU
@@ -119,47 +123,65 @@ def apc_set_device(conn):
 		    None:ApcMS}
 
 	# First resolve type of APC
-	apc_type = conn.walk(OID_SYS_OBJECT_ID)
+	apc_type = cache.get("sysObjectID")
 
-	if not ((len(apc_type) == 1) and (apc_type[0][1] in agents_dir)):
-		apc_type = [[None, None]]
+	if apc_type is None:
+		res = conn.walk(OID_SYS_OBJECT_ID)
+		apc_type = (len(res) == 1) and res[0][1] or ""
+		cache.set("sysObjectID", apc_type)
 
-	device = agents_dir[apc_type[0][1]]
+	device = agents_dir.get(apc_type, agents_dir[None])
 
 	logging.debug("Trying %s"%(device.ident_str))
 
-def apc_resolv_port_id(conn, options):
-	global port_id, switch_id
+def apc_table_plug_id(oid):
+	# Return (switch_id, port_id) from oid of outlet table
+	t = oid.split('.')
+	if device.has_switches:
+		return (int(t[len(t)-3]), int(t[len(t)-1]))
+	else:
+		return (None, int(t[len(t)-1]))
 
+def apc_plug_id(conn, options, plug):
+	# Return (switch_id, port_id) of plug given by number or name
 	if device == None:
 		apc_set_device(conn)
 
-	# Now we resolv port_id/switch_id
-	if (options["--plug"].isdigit()) and ((not device.has_switches) or (options["--switch"].isdigit())):
-		port_id = int(options["--plug"])
+	if plug.isdigit() and ((not device.has_switches) or (options["--switch"].isdigit())):
+		return ((device.has_switches) and int(options["--switch"]) or None, int(plug))
 
-		if device.has_switches:
-			switch_id = int(options["--switch"])
-	else:
-		table = conn.walk(device.outlet_table_oid, 30)
+	# Name of port is verified by one GET instead of walk of outlet table
+	cached = cache.get("port:" + plug)
+	if cached is not None:
+		res = conn.get(cached, stop=False)
+		if res is not None and res[1].strip('"') == plug:
+			return apc_table_plug_id(cached)
+		cache.invalidate()
 
-		for x in table:
-			if x[1].strip('"') == options["--plug"]:
-				t = x[0].split('.')
-				if device.has_switches:
-					port_id = int(t[len(t)-1])
-					switch_id = int(t[len(t)-3])
-				else:
-					port_id = int(t[len(t)-1])
+	table = conn.bulkwalk(device.outlet_table_oid, 30)
 
-	if port_id == None:
-		fail_usage("Can't find port with name %s!"%(options["--plug"]))
+	for x in table:
+		if x[1].strip('"') == plug:
+			cache.set("port:" + plug, x[0])
+			return apc_table_plug_id(x[0])
+
+	cache.invalidate()
+	fail_usage("Can't find port with name %s!"%(plug))
+
+def apc_resolv_port_id(conn, options):
+	global port_id, switch_id
+
+	(switch_id, port_id) = apc_plug_id(conn, options, options["--plug"])
+
+def plug_oid(oid, plug_id):
+	(switch, port) = plug_id
+	return ((device.has_switches) and oid%(switch, port) or oid%(port))
 
 def get_power_status(conn, options):
 	if port_id == None:
 		apc_resolv_port_id(conn, options)
 
-	oid = ((device.has_switches) and device.status_oid%(switch_id, port_id) or device.status_oid%(port_id))
+	oid = plug_oid(device.status_oid, (switch_id, port_id))
 
 	(oid, status) = conn.get(oid)
 	return status == str(device.state_on) and "on" or "off"
@@ -168,10 +190,24 @@ def set_power_status(conn, options):
 	if port_id == None:
 		apc_resolv_port_id(conn, options)
 
-	oid = ((device.has_switches) and device.control_oid%(switch_id, port_id) or device.control_oid%(port_id))
+	oid = plug_oid(device.control_oid, (switch_id, port_id))
 
 	conn.set(oid, (options["--action"] == "on" and device.turn_on or device.turn_off))
 
+# Status of all plugs in one request
+def get_plugs_power_status(conn, options):
+	plug_ids = [apc_plug_id(conn, options, plug) for plug in options["--plugs"]]
+
+	res = conn.get_many([plug_oid(device.status_oid, plug_id) for plug_id in plug_ids])
+	return [status == str(device.state_on) and "on" or "off" for (oid, status) in res]
+
+# Turn all plugs on/off in one request
+def set_plugs_power_status(conn, options):
+	plug_ids = [apc_plug_id(conn, options, plug) for plug in options["--plugs"]]
+
+	value = options["--action"] == "on" and device.turn_on or device.turn_off
+	conn.set_many([(plug_oid(device.control_oid, plug_id), value) for plug_id in plug_ids])
+
 
 def get_outlets_status(conn, options):
 	result = {}
@@ -179,7 +215,7 @@ def get_outlets_status(conn, options):
 	if device == None:
 		apc_set_device(conn)
 
-	res_ports = conn.walk(device.outlet_table_oid, 30)
+	res_ports = conn.bulkwalk(device.outlet_table_oid, 30)
 
 	for x in res_ports:
 		t = x[0].split('.')
@@ -225,8 +261,12 @@ SNMP v1, v2c, v3 with all combinations of  authenticity/privacy settings.".forma
 	docs["symlink"] = [("fence_tripplite_snmp", "Fence agent for Tripplife over SNMP")]
 	show_docs(options, docs)
 
+	global cache
+	cache = FencingCache(options, "fence_apc_snmp")
+
 	# Operate the fencing device
-	result = fence_action(FencingSnmp(options), options, set_power_status, get_power_status, get_outlets_status)
+	result = fence_action(FencingSnmp(options), options, set_power_status, get_power_status, get_outlets_status,
+			get_plugs_power_fn=get_plugs_power_status, set_plugs_power_fn=set_plugs_power_status)
 
 	sys.exit(result)
 if __name__ == "__main__":
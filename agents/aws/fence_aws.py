@@ -5,14 +5,13 @@ import logging
 import atexit
 sys.path.append("@FENCEAGENTSLIBDIR@")
 from fencing import *
-from fencing import fail, fail_usage, run_delay, EC_STATUS, SyslogLibHandler
+from fencing import fail, fail_usage, run_delay, EC_STATUS, SyslogLibHandler, lazy_import
 
-import requests
-from requests import HTTPError
+requests = lazy_import("requests")
 
 try:
-	import boto3
-	from botocore.exceptions import ConnectionError, ClientError, EndpointConnectionError, NoRegionError, ParamValidationError
+	boto3 = lazy_import("boto3")
+	botocore = lazy_import("botocore.exceptions")
 except ImportError:
 	pass
 
@@ -36,7 +35,7 @@ def get_instance_id(options):
 		token = requests.put('http://169.254.169.254/latest/api/token', headers={"X-aws-ec2-metadata-token-ttl-seconds" : "21600"}).content.decode("UTF-8")
 		r = requests.get('http://169.254.169.254/latest/meta-data/instance-id', headers={"X-aws-ec2-metadata-token" : token}).content.decode("UTF-8")
 		return r
-	except HTTPError as http_err:
+	except requests.HTTPError as http_err:
 		logger.error('HTTP error occurred while trying to access EC2 metadata server: %s', http_err)
 	except Exception as err:
 		if "--skip-race-check" not in options:
@@ -67,11 +66,11 @@ def get_nodes_list(conn, options):
 				if options.get("--original-action") == "list-status":
 					logger.error("Unknown status \"{}\" returned for {} ({})".format(instance.state["Name"], instance.id, instance_name))
 				result[instance.id] = (instance_name, "unknown")
-	except ClientError:
+	except botocore.exceptions.ClientError:
 		fail_usage("Failed: Incorrect Access Key or Secret Key.")
-	except EndpointConnectionError:
+	except botocore.exceptions.EndpointConnectionError:
 		fail_usage("Failed: Incorrect Region.")
-	except ConnectionError as e:
+	except botocore.exceptions.ConnectionError as e:
 		fail_usage("Failed: Unable to connect to AWS: " + str(e))
 	except Exception as e:
 		logger.error("Failed to get node list: %s", e)
@@ -89,9 +88,9 @@ def get_power_status(conn, options):
 		except KeyError as e:
 			logger.error("Unknown status \"{}\" returned".format(state))
 			return "unknown"
-	except ClientError:
+	except botocore.exceptions.ClientError:
 		fail_usage("Failed: Incorrect Access Key or Secret Key.")
-	except EndpointConnectionError:
+	except botocore.exceptions.EndpointConnectionError:
 		fail_usage("Failed: Incorrect Region.")
 	except IndexError:
 		fail(EC_STATUS)
@@ -110,9 +109,9 @@ def get_self_power_status(conn, instance_id):
 			logger.debug("Captured my (%s) state it is %s - returning Alert - Unable to fence other nodes",instance_id,state.upper())
 			return "alert"
 	
-	except ClientError:
+	except botocore.exceptions.ClientError:
 		fail_usage("Failed: Incorrect Access Key or Secret Key.")
-	except EndpointConnectionError:
+	except botocore.exceptions.EndpointConnectionError:
 		fail_usage("Failed: Incorrect Region.")
 	except IndexError:
 		return "fail"
@@ -138,7 +137,7 @@ def set_power_status(conn, options):
 				logger.debug("Skipping fencing as instance is not in running status")
 		elif (options["--action"]=="on"):
 			conn.instances.filter(InstanceIds=[options["--plug"]]).start()
-	except ParamValidationError:
+	except botocore.exceptions.ParamValidationError:
 		if (options["--action"] == "off"):
 			logger.warning(f"SkipOsShutdown not supported with the current boto3 version {boto3.__version__} - falling back to graceful shutdown")
 			conn.instances.filter(InstanceIds=[options["--plug"]]).stop(Force=True)
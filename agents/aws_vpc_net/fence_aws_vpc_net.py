@@ -14,14 +14,16 @@ from fencing import (
     run_delay,
     fail,
     fail_usage,
+    poll_until,
     EC_STATUS,
     EC_GENERIC_ERROR,
-    SyslogLibHandler
+    SyslogLibHandler,
+    lazy_import
 )
 
 try:
-    import boto3
-    from botocore.exceptions import ConnectionError, ClientError, EndpointConnectionError, NoRegionError
+    boto3 = lazy_import("boto3")
+    botocore = lazy_import("botocore.exceptions")
 except ImportError:
     pass
 
@@ -32,6 +34,9 @@ logger.setLevel(logging.INFO)
 logger.addHandler(SyslogLibHandler())
 logging.getLogger('botocore.vendored').propagate = False
 
+# Seconds to wait for modified security groups to show up on the interfaces
+SG_PROPAGATION_TIMEOUT = 5
+
 # DESIGN HEURISTIC:
 # The code follows a clear separation of concerns pattern:
 # - get_power_status: Should ONLY contain logic to READ the current state, never modify it
@@ -319,9 +324,9 @@ def get_power_status(conn, options):
             logger.debug(f"Instance {instance_id} is not fenced - returning 'on'")
             return "on"
 
-    except ClientError:
+    except botocore.exceptions.ClientError:
         fail_usage("Failed: Incorrect Access Key or Secret Key.")
-    except EndpointConnectionError:
+    except botocore.exceptions.EndpointConnectionError:
         fail_usage("Failed: Incorrect Region.")
     except IndexError:
         fail(EC_STATUS)
@@ -373,7 +378,7 @@ def get_instance_details(ec2_client, instance_id):
 
         return instance_state, vpc_id, interfaces
 
-    except ClientError as e:
+    except botocore.exceptions.ClientError as e:
         logger.error(f"AWS API error while retrieving instance details: {str(e)}")
         raise
     except IndexError as e:
@@ -386,6 +391,32 @@ def get_instance_details(ec2_client, instance_id):
         logger.error(f"Unexpected error while retrieving instance details: {str(e)}")
         raise
 
+def wait_for_security_groups(ec2_client, instance_id, expected_sgs, timeout=SG_PROPAGATION_TIMEOUT):
+    """
+    Wait until the interfaces of the instance report the expected security groups.
+
+    Args:
+        ec2_client: The boto3 EC2 client
+        instance_id: The ID of the EC2 instance
+        expected_sgs: Dict of interface IDs to their expected security groups
+        timeout: Seconds to wait for the changes to propagate
+
+    Returns:
+        bool: True if all interfaces have the expected security groups
+    """
+    if not expected_sgs:
+        return True
+
+    def propagated():
+        _, _, interfaces = get_instance_details(ec2_client, instance_id)
+        current_sgs = {i["NetworkInterfaceId"]: sorted(i["SecurityGroups"]) for i in interfaces}
+        return all(current_sgs.get(interface_id) == sorted(sgs) for interface_id, sgs in expected_sgs.items())
+
+    if not poll_until(propagated, timeout, max_interval=1):
+        logger.warning(f"Security group changes of instance {instance_id} did not propagate in {timeout} seconds")
+        return False
+    return True
+
 # Check if we are the self-fencing node
 def get_self_power_status(conn, instance_id):
     try:
@@ -398,9 +429,9 @@ def get_self_power_status(conn, instance_id):
             logger.debug(f"Captured my ({instance_id}) state it is {state.upper()} - returning Alert - Unable to fence other nodes")
             return "alert"
 
-    except ClientError:
+    except botocore.exceptions.ClientError:
         fail_usage("Failed: Incorrect Access Key or Secret Key.")
-    except EndpointConnectionError:
+    except botocore.exceptions.EndpointConnectionError:
         fail_usage("Failed: Incorrect Region.")
     except IndexError:
         return "fail"
@@ -498,7 +529,7 @@ def create_backup_tag(ec2_client, instance_id, interfaces, timestamp):
                     raise Exception("Backup tag value mismatch")
 
                 logger.info(f"Backup tag '{tag_key}' chunk {chunk_idx + 1}/{len(sg_chunks)} created and verified for interface {interface_id}.")
-    except ClientError as e:
+    except botocore.exceptions.ClientError as e:
         logger.error(f"AWS API error while creating/verifying backup tag: {str(e)}")
         raise
     except Exception as e:
@@ -552,6 +583,7 @@ def modify_security_groups(ec2_client, instance_id, sg_list, timestamp, mode="re
             logger.info("Skipping tag creation as interface options are specified")
 
         changed_any = False
+        expected_sgs = {}
         for interface in interfaces:
             try:
                 original_sgs = interface["SecurityGroups"]
@@ -588,7 +620,8 @@ def modify_security_groups(ec2_client, instance_id, sg_list, timestamp, mode="re
                         Groups=updated_sgs
                     )
                     changed_any = True
-                except ClientError as e:
+                    expected_sgs[interface["NetworkInterfaceId"]] = updated_sgs
+                except botocore.exceptions.ClientError as e:
                     logger.error(
                         f"Failed to modify security groups for interface "
                         f"{interface['NetworkInterfaceId']}: {str(e)}"
@@ -631,10 +664,10 @@ def modify_security_groups(ec2_client, instance_id, sg_list, timestamp, mode="re
                 else:
                     logger.info(f"Interfaces already have the desired security groups. No changes needed.")
 
-        # Wait a bit for changes to propagate
-        time.sleep(5)
+        # Wait for changes to propagate
+        wait_for_security_groups(ec2_client, instance_id, expected_sgs)
 
-    except ClientError as e:
+    except botocore.exceptions.ClientError as e:
         logger.error(f"AWS API error: {str(e)}")
         raise
     except Exception as e:
@@ -750,6 +783,7 @@ def restore_security_groups(ec2_client, instance_id):
         backup_sg_map = matching_backups
 
         changed_any = False
+        expected_sgs = {}
         for interface in current_interfaces:
             try:
                 interface_id = interface["NetworkInterfaceId"]
@@ -779,7 +813,8 @@ def restore_security_groups(ec2_client, instance_id):
                         Groups=original_sgs
                     )
                     changed_any = True
-                except ClientError as e:
+                    expected_sgs[interface_id] = original_sgs
+                except botocore.exceptions.ClientError as e:
                     logger.error(
                         f"Failed to restore security groups for interface "
                         f"{interface_id}: {str(e)}"
@@ -795,7 +830,7 @@ def restore_security_groups(ec2_client, instance_id):
             sys.exit(EC_GENERIC_ERROR)
 
         # Wait for changes to propagate
-        time.sleep(5)
+        wait_for_security_groups(ec2_client, instance_id, expected_sgs)
 
         # Clean up only the matching backup tags and lastfence tag after successful restore
         try:
@@ -817,11 +852,11 @@ def restore_security_groups(ec2_client, instance_id):
                     Tags=tags_to_delete
                 )
                 logger.info(f"Removed matching backup tags {deleted_tag_keys} and lastfence tag from instance {instance_id}")
-        except ClientError as e:
+        except botocore.exceptions.ClientError as e:
             logger.warning(f"Failed to remove tags: {str(e)}")
             # Continue since the restore operation was successful
 
-    except ClientError as e:
+    except botocore.exceptions.ClientError as e:
         logger.error(f"AWS API error: {str(e)}")
         raise
     except Exception as e:
@@ -835,7 +870,7 @@ def shutdown_instance(ec2_client, instance_id):
         logger.info(f"Initiating shutdown for instance {instance_id}...")
         ec2_client.stop_instances(InstanceIds=[instance_id], Force=True)
         logger.info(f"Shutdown initiated for instance {instance_id}. Status checking will be handled by get_power_status.")
-    except ClientError as e:
+    except botocore.exceptions.ClientError as e:
         logger.error(f"AWS API error during instance shutdown: {str(e)}")
         fail_usage(f"Failed to shutdown instance: {str(e)}")
     except Exception as e:
@@ -1015,7 +1050,7 @@ def restore_security_groups_from_options(ec2_client, instance_id, options):
                         )
                         time.sleep(retry_delay * (attempt + 1))  # Exponential backoff
                         
-                except ClientError as e:
+                except botocore.exceptions.ClientError as e:
                     logger.error(
                         f"Failed to set security groups for interface "
                         f"{interface['NetworkInterfaceId']} (attempt {attempt+1}/{max_retries}): {str(e)}"
@@ -1152,7 +1187,7 @@ def set_power_status(conn, options):
                         shutdown_instance(ec2_client, instance_id)
                         
                 except Exception as e:
-                    if isinstance(e, ClientError):
+                    if isinstance(e, botocore.exceptions.ClientError):
                         logger.error("AWS API error: %s", e)
                         fail_usage(str(e))
                     elif "--ignore-tag-write-failure" in options:
@@ -1,6 +1,6 @@
 #!@PYTHON@ -tt
 
-import sys, re, pexpect
+import sys, re
 import logging
 import atexit
 import xml.etree.ElementTree as ET
@@ -70,17 +70,11 @@ def get_power_status(clients, options):
                 logging.info("Network fenced for " + vmName)
                 return netState
 
-        powerState = "unknown"
         try:
-            vmStatus = azure_fence.get_vm_resource(compute_client, rgName, vmName)
+            powerState = azure_fence.get_vm_power_state(compute_client, rgName, vmName)
         except Exception as e:
             fail_usage("Failed: %s" % e)
 
-        for status in vmStatus.instance_view.statuses:
-            if status.code.startswith("PowerState"):
-                powerState = status.code.split("/")[1]
-                break
-
         vmState = vmstate.get(powerState, "unknown")
         logging.info("Found power state of VM: %s (%s)" % (vmState, powerState))
 
@@ -185,6 +179,15 @@ def define_new_opts():
         "required" : "0",
         "order" : 8
     }
+    all_opt["rest_api"] = {
+        "getopt" : "",
+        "longopt" : "rest-api",
+        "help" : "--rest-api                     Use REST API of Azure Resource Manager instead\n\
+                                  of Azure SDK. Not used with network fencing.",
+        "shortdesc" : "Use REST API of Azure Resource Manager instead of Azure SDK.",
+        "required" : "0",
+        "order" : 9
+    }
 
 # Main agent method
 def main():
@@ -193,7 +196,7 @@ def main():
 
     device_opt = ["login", "no_login", "no_password", "passwd", "port",
 		  "resourceGroup", "tenantId", "subscriptionId",
-		  "network-fencing", "msi", "cloud", "metadata-endpoint"]
+		  "network-fencing", "msi", "cloud", "metadata-endpoint", "rest_api", "cache_ttl"]
 
     atexit.register(atexit_handler)
 
@@ -210,6 +213,9 @@ def main():
     docs["shortdesc"] = "Fence agent for Azure Resource Manager"
     docs["longdesc"] = "fence_azure_arm is a Power Fencing agent for Azure Resource Manager. It uses Azure SDK for Python to connect to Azure.\
 \n.P\n\
+With --rest-api the power operations are done by REST API of Azure Resource Manager without Azure SDK, \
+the access token is cached between runs (see --cache-ttl).\
+\n.P\n\
 For instructions to setup credentials see: https://docs.microsoft.com/en-us/azure/azure-resource-manager/resource-group-create-service-principal-portal\
 \n.P\n\
 Username and password are application ID and authentication key from \"App registrations\".\
@@ -232,7 +238,13 @@ When using network fencing the reboot-action will cause a quick-return once the
     try:
         config = azure_fence.get_azure_config(options)
         options["--resourceGroup"] = config.RGName
-        compute_client = azure_fence.get_azure_compute_client(config)
+        if "--rest-api" in options and "--network-fencing" not in options:
+            compute_client = azure_fence.AzureRestClient(options, config)
+            atexit.register(compute_client.close)
+        else:
+            if "--rest-api" in options:
+                logging.info("Network fencing uses Azure SDK, --rest-api is ignored")
+            compute_client = azure_fence.get_azure_compute_client(config)
         if "--network-fencing" in options:
             network_client = azure_fence.get_azure_network_client(config)
     except ImportError:
@@ -33,10 +33,12 @@
 ##
 #####
 
-import sys, re, pexpect, atexit, logging
+import sys, re, atexit, logging
 sys.path.append("@FENCEAGENTSLIBDIR@")
 from fencing import *
-from fencing import fail, EC_TIMED_OUT, run_command, frun, EC_STATUS
+from fencing import fail, EC_TIMED_OUT, run_command, frun, EC_STATUS, lazy_import
+
+pexpect = lazy_import("pexpect")
 
 def get_power_status(conn, options):
     exp_result = 0
@@ -21,10 +21,6 @@ PORT_ADMIN_STATUS_OID = ".1.3.6.1.2.1.75.1.2.2.1.1"
 ALIASES_OID = ".1.3.6.1.2.1.31.1.1.1.18"
 PORTS_OID = ".1.3.6.1.2.1.2.2.1.2"
 
-### GLOBAL VARIABLES ###
-# OID converted from fc port name (fc(x)/(y))
-PORT_OID = ""
-
 ### FUNCTIONS ###
 
 # Convert cisco port name (fc(x)/(y)) to OID
@@ -39,17 +35,17 @@ def cisco_port2oid(port):
 		fail_usage("Mangled port number: %s"%(port))
 
 def get_power_status(conn, options):
-	(_, status) = conn.get(PORT_OID)
+	(_, status) = conn.get(cisco_port2oid(options["--plug"]))
 	return status == "1" and "on" or "off"
 
 def set_power_status(conn, options):
-	conn.set(PORT_OID, (options["--action"] == "on" and 1 or 2))
+	conn.set(cisco_port2oid(options["--plug"]), (options["--action"] == "on" and 1 or 2))
 
 def get_outlets_status(conn, options):
 	result = {}
 
-	res_fc = conn.walk(PORTS_OID, 30)
-	res_aliases = array_to_dict(conn.walk(ALIASES_OID, 30))
+	res_fc = conn.bulkwalk(PORTS_OID, 30)
+	res_aliases = array_to_dict(conn.bulkwalk(ALIASES_OID, 30))
 
 	fc_re = re.compile(r'^"fc\d+/\d+"$')
 
@@ -66,10 +62,8 @@ def get_outlets_status(conn, options):
 
 # Main agent method
 def main():
-	global PORT_OID
-
 	device_opt = ["fabric_fencing", "ipaddr", "login", "passwd", "no_login", "no_password", \
-		       "port", "snmp_version", "snmp"]
+		       "port", "snmp_version", "snmp", "plug_concurrency"]
 
 	atexit.register(atexit_handler)
 
@@ -83,7 +77,9 @@ which can be used with any Cisco MDS 9000 series with SNMP enabled device."
 	show_docs(options, docs)
 
 	if not options["--action"] in ["list", "monitor"]:
-		PORT_OID = cisco_port2oid(options["--plug"])
+		## fail on a mangled port before any of the plugs is fenced
+		for plug in options["--plug"].split(options["--plug-separator"]):
+			cisco_port2oid(plug)
 
 	# Operate the fencing device
 	result = fence_action(FencingSnmp(options), options, set_power_status, get_power_status, get_outlets_status)
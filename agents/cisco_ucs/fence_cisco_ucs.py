@@ -1,14 +1,18 @@
 #!@PYTHON@ -tt
 
 import sys, re
-import pycurl, io
 import logging
 import atexit
 sys.path.append("@FENCEAGENTSLIBDIR@")
 from fencing import *
 from fencing import fail, EC_STATUS, EC_LOGIN_DENIED, run_delay
+from fencing_cache import CredentialCache, LoginExpired
+from fencing_http import FencingHttp
 
 RE_COOKIE = re.compile(r"<aaaLogin .* outCookie=\"(.*?)\"", re.IGNORECASE)
+RE_REFRESH_PERIOD = re.compile(r" outRefreshPeriod=\"(\d+)\"", re.IGNORECASE)
+## 552 - Authorization required (cookie of the session is not valid)
+RE_SESSION_EXPIRED = re.compile(r" errorCode=\"552\"", re.IGNORECASE)
 RE_STATUS = re.compile(r"<lsPower .*? state=\"(.*?)\"", re.IGNORECASE)
 RE_GET_DN = re.compile(r" dn=\"(.*?)\"", re.IGNORECASE)
 RE_GET_PNDN = re.compile(r" pndn=\"(.*?)\"", re.IGNORECASE)
@@ -21,8 +25,8 @@ options_global = None
 def get_power_status(conn, options):
 	del conn
 
-	res = send_command(options, "<configResolveDn cookie=\"" + options["cookie"] +
-			"\" inHierarchical=\"false\" dn=\"org-root" + options["--suborg"] + "/ls-" +
+	res = send_session_command(options, "<configResolveDn inHierarchical=\"false\" dn=\"org-root" +
+			options["--suborg"] + "/ls-" +
 			options["--plug"] + "\"/>", int(options["--shell-timeout"]))
 
 	result = RE_GET_PNDN.search(res)
@@ -37,8 +41,7 @@ def get_power_status(conn, options):
 		else:
 			fail(EC_STATUS)
 
-	res = send_command(options, "<configResolveDn cookie=\"" + options["cookie"] +
-			"\" inHierarchical=\"false\" dn=\"" + pndn +
+	res = send_session_command(options, "<configResolveDn inHierarchical=\"false\" dn=\"" + pndn +
 			"\"/>", int(options["--shell-timeout"]))
 
 	result = RE_GET_PRESENCE.search(res)
@@ -69,7 +72,7 @@ def set_power_status(conn, options):
 		'off' : "admin-down"
 	}[options["--action"]]
 
-	send_command(options, "<configConfMos cookie=\"" + options["cookie"] + "\" inHierarchical=\"no\">" +
+	send_session_command(options, "<configConfMos inHierarchical=\"no\">" +
 			"<inConfigs><pair key=\"org-root" + options["--suborg"] + "/ls-" + options["--plug"] +
 			"/power\">" + "<lsPower dn=\"org-root/ls-" + options["--plug"] + "/power\" state=\"" +
 			action + "\" status=\"modified\" />" + "</pair></inConfigs></configConfMos>",
@@ -82,8 +85,8 @@ def get_list(conn, options):
 	outlets = {}
 
 	try:
-		res = send_command(options, "<configResolveClass cookie=\"" + options["cookie"] +
-				"\" inHierarchical=\"false\" classId=\"lsServer\"/>", int(options["--shell-timeout"]))
+		res = send_session_command(options, "<configResolveClass inHierarchical=\"false\" classId=\"lsServer\"/>",
+				int(options["--shell-timeout"]))
 
 		lines = res.split("<lsServer ")
 		for i in range(1, len(lines)):
@@ -98,37 +101,41 @@ def get_list(conn, options):
 	return outlets
 
 def send_command(opt, command, timeout):
-	## setup correct URL
-	if "--ssl-secure" in opt or "--ssl-insecure" in opt:
-		url = "https:"
-	else:
-		url = "http:"
+	result = opt["http"].post("nuova", command, headers={"Content-type": "text/xml"}, timeout=timeout).text
 
-	url += "//" + opt["--ip"] + ":" + str(opt["--ipport"]) + "/nuova"
+	logging.debug("%s\n", command)
+	logging.debug("%s\n", result)
 
-	## send command through pycurl
-	conn = pycurl.Curl()
-	web_buffer = io.BytesIO()
-	conn.setopt(pycurl.URL, url.encode("ascii"))
-	conn.setopt(pycurl.HTTPHEADER, ["Content-type: text/xml"])
-	conn.setopt(pycurl.POSTFIELDS, command.encode("ascii"))
-	conn.setopt(pycurl.WRITEFUNCTION, web_buffer.write)
-	conn.setopt(pycurl.TIMEOUT, timeout)
+	return result
 
-	if "--ssl-secure" in opt:
-		conn.setopt(pycurl.SSL_VERIFYPEER, 1)
-		conn.setopt(pycurl.SSL_VERIFYHOST, 2)
-	elif "--ssl-insecure" in opt:
-		conn.setopt(pycurl.SSL_VERIFYPEER, 0)
-		conn.setopt(pycurl.SSL_VERIFYHOST, 0)
+def send_session_command(opt, command, timeout):
+	## command in the logged in session, the cookie is added to its root element
+	def send(cookie):
+		res = send_command(opt, command.replace(" ", " cookie=\"" + cookie + "\" ", 1), timeout)
+		if RE_SESSION_EXPIRED.search(res):
+			raise LoginExpired()
+		return res
 
-	conn.perform()
-	result = web_buffer.getvalue().decode()
+	try:
+		return opt["session"].request(send)
+	except LoginExpired:
+		fail(EC_LOGIN_DENIED)
 
-	logging.debug("%s\n", command)
-	logging.debug("%s\n", result)
+def login(opt):
+	try:
+		res = send_command(opt, "<aaaLogin inName=\"" + opt["--username"] +
+				"\" inPassword=\"" + opt["--password"] + "\" />", int(opt["--login-timeout"]))
+		result = RE_COOKIE.search(res)
+		if result == None:
+			## Cookie is absenting in response
+			fail(EC_LOGIN_DENIED)
+	except Exception as e:
+		logging.error("Failed: {}".format(str(e)))
+		fail(EC_LOGIN_DENIED)
 
-	return result
+	## session expires when it is not refreshed in outRefreshPeriod seconds
+	refresh_period = RE_REFRESH_PERIOD.search(res)
+	return (result.group(1), refresh_period and int(refresh_period.group(1)))
 
 def define_new_opts():
 	all_opt["suborg"] = {
@@ -142,15 +149,20 @@ def define_new_opts():
 
 def logout():
 	### Logout; we do not care about result as we will end in any case
+	## cached session is used by next runs of the agent
+	session = options_global and options_global.get("session")
+	if session is None or session.enabled() or session.credentials is None:
+		return
+
 	try:
-		send_command(options_global, "<aaaLogout inCookie=\"" + options_global["cookie"] + "\" />",
+		send_command(options_global, "<aaaLogout inCookie=\"" + session.credentials + "\" />",
 				int(options_global["--shell-timeout"]))
 	except Exception:
 		pass
 
 def main():
 	global options_global
-	device_opt = ["ipaddr", "login", "passwd", "ssl", "notls", "port", "web", "suborg", "missing_as_off"]
+	device_opt = ["ipaddr", "login", "passwd", "ssl", "notls", "port", "web", "suborg", "missing_as_off", "cache_ttl"]
 
 	atexit.register(atexit_handler)
 	atexit.register(logout)
@@ -167,19 +179,18 @@ used with Cisco UCS to fence machines."
 	show_docs(options_global, docs)
 
 	run_delay(options_global)
-	### Login
-	try:
-		res = send_command(options_global, "<aaaLogin inName=\"" + options_global["--username"] +
-				"\" inPassword=\"" + options_global["--password"] + "\" />", int(options_global["--login-timeout"]))
-		result = RE_COOKIE.search(res)
-		if result == None:
-			## Cookie is absenting in response
-			fail(EC_LOGIN_DENIED)
-	except Exception as e:
-		logging.error("Failed: {}".format(str(e)))
-		fail(EC_LOGIN_DENIED)
 
-	options_global["cookie"] = result.group(1)
+	## setup correct URL
+	if "--ssl-secure" in options_global or "--ssl-insecure" in options_global:
+		url = "https:"
+	else:
+		url = "http:"
+	options_global["http"] = FencingHttp(options_global, url + "//" + options_global["--ip"] + ":" + \
+			str(options_global["--ipport"]) + "/")
+
+	### Login
+	options_global["session"] = CredentialCache(options_global, "fence_cisco_ucs", lambda: login(options_global))
+	options_global["session"].get_credentials()
 
 	##
 	## Modify suborg to format /suborg
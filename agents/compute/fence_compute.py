@@ -9,7 +9,7 @@ import requests.exceptions
 
 sys.path.append("@FENCEAGENTSLIBDIR@")
 from fencing import *
-from fencing import fail_usage, is_executable, run_command, run_delay
+from fencing import fail_usage, is_executable, run_command, run_delay, poll_until
 
 override_status = ""
 
@@ -74,14 +74,15 @@ def get_attrd_status(host, options):
 
 def set_power_status_on(connection, options):
 	# Wait for any evacuations to complete
-	while True:
+	def evacuations_complete():
 		current = get_attrd_status(options["--plug"], options)
 		if current in ["no", ""]:
 			logging.info("Evacuation complete for: %s '%s'" % (options["--plug"], current))
-			break
-		else:
-			logging.info("Waiting for %s to complete evacuations: %s" % (options["--plug"], current))
-			time.sleep(2)
+			return True
+		logging.info("Waiting for %s to complete evacuations: %s" % (options["--plug"], current))
+		return False
+
+	poll_until(evacuations_complete, None, max_interval=2)
 
 	status = get_power_status(connection, options)
 	# Should we do it for 'failed' too?
@@ -134,13 +135,17 @@ def set_power_status_off(connection, options):
 			      "%s: %s" % (e.__class__.__name__, e))
 		# need to wait for nova to update its internal status or we
 		# cannot call host-evacuate
-		while get_power_status(connection, options) not in ["off"]:
-			# Loop forever if need be.
-			#
-			# Some callers (such as Pacemaker) will have a timer
-			# running and kill us if necessary
+		def nova_reports_off():
+			if get_power_status(connection, options) in ["off"]:
+				return True
 			logging.debug("Waiting for nova to update its internal state for %s" % options["--plug"])
-			time.sleep(1)
+			return False
+
+		# Loop forever if need be.
+		#
+		# Some callers (such as Pacemaker) will have a timer
+		# running and kill us if necessary
+		poll_until(nova_reports_off, None, max_interval=1)
 
 	set_attrd_status(options["--plug"], "yes", options)
 
@@ -446,11 +451,11 @@ def set_multi_power_fn(connection, options, set_power_fn, get_power_fn, retry_at
 		set_power_fn(connection, options)
 		time.sleep(int(options["--power-wait"]))
 
-		for _ in range(int(options["--power-timeout"])):
-			if get_power_fn(connection, options) != options["--action"]:
-				time.sleep(1)
-			else:
-				return True
+		# --power-timeout=0 is used to skip waiting for a node that is not safe to unfence
+		if int(options["--power-timeout"]) > 0 and \
+				poll_until(lambda: get_power_fn(connection, options) == options["--action"],
+					int(options["--power-timeout"]), max_interval=1):
+			return True
 	return False
 
 def main():
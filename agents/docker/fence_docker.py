@@ -2,13 +2,11 @@
 
 import atexit
 import sys
-import io
 import logging
-import pycurl
-import json
 
 sys.path.append("@FENCEAGENTSLIBDIR@")
 from fencing import fail_usage, all_opt, fence_action, atexit_handler, check_input, process_input, show_docs, run_delay
+from fencing_http import FencingHttp, HttpError
 
 def get_power_status(conn, options):
 	del conn
@@ -43,46 +41,16 @@ def get_list(conn, options):
 
 
 def send_cmd(options, cmd, post = False):
-	url = "http%s://%s:%s/v%s/%s" % ("s" if "--ssl-secure" in options or "--ssl-insecure" in options else "", options["--ip"], options["--ipport"], options["--api-version"], cmd)
-	conn = pycurl.Curl()
-	output_buffer = io.BytesIO()
-	if logging.getLogger().getEffectiveLevel() < logging.WARNING:
-		conn.setopt(pycurl.VERBOSE, True)
-	if "--unix-socket" in options:
-		conn.setopt(pycurl.UNIX_SOCKET_PATH, options["--unix-socket"])
-	conn.setopt(pycurl.HTTPGET, 1)
-	conn.setopt(pycurl.URL, url.encode("ascii"))
-	if post:
-		conn.setopt(pycurl.POST, 1)
-		conn.setopt(pycurl.POSTFIELDSIZE, 0)
-	conn.setopt(pycurl.WRITEFUNCTION, output_buffer.write)
-	conn.setopt(pycurl.TIMEOUT, int(options["--shell-timeout"]))
-
-	if "--ssl-secure" in options:
-		if not (set(("--tlscert", "--tlskey", "--tlscacert")) <= set(options)):
-			fail_usage("Failed. If --ssl option is used, You have to also \
-specify: --tlscert, --tlskey and --tlscacert")
-		conn.setopt(pycurl.SSL_VERIFYPEER, 1)
-		conn.setopt(pycurl.SSLCERT, options["--tlscert"])
-		conn.setopt(pycurl.SSLKEY, options["--tlskey"])
-		conn.setopt(pycurl.CAINFO, options["--tlscacert"])
-	elif "--ssl-insecure" in options:
-		conn.setopt(pycurl.SSL_VERIFYPEER, 0)
-		conn.setopt(pycurl.SSL_VERIFYHOST, 0)
-
-	logging.debug("URL: " + url)
-
+	result = None
 	try:
-		conn.perform()
-		result = output_buffer.getvalue().decode()
-		return_code = conn.getinfo(pycurl.RESPONSE_CODE)
-
-		logging.debug("RESULT [" + str(return_code) + \
-			"]: " + result)
-		conn.close()
-		if return_code == 200:
-			return json.loads(result)
-	except pycurl.error:
+		if post:
+			response = options["http"].post(cmd, "")
+		else:
+			response = options["http"].get(cmd)
+		result = response.text
+		if response.code == 200:
+			return response.json()
+	except HttpError:
 		logging.error("Connection failed")
 	except:
 		if result is not None:
@@ -178,6 +146,17 @@ http://docs.docker.com/examples/https/)."
 
 	run_delay(options)
 
+	if "--ssl-secure" in options and \
+			not (set(("--tlscert", "--tlskey", "--tlscacert")) <= set(options)):
+		fail_usage("Failed. If --ssl option is used, You have to also \
+specify: --tlscert, --tlskey and --tlscacert")
+
+	options["http"] = FencingHttp(options, "http%s://%s:%s/v%s/" % \
+			("s" if "--ssl-secure" in options or "--ssl-insecure" in options else "",
+			options["--ip"], options["--ipport"], options["--api-version"]),
+			cert=options.get("--tlscert"), key=options.get("--tlskey"), cacert=options.get("--tlscacert"))
+	atexit.register(options["http"].close)
+
 	result = fence_action(None, options, set_power_status, get_power_status, get_list, reboot_cycle)
 
 	sys.exit(result)
@@ -13,6 +13,7 @@ sys.path.append("@FENCEAGENTSLIBDIR@")
 from fencing import *
 from fencing import fail_usage
 from fencing_snmp import FencingSnmp
+from fencing_cache import FencingCache
 
 ### CONSTANTS ###
 # oid defining fence device
@@ -27,6 +28,9 @@ port_id = None
 # Switch ID
 switch_id = None
 
+# Cache of device type and port indexes - see FencingCache
+cache = None
+
 # Did we issue a set before get (to adjust OID with Switched ePDU)
 after_set = False
 
@@ -69,51 +73,63 @@ def eaton_set_device(conn):
 				'.1.3.6.1.4.1.20677.2':EatonSwitchedePDU}
 
 	# First resolve type of Eaton
-	eaton_type = conn.walk(OID_SYS_OBJECT_ID)
+	eaton_type = cache.get("sysObjectID")
 
-	if not ((len(eaton_type) == 1) and (eaton_type[0][1] in agents_dir)):
-		eaton_type = [[None, None]]
+	if eaton_type is None:
+		res = conn.walk(OID_SYS_OBJECT_ID)
+		eaton_type = (len(res) == 1) and res[0][1] or None
+		if eaton_type in agents_dir:
+			cache.set("sysObjectID", eaton_type)
 
-	device = agents_dir[eaton_type[0][1]]
+	device = agents_dir[eaton_type]
 
 	logging.debug("Trying %s"%(device.ident_str))
 
-def eaton_resolv_port_id(conn, options):
-	global port_id, switch_id
+def eaton_table_plug_id(oid):
+	# Return (switch_id, port_id) from oid of outlet table
+	t = oid.split('.')
+	if device.has_switches:
+		return (int(t[len(t)-3]), int(t[len(t)-1]))
+	elif device.ident_str == "Eaton Switched ePDU":
+		return (None, int(t[len(t)-3]))
+	else:
+		return (None, int(t[len(t)-1]))
 
+def eaton_plug_id(conn, options, plug):
+	# Return (switch_id, port_id) of plug given by number (decreased by 1 in main) or name
 	if device == None:
 		eaton_set_device(conn)
 
-	# Restore the increment, that was removed in main for ePDU Managed
-	if device.ident_str == "Eaton Switched ePDU":
-		options["--plug"] = str(int(options["--plug"]) + 1)
+	if plug.isdigit() and ((not device.has_switches) or (options["--switch"].isdigit())):
+		# Restore the increment, that was removed in main for ePDU Managed
+		port = int(plug)
+		if device.ident_str == "Eaton Switched ePDU":
+			port += 1
+		return ((device.has_switches) and int(options["--switch"]) or None, port)
 
-	# Now we resolv port_id/switch_id
-	if options["--plug"].isdigit() and ((not device.has_switches) or (options["--switch"].isdigit())):
-		port_id = int(options["--plug"])
+	# Name of port is verified by one GET instead of walk of outlet table
+	cached = cache.get("port:" + plug)
+	if cached is not None:
+		res = conn.get(cached, stop=False)
+		if res is not None and res[1].strip('"') == plug:
+			return eaton_table_plug_id(cached)
+		cache.invalidate()
 
-		if device.has_switches:
-			switch_id = int(options["--switch"])
-	else:
-		table = conn.walk(device.outlet_table_oid, 30)
-
-		for x in table:
-			if x[1].strip('"') == options["--plug"]:
-				t = x[0].split('.')
-				if device.has_switches:
-					port_id = int(t[len(t)-1])
-					switch_id = int(t[len(t)-3])
-				else:
-					if device.ident_str == "Eaton Switched ePDU":
-						port_id = int(t[len(t)-3])
-					else:
-						port_id = int(t[len(t)-1])
+	table = conn.bulkwalk(device.outlet_table_oid, 30)
 
-	if port_id == None:
-		# Restore index offset, to provide a valid error output on Managed ePDU
-		if device.ident_str != "Eaton Switched ePDU":
-			options["--plug"] = str(int(options["--plug"]) + 1)
-		fail_usage("Can't find port with name %s!"%(options["--plug"]))
+	for x in table:
+		if x[1].strip('"') == plug:
+			cache.set("port:" + plug, x[0])
+			return eaton_table_plug_id(x[0])
+
+	cache.invalidate()
+	# Restore index offset, to provide a valid error output
+	fail_usage("Can't find port with name %s!"%(plug.isdigit() and str(int(plug) + 1) or plug))
+
+def eaton_resolv_port_id(conn, options):
+	global port_id, switch_id
+
+	(switch_id, port_id) = eaton_plug_id(conn, options, options["--plug"])
 
 def get_power_status(conn, options):
 	global port_id, after_set
@@ -156,6 +172,32 @@ def set_power_status(conn, options):
 	conn.set(oid, (options["--action"] == "on" and device.turn_on or device.turn_off))
 
 
+def plug_oid(oid, plug_id):
+	(switch, port) = plug_id
+	return ((device.has_switches) and oid%(switch, port) or oid%(port))
+
+# Status of all plugs in one request
+def get_plugs_power_status(conn, options):
+	plug_ids = [eaton_plug_id(conn, options, plug) for plug in options["--plugs"]]
+
+	states = {str(device.state_on): "on", str(device.state_off): "off"}
+	try:
+		res = conn.get_many([plug_oid(device.status_oid, plug_id) for plug_id in plug_ids])
+		return [states.get(status) for (oid, status) in res]
+	except Exception:
+		return [None] * len(plug_ids)
+
+# Turn all plugs on/off in one request
+def set_plugs_power_status(conn, options):
+	plug_ids = [eaton_plug_id(conn, options, plug) for plug in options["--plugs"]]
+
+	# Controls start at #2 on Switched ePDU, since #1 is the global command
+	if device.ident_str == "Eaton Switched ePDU":
+		plug_ids = [(switch, port + 1) for (switch, port) in plug_ids]
+
+	value = options["--action"] == "on" and device.turn_on or device.turn_off
+	conn.set_many([(plug_oid(device.control_oid, plug_id), value) for plug_id in plug_ids])
+
 def get_outlets_status(conn, options):
 	outletCount = 0
 	result = {}
@@ -163,7 +205,7 @@ def get_outlets_status(conn, options):
 	if device == None:
 		eaton_set_device(conn)
 
-	res_ports = conn.walk(device.outlet_table_oid, 30)
+	res_ports = conn.bulkwalk(device.outlet_table_oid, 30)
 
 	for x in res_ports:
 		outletCount += 1
@@ -209,8 +251,9 @@ def main():
 	# Plug indexing start from zero on ePDU Managed, so we substract '1' from
 	# the user's given plug number.
 	# For Switched ePDU, we will add this back again later.
-	if "--plug" in options and options["--plug"].isdigit():
-		options["--plug"] = str(int(options["--plug"]) - 1)
+	if "--plug" in options:
+		options["--plug"] = options["--plug-separator"].join([plug.isdigit() and str(int(plug) - 1) or plug \
+				for plug in options["--plug"].split(options["--plug-separator"])])
 
 	docs = {}
 	docs["shortdesc"] = "Fence agent for Eaton over SNMP"
@@ -221,8 +264,12 @@ SNMP v1 and v3 with all combinations of  authenticity/privacy settings."
 	docs["vendorurl"] = "http://powerquality.eaton.com"
 	show_docs(options, docs)
 
+	global cache
+	cache = FencingCache(options, "fence_eaton_snmp")
+
 	# Operate the fencing device
-	result = fence_action(FencingSnmp(options), options, set_power_status, get_power_status, get_outlets_status)
+	result = fence_action(FencingSnmp(options), options, set_power_status, get_power_status, get_outlets_status,
+			get_plugs_power_fn=get_plugs_power_status, set_plugs_power_fn=set_plugs_power_status)
 
 	sys.exit(result)
 if __name__ == "__main__":
@@ -20,15 +20,16 @@
 # <http://www.gnu.org/licenses/>.
 
 import sys
-import time
 import atexit
 import logging
 import requests
 sys.path.append("@FENCEAGENTSLIBDIR@")
 from fencing import *
-from fencing import run_delay, fail_usage, fail, EC_TIMED_OUT
+from fencing import run_delay, fail_usage, fail, poll_until, EC_TIMED_OUT
 
 API_BASE = "https://api.ukfast.io/ecloud"
+# seconds to retry an action refused with 409 while a previous task still runs
+CONFLICT_TIMEOUT = 12
 API_MONITOR = API_BASE + "/ping"
 API_VPC_INSTANCE_DATA = API_BASE + "/v2/instances/:ID"
 API_VPC_POWER_ON = API_BASE + "/v2/instances/:ID/power-on"
@@ -51,28 +52,25 @@ def set_power_fn(conn, options):
 
     logging.info("executing '{}' action on '{}'".format(action, plug))
 
-    retries = 0
-    while True:
+    resp = None
+
+    def put_action():
+        nonlocal resp
         resp = requests.put(url, headers=hdrs)
-        if resp.status_code == 409:
-            # If we attempt to power the instance back on too soon after powering it off,
-            # e.g. during a reboot, the API will return a 409 because while the power status
-            # has changed, the task is still executing. Retry the action until we exceed
-            # retries or get a different status code.
-            if retries >= 6:
-                logging.error("timed out trying to execute '{}' action after repeated 409 codes from API", action)
-                fail(EC_TIMED_OUT)
-
-            time.sleep(2)
-            retries += 1
-            continue
-
-        if resp.status_code != 202:
-            logging.error("unexpected status code '{}' from endpoint '{}': {}".format(
-                resp.status_code, url, resp.text
-            ))
-            
-        break
+        # If we attempt to power the instance back on too soon after powering it off,
+        # e.g. during a reboot, the API will return a 409 because while the power status
+        # has changed, the task is still executing. Retry the action until we exceed
+        # the timeout or get a different status code.
+        return resp.status_code != 409
+
+    if not poll_until(put_action, CONFLICT_TIMEOUT, max_interval=2):
+        logging.error("timed out trying to execute '{}' action after repeated 409 codes from API".format(action))
+        fail(EC_TIMED_OUT)
+
+    if resp.status_code != 202:
+        logging.error("unexpected status code '{}' from endpoint '{}': {}".format(
+            resp.status_code, url, resp.text
+        ))
 
 
 def get_power_fn(conn, options):
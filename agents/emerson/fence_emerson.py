@@ -29,7 +29,7 @@ def set_power_status(conn, options):
 
 def get_outlets_status(conn, _):
 	result = {}
-	res_outlet = conn.walk(STATUSES_OID, 30)
+	res_outlet = conn.bulkwalk(STATUSES_OID, 30)
 
 	for outlet_info in res_outlet:
 		port_num = ".".join(outlet_info[0].split('.')[-3:])
@@ -40,7 +40,7 @@ def get_outlets_status(conn, _):
 
 def main():
 	device_opt = ["ipaddr", "login", "passwd", "no_login", "no_password", \
-		       "port", "snmp_version", "snmp"]
+		       "port", "snmp_version", "snmp", "plug_concurrency"]
 
 	atexit.register(atexit_handler)
 
@@ -11,11 +11,13 @@
 import atexit
 import logging
 import json
+import math
 import re
 import os
 import socket
 import sys
 import time
+import threading
 
 from ssl import SSLError
 
@@ -30,14 +32,12 @@ else:
 sys.path.append("@FENCEAGENTSLIBDIR@")
 
 from fencing import fail_usage, run_delay, all_opt, atexit_handler, check_input, process_input, show_docs, fence_action, run_command
+from fencing import poll_until, lazy_import
+from fencing_cache import FencingCache
 try:
-  import httplib2
-  import googleapiclient.discovery
-  import socks
-  try:
-    from google.oauth2.credentials import Credentials as GoogleCredentials
-  except:
-    from oauth2client.client import GoogleCredentials
+  httplib2 = lazy_import("httplib2")
+  googleapiclient = lazy_import("googleapiclient.discovery")
+  socks = lazy_import("socks")
 except:
   pass
 
@@ -50,6 +50,16 @@ USER_AGENT = 'sap-core-eng/fencegce/%s/%s/ACTION/%s'
 METADATA_SERVER = 'http://metadata.google.internal/computeMetadata/v1/'
 METADATA_HEADERS = {'Metadata-Flavor': 'Google'}
 INSTANCE_LINK = 'https://www.googleapis.com/compute/v1/projects/{}/zones/{}/instances/{}'
+DISCOVERY_URI = 'https://www.googleapis.com/discovery/v1/apis/compute/v1/rest'
+# Resources of the Compute API used by the agent, the cached discovery document
+# contains only these
+DISCOVERY_RESOURCES = ['instances', 'zoneOperations']
+# Number of zones listed at once
+ZONE_WORKERS = 10
+# Longest wait of one zoneOperations().wait request, and how much shorter than
+# the socket timeout it has to be
+OPERATION_WAIT = 60
+OPERATION_WAIT_MARGIN = 5
 
 def run_on_fail(options):
 	if "--runonfail" in options:
@@ -107,7 +117,18 @@ def replace_api_uri(options, http_request):
 		break
 	return http_request
 
-def retry_api_execute(options, http_request):
+def is_not_found(err):
+	return getattr(getattr(err, "resp", None), "status", None) == 404
+
+def thread_http(options):
+	# httplib2.Http is not thread safe, so every thread sends its requests by
+	# its own connection
+	local = options["threadhttp"]
+	if not hasattr(local, "http"):
+		local.http = options["newhttp"]()
+	return local.http
+
+def retry_api_execute(options, http_request, http=None):
 	replaced_http_request = replace_api_uri(options, http_request)
 	action = ACTION_IDS[options["--action"]] if options["--action"] in ACTION_IDS else 0
 	try:
@@ -128,8 +149,10 @@ def retry_api_execute(options, http_request):
 		if retry > 0:
 			time.sleep(retry_sleep)
 		try:
-			return replaced_http_request.execute()
+			return replaced_http_request.execute(http=http)
 		except Exception as err:
+			if is_not_found(err):
+				raise
 			current_err = err
 			logging.warning("Could not execute api call to: %s, retry: %s, "
 				"err: %s" % (replaced_http_request.uri, retry, str(err)))
@@ -151,23 +174,44 @@ def get_nodes_list(conn, options):
 	plug = options["--plug"] if "--plug" in options else ""
 	zones = options["--zone"] if "--zone" in options else ""
 	filter = "name="+plug if plug != "" else ""
-	max_results = 1 if options.get("--action") == "monitor" else 500
+	monitor = options.get("--action") == "monitor"
+	max_results = 1 if monitor else 500
 	if not zones:
 		zones = get_zone(conn, options, plug) if "--plugzonemap" not in options else options["--plugzonemap"][plug]
-	try:
-		for zone in zones.split(","):
-			request = conn.instances().list(
-				project=options["--project"],
-				zone=zone,
-				filter=filter,
-				maxResults=max_results)
+
+	def list_zone(zone, http=None):
+		instances = []
+		request = conn.instances().list(
+			project=options["--project"],
+			zone=zone,
+			filter=filter,
+			maxResults=max_results)
 		while request is not None:
-			instanceList = retry_api_execute(options, request)
+			instanceList = retry_api_execute(options, request, http)
 			if "items" not in instanceList:
 				break
-			for instance in instanceList["items"]:
-				result[instance["id"]] = (instance["name"], translate_status(instance["status"]))
+			instances.extend(instanceList["items"])
+			# monitor checks only that the API works, it does not need all pages
+			if monitor:
+				break
 			request = conn.instances().list_next(previous_request=request, previous_response=instanceList)
+		return instances
+
+	zones = zones.split(",")
+	try:
+		if len(zones) == 1:
+			zone_instances = [list_zone(zones[0])]
+			if not zone_instances[0] and plug in options.get("zonelookups", []):
+				# instance is not in its cached zone anymore
+				zone_instances = [list_zone(get_zone(conn, options, plug, refresh=True))]
+		else:
+			import concurrent.futures
+			with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(zones), ZONE_WORKERS)) as executor:
+				zone_instances = list(executor.map(lambda zone: list_zone(zone, thread_http(options)), zones))
+
+		for instances in zone_instances:
+			for instance in instances:
+				result[instance["id"]] = (instance["name"], translate_status(instance["status"]))
 	except Exception as err:
 		fail_fence_agent(options, "Failed: get_nodes_list: {}".format(str(err)))
 
@@ -186,7 +230,14 @@ def get_power_status(conn, options):
 	# If zone is not listed for an entry we attempt to get it automatically
 	instance = options["--plug"]
 	zone = get_zone(conn, options, instance) if "--plugzonemap" not in options else options["--plugzonemap"][instance]
-	instance_status = get_instance_power_status(conn, options, instance, zone)
+	instance_status = get_instance_power_status(conn, options, instance, zone,
+			stop=instance not in options.get("zonelookups", []))
+	if instance_status is None:
+		# instance is not in its cached zone anymore
+		zone = get_zone(conn, options, instance, refresh=True)
+		if "--plugzonemap" in options:
+			options["--plugzonemap"][instance] = zone
+		instance_status = get_instance_power_status(conn, options, instance, zone)
 	# If any of the instances do not match the intended status we return the
 	# the opposite status so that the fence agent can change it.
 	if instance_status != options.get("--action"):
@@ -195,13 +246,16 @@ def get_power_status(conn, options):
 	return options.get("--action")
 
 
-def get_instance_power_status(conn, options, instance, zone):
+def get_instance_power_status(conn, options, instance, zone, stop=True):
+	# with stop=False None is returned when the instance is not in zone
 	try:
 		instance = retry_api_execute(
 				options,
 				conn.instances().get(project=options["--project"], zone=zone, instance=instance))
 		return translate_status(instance["status"])
 	except Exception as err:
+		if not stop and is_not_found(err):
+			return None
 		fail_fence_agent(options, "Failed: get_instance_power_status: {}".format(str(err)))
 
 
@@ -223,35 +277,69 @@ def check_for_existing_operation(conn, options, instance, zone, operation_type):
 		return result["items"][0]
 
 
+def wait_operation_done(conn, options, zone, operation, timeout):
+	# zoneOperations().wait returns when the operation is done, or after its
+	# deadline (at most 2 minutes) when it is not. It is sent again until the
+	# timeout, every request waits at most for the time left and shorter than
+	# the socket timeout (--apitimeout). Returns None in case of timeout.
+	deadline = time.monotonic() + timeout if timeout is not None else None
+	max_wait = max(int(options.get("--apitimeout") or OPERATION_WAIT) - OPERATION_WAIT_MARGIN, 1)
+
+	while True:
+		wait = min(max_wait, OPERATION_WAIT)
+		if deadline is not None:
+			time_left = deadline - time.monotonic()
+			if time_left <= 0:
+				return None
+			wait = min(wait, int(math.ceil(time_left)))
+
+		request = conn.zoneOperations().wait(
+			project=options["--project"],
+			zone=zone,
+			operation=operation['name'])
+		request.headers["X-Server-Timeout"] = str(wait)
+		result = retry_api_execute(options, request)
+		if result['status'] == 'DONE':
+			return result
+
+
 def wait_for_operation(conn, options, zone, operation):
 	if 'name' not in operation:
 		logging.warning('Cannot wait for operation to complete, the'
 		' requested operation will continue asynchronously')
 		return False
 
-	wait_time = 0
 	project = options["--project"]
-	while True:
-		result = retry_api_execute(options, conn.zoneOperations().get(
-			project=project,
-			zone=zone,
-			operation=operation['name']))
-		if result['status'] == 'DONE':
-			if 'error' in result:
-				raise_fence_agent(options, result['error'])
-			return True
 
-		if "--errortimeout" in options and wait_time > int(options["--errortimeout"]):
-			raise_fence_agent(options, "Operation did not complete before the timeout.")
+	error_timeout = int(options["--errortimeout"]) if "--errortimeout" in options else None
+	warn_timeout = int(options["--warntimeout"]) if "--warntimeout" in options else None
+	timeouts = [t for t in [error_timeout, warn_timeout] if t is not None]
+	timeout = min(timeouts) if timeouts else None
+
+	if "--baremetalsolution" in options:
+		def operation_done():
+			result = retry_api_execute(options, conn.zoneOperations().get(
+				project=project,
+				zone=zone,
+				operation=operation['name']))
+			return result if result['status'] == 'DONE' else None
+
+		result = poll_until(operation_done, timeout, max_interval=1)
+	else:
+		result = wait_operation_done(conn, options, zone, operation, timeout)
 
-		if "--warntimeout" in options and wait_time > int(options["--warntimeout"]):
-			logging.warning("Operation did not complete before the timeout.")
-			if "--runonwarn" in options:
-				run_command(options, options["--runonwarn"])
-			return False
+	if result:
+		if 'error' in result:
+			raise_fence_agent(options, result['error'])
+		return True
 
-		wait_time = wait_time + 1
-		time.sleep(1)
+	if error_timeout is not None and (warn_timeout is None or error_timeout <= warn_timeout):
+		raise_fence_agent(options, "Operation did not complete before the timeout.")
+
+	logging.warning("Operation did not complete before the timeout.")
+	if "--runonwarn" in options:
+		run_command(options, options["--runonwarn"])
+	return False
 
 
 def set_power_status(conn, options):
@@ -322,9 +410,22 @@ def power_cycle_instance(conn, options, instance, zone):
 		raise err
 
 
-def get_zone(conn, options, instance):
+def get_zone(conn, options, instance, refresh=False):
 	logging.debug("get_zone");
 	project = options['--project']
+	options.setdefault("zonelookups", set()).add(instance)
+
+	# Zones of instances are kept in the cache (--cache-ttl), refresh=True looks
+	# up the zone again when the instance is not in the cached one
+	if "zonecache" not in options:
+		options["zonecache"] = FencingCache(options, "gce-zones", key_values=[project])
+	if refresh:
+		options["zonecache"].invalidate("zone:" + instance)
+	else:
+		zone = options["zonecache"].get("zone:" + instance)
+		if zone is not None:
+			return zone
+
 	fl = 'name="%s"' % instance
 	request = replace_api_uri(options, conn.instances().aggregatedList(project=project, filter=fl))
 	while request is not None:
@@ -333,6 +434,7 @@ def get_zone(conn, options, instance):
 		for zone in zones.values():
 			for inst in zone.get('instances', []):
 				if inst['name'] == instance:
+					options["zonecache"].set("zone:" + instance, inst['zone'].split("/")[-1])
 					return inst['zone'].split("/")[-1]
 		request = replace_api_uri(options, conn.instances().aggregatedList_next(
 				previous_request=request, previous_response=response))
@@ -363,6 +465,77 @@ def get_metadata(metadata_key, params=None, timeout=None):
 	return request_opener.open(request, timeout=timeout * 1.1).read().decode("utf-8")
 
 
+def fetch_discovery_document(http):
+	document = None
+	try:
+		# document bundled with googleapiclient 2.0 and later
+		from googleapiclient.discovery_cache import get_static_doc
+		document = get_static_doc('compute', 'v1')
+	except ImportError:
+		pass
+
+	if document is None:
+		(response, document) = (http or httplib2.Http()).request(DISCOVERY_URI)
+		if response.status >= 400:
+			raise Exception("Unable to get discovery document: HTTP {}".format(response.status))
+
+	return json.loads(document)
+
+def prune_discovery_document(document):
+	# Keep only DISCOVERY_RESOURCES and the schemas they refer to, which is a
+	# small part of the whole Compute API
+	def refs(value):
+		if isinstance(value, dict):
+			for (key, item) in value.items():
+				if key == '$ref':
+					yield item
+				else:
+					for ref in refs(item):
+						yield ref
+		elif isinstance(value, list):
+			for item in value:
+				for ref in refs(item):
+					yield ref
+
+	document = dict(document)
+	document['resources'] = dict((name, document['resources'][name]) for name in DISCOVERY_RESOURCES)
+
+	schemas = {}
+	pending = list(refs(document['resources']))
+	while pending:
+		name = pending.pop()
+		if name not in schemas and name in document.get('schemas', {}):
+			schemas[name] = document['schemas'][name]
+			pending.extend(refs(schemas[name]))
+	document['schemas'] = schemas
+
+	return document
+
+def build_compute(options, http=None, credentials=None):
+	# The discovery document is cached (--cache-ttl) for the installed version of
+	# googleapiclient, so it is not fetched or parsed by every run
+	cache = FencingCache(options, "gce-discovery", key_values=[getattr(googleapiclient, '__version__', None)])
+	if not cache.enabled():
+		if http:
+			return googleapiclient.discovery.build('compute', 'v1', http=http, cache_discovery=False)
+		return googleapiclient.discovery.build('compute', 'v1', credentials=credentials, cache_discovery=False)
+
+	if "--refresh-discovery" in options:
+		cache.invalidate("compute")
+
+	document = cache.get("compute")
+	if document is not None:
+		try:
+			return googleapiclient.discovery.build_from_document(document, http=http, credentials=credentials)
+		except Exception as err:
+			logging.debug("Cached discovery document is not valid: %s", str(err))
+			cache.invalidate("compute")
+
+	document = prune_discovery_document(fetch_discovery_document(http))
+	logging.debug("Using discovery document of revision %s", document.get('revision'))
+	cache.set("compute", document)
+	return googleapiclient.discovery.build_from_document(document, http=http, credentials=credentials)
+
 def define_new_opts():
 	all_opt["zone"] = {
 		"getopt" : ":",
@@ -502,6 +675,14 @@ def define_new_opts():
 		"required" : "0",
 		"order" : 17
 	}
+	all_opt["refresh_discovery"] = {
+		"getopt" : "",
+		"longopt" : "refresh-discovery",
+		"help" : "--refresh-discovery            Get the discovery document of Compute API again",
+		"shortdesc" : "Discard the cached discovery document of Compute API and get it again.",
+		"required" : "0",
+		"order" : 18
+	}
 
 
 def main():
@@ -510,7 +691,7 @@ def main():
 	device_opt = ["port", "no_password", "zone", "project", "stackdriver-logging",
 		"method", "baremetalsolution", "apitimeout", "retries", "retrysleep",
 		"serviceaccount", "plugzonemap", "proxyhost", "proxyport", "earlyexit",
-		"warntimeout", "errortimeout", "runonwarn", "runonfail"]
+		"warntimeout", "errortimeout", "runonwarn", "runonfail", "refresh_discovery", "cache_ttl"]
 
 	atexit.register(atexit_handler)
 
@@ -576,6 +757,10 @@ def main():
 				from googleapiclient import _auth
 				credentials = _auth.default_credentials();
 			except:
+				try:
+					from google.oauth2.credentials import Credentials as GoogleCredentials
+				except:
+					from oauth2client.client import GoogleCredentials
 				credentials = GoogleCredentials.get_application_default()
 			logging.debug("using application default credentials")
 
@@ -585,11 +770,15 @@ def main():
 				proxy_host=options.get("--proxyhost"),
 				proxy_port=int(options.get("--proxyport")))
 			http = credentials.authorize(httplib2.Http(proxy_info=proxy_info))
-			conn = googleapiclient.discovery.build(
-				'compute', 'v1', http=http, cache_discovery=False)
+			conn = build_compute(options, http=http)
+			options["newhttp"] = lambda: credentials.authorize(httplib2.Http(proxy_info=proxy_info))
 		else:
-			conn = googleapiclient.discovery.build(
-				'compute', 'v1', credentials=credentials, cache_discovery=False)
+			conn = build_compute(options, credentials=credentials)
+			def new_http():
+				from googleapiclient import _auth
+				return _auth.authorized_http(credentials)
+			options["newhttp"] = new_http
+		options["threadhttp"] = threading.local()
 	except SSLError as err:
 		fail_fence_agent(options, "Failed: Create GCE compute v1 connection: {}\n\nThis might be caused by old versions of httplib2.".format(str(err)))
 	except Exception as err:
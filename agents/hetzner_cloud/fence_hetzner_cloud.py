@@ -1,13 +1,15 @@
 #!@PYTHON@ -tt
 
 import sys
-import pycurl, io, json
+import io, json
 import logging
 import atexit
 
 sys.path.append("@FENCEAGENTSLIBDIR@")
 from fencing import *
-from fencing import fail, run_delay, EC_LOGIN_DENIED, EC_STATUS
+from fencing import fail, run_delay, EC_LOGIN_DENIED, EC_STATUS, lazy_import
+
+pycurl = lazy_import("pycurl")
 
 if sys.version_info[0] > 2:
     import urllib.parse as urllib
@@ -8,7 +8,6 @@
 #####
 
 import sys, re
-import pexpect
 import atexit
 sys.path.append("@FENCEAGENTSLIBDIR@")
 from fencing import *
@@ -1,14 +1,15 @@
 #!@PYTHON@ -tt
 
 import sys
-import pycurl
 import io
 import json
 import logging
 import atexit
 
 sys.path.append("@FENCEAGENTSLIBDIR@")
-from fencing import all_opt, atexit_handler, check_input, process_input, show_docs, fence_action, fail, run_delay, EC_STATUS
+from fencing import all_opt, atexit_handler, check_input, process_input, show_docs, fence_action, fail, run_delay, EC_STATUS, lazy_import
+
+pycurl = lazy_import("pycurl")
 
 state = {
 	 "ACTIVE": "on",
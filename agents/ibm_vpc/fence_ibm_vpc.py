@@ -1,13 +1,15 @@
 #!@PYTHON@ -tt
 
 import sys
-import pycurl, io, json
+import io, json
 import logging
 import atexit
-import hashlib
 sys.path.append("@FENCEAGENTSLIBDIR@")
 from fencing import *
-from fencing import fail, run_delay, EC_BAD_ARGS, EC_LOGIN_DENIED, EC_STATUS, EC_GENERIC_ERROR
+from fencing import fail, run_delay, EC_BAD_ARGS, EC_LOGIN_DENIED, EC_STATUS, lazy_import
+from fencing_cache import CredentialCache, LoginExpired
+
+pycurl = lazy_import("pycurl")
 
 state = {
 	 "running": "on",
@@ -66,54 +68,20 @@ def set_power_status(conn, options):
 		fail(EC_STATUS)
 
 def get_bearer_token(conn, options):
-	import os, errno
-
-	try:
-		# FIPS requires usedforsecurity=False and might not be
-		# available on all distros: https://bugs.python.org/issue9216
-		hash = hashlib.sha256(options["--apikey"].encode("utf-8"), usedforsecurity=False).hexdigest()
-	except (AttributeError, TypeError):
-		hash = hashlib.sha256(options["--apikey"].encode("utf-8")).hexdigest()
-	file_path = options["--token-file"].replace("[hash]", hash)
-	token = None
-
-	if not os.path.isdir(os.path.dirname(file_path)):
-		os.makedirs(os.path.dirname(file_path))
-
-	# For security, remove file with potentially elevated mode
 	try:
-		os.remove(file_path)
-	except OSError:
-		pass
+		conn.setopt(pycurl.HTTPHEADER, [
+			"Content-Type: application/x-www-form-urlencoded",
+			"User-Agent: curl",
+		])
+		res = _send_command(conn, options, "https://iam.cloud.ibm.com/identity/token", "POST", "grant_type=urn:ibm:params:oauth:grant-type:apikey&apikey={}".format(options["--apikey"]))
+		token = res["access_token"]
+	except Exception as e:
+		logging.error("Failed: Unable to authenticate: {}".format(e))
+		fail(EC_LOGIN_DENIED)
+	if len(token) < 1:
+		fail(EC_LOGIN_DENIED)
 
-	try:
-		oldumask = os.umask(0)
-		file_handle = os.open(file_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600)
-	except OSError as e:
-		if e.errno == errno.EEXIST:  # Failed as the file already exists.
-			logging.error("Failed: File already exists: {}".format(e))
-			sys.exit(EC_GENERIC_ERROR)
-		else:  # Something unexpected went wrong
-			logging.error("Failed: Unable to open file: {}".format(e))
-			sys.exit(EC_GENERIC_ERROR)
-	else:  # No exception, so the file must have been created successfully.
-		with os.fdopen(file_handle, 'w') as file_obj:
-			try:
-				conn.setopt(pycurl.HTTPHEADER, [
-					"Content-Type: application/x-www-form-urlencoded",
-					"User-Agent: curl",
-				])
-				token = send_command(conn, options, "https://iam.cloud.ibm.com/identity/token", "POST", "grant_type=urn:ibm:params:oauth:grant-type:apikey&apikey={}".format(options["--apikey"]))["access_token"]
-			except Exception as e:
-				logging.error("Failed: Unable to authenticate: {}".format(e))
-				fail(EC_LOGIN_DENIED)
-			if len(token) < 1:
-				fail(EC_LOGIN_DENIED)
-			file_obj.write(token)
-	finally:
-		os.umask(oldumask)
-
-	return token
+	return (token, res.get("expires_in"))
 
 def set_bearer_token(conn, bearer_token):
 	conn.setopt(pycurl.HTTPHEADER, [
@@ -126,7 +94,6 @@ def set_bearer_token(conn, bearer_token):
 
 def connect(opt):
 	conn = pycurl.Curl()
-	bearer_token = ""
 
 	## setup correct URL
 	conn.base_url = "https://" + opt["--region"] + ".iaas.cloud.ibm.com/v1/"
@@ -139,30 +106,9 @@ def connect(opt):
 	conn.setopt(pycurl.SSL_VERIFYHOST, 2)
 	conn.setopt(pycurl.PROXY, "{}".format(opt["--proxy"]))
 
-	# get bearer token
-	try:
-		try:
-			# FIPS requires usedforsecurity=False and might not be
-			# available on all distros: https://bugs.python.org/issue9216
-			hash = hashlib.sha256(opt["--apikey"].encode("utf-8"), usedforsecurity=False).hexdigest()
-		except (AttributeError, TypeError):
-			hash = hashlib.sha256(opt["--apikey"].encode("utf-8")).hexdigest()
-		f = open(opt["--token-file"].replace("[hash]", hash))
-		bearer_token = f.read()
-		f.close()
-	except IOError:
-		bearer_token = get_bearer_token(conn, opt)
-
-	# set auth token for later requests
-	conn = set_bearer_token(conn, bearer_token)
-
-	try:
-		command = "instances?version=2021-05-25&generation=2&limit=1"
-		res = send_command(conn, opt, command)
-	except Exception as e:
-		logging.warning("Failed to login/connect. Updating bearer-token.")
-		bearer_token = get_bearer_token(conn, opt)
-		conn = set_bearer_token(conn, bearer_token)
+	# bearer token is kept between runs of the agent
+	conn.token = CredentialCache(opt, "fence_ibm_vpc", lambda: get_bearer_token(conn, opt), ["--apikey"])
+	conn.token.get_credentials()
 
 	return conn
 
@@ -170,6 +116,13 @@ def disconnect(conn):
 	conn.close()
 
 def send_command(conn, options, command, method="GET", action=None, expected_rc=200):
+	def send(bearer_token):
+		set_bearer_token(conn, bearer_token)
+		return _send_command(conn, options, command, method, action, expected_rc, True)
+
+	return conn.token.request(send)
+
+def _send_command(conn, options, command, method="GET", action=None, expected_rc=200, authorized=False):
 	if not command.startswith("https"):
 		url = conn.base_url + command
 	else:
@@ -195,30 +148,14 @@ def send_command(conn, options, command, method="GET", action=None, expected_rc=
 
 	rc = conn.getinfo(pycurl.HTTP_CODE)
 
-	# auth if token has expired
-	if rc in [400, 401, 415]:
-		tokenconn = pycurl.Curl()
-		tokenconn.setopt(pycurl.PROXY, "{}".format(opt["--proxy"]))
-		token = get_bearer_token(tokenconn, options)
-		tokenconn.close()
-		conn = set_bearer_token(conn, token)
-
-		# flush web_buffer
-		web_buffer.close()
-		web_buffer = io.BytesIO()
-		conn.setopt(pycurl.WRITEFUNCTION, web_buffer.write)
-
-		try:
-			conn.perform()
-		except Exception as e:
-			raise(e)
-
-		rc = conn.getinfo(pycurl.HTTP_CODE)
-
 	result = web_buffer.getvalue().decode("UTF-8")
 
 	web_buffer.close()
 
+	# bearer token has expired
+	if authorized and rc == 401:
+		raise LoginExpired()
+
 	# actions (start/stop/reboot) report 201 when they've been created
 	if rc != expected_rc:
 		logging.debug("rc: {}, result: {}".format(rc, result))
@@ -276,12 +213,10 @@ def define_new_opts():
 	all_opt["token_file"] = {
 		"getopt" : ":",
 		"longopt" : "token-file",
-		"help" : "--token-file=[path]            Path to the token cache file\n"
-			"\t\t\t\t  (Default: @FENCETMPDIR@/fence_ibm_vpc/[hash].token)\n"
-			"\t\t\t\t  [hash] will be replaced by a hashed value",
+		"help" : "--token-file=[path]            Not used anymore, the token is kept\n"
+			"\t\t\t\t  in the cache of fence agents (see --cache-ttl)",
 		"required" : "0",
-		"default": "@FENCETMPDIR@/fence_ibm_vpc/[hash].token",
-		"shortdesc" : "Path to the token cache file",
+		"shortdesc" : "Not used anymore, the token is kept in the cache of fence agents",
 		"order" : 0
 	}
 
@@ -293,6 +228,7 @@ def main():
 		"proxy",
 		"limit",
 		"token_file",
+		"cache_ttl",
 		"port",
 		"no_password",
 	]
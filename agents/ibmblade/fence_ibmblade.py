@@ -32,7 +32,7 @@ def set_power_status(conn, options):
 def get_outlets_status(conn, _):
 	result = {}
 
-	res_blades = conn.walk(STATUSES_OID, 30)
+	res_blades = conn.bulkwalk(STATUSES_OID, 30)
 
 	for blade_info in res_blades:
 		port_num = blade_info[0].split('.')[-1]
@@ -47,7 +47,7 @@ def get_outlets_status(conn, _):
 # Main agent method
 def main():
 	device_opt = ["ipaddr", "login", "passwd", "no_login", "no_password", \
-		       "port", "snmp_version", "snmp"]
+		       "port", "snmp_version", "snmp", "plug_concurrency"]
 
 	atexit.register(atexit_handler)
 
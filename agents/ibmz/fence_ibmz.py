@@ -18,7 +18,6 @@
 
 import atexit
 import logging
-import time
 import sys
 
 import requests
@@ -26,7 +25,8 @@ from requests.packages import urllib3
 
 sys.path.append("@FENCEAGENTSLIBDIR@")
 from fencing import *
-from fencing import fail_usage, run_delay, EC_GENERIC_ERROR
+from fencing import fail_usage, run_delay, poll_until, EC_GENERIC_ERROR
+from fencing_cache import CredentialCache, LoginExpired
 
 DEFAULT_POWER_TIMEOUT = '300'
 ERROR_NOT_FOUND = ("{obj_type} {obj_name} not found in this HMC. "
@@ -110,6 +110,9 @@ class APIClient(object):
         self.user = user
         self._cpc_cache = {}
         self._session = None
+        # CredentialCache with login new_session() keeping the session ID
+        # between runs of the agent
+        self.credentials = None
         self._config = self.DEFAULT_CONFIG.copy()
         # apply user defined values
         if config:
@@ -208,7 +211,19 @@ class APIClient(object):
 
     def _request(self, method, uri, body=None, headers=None, valid_codes=None):
         """
-        Perform a request to the HMC API
+        Perform a request to the HMC API, log on again when the session
+        expired
+        """
+        if self.credentials is None:
+            return self._send_request(
+                None, method, uri, body, headers, valid_codes)
+        return self.credentials.request(
+            self._send_request, method, uri, body, headers, valid_codes)
+
+    def _send_request(self, session_id, method, uri, body=None, headers=None,
+                      valid_codes=None):
+        """
+        Perform a request to the HMC API in the session with given ID
         """
         assert method in ('delete', 'head', 'get', 'post', 'put')
 
@@ -222,9 +237,19 @@ class APIClient(object):
         method = getattr(self._session, method)
         timeout = (
             self._config['connect_timeout'], self._config['read_timeout'])
+        if session_id is not None:
+            headers = dict(headers, **{"X-API-Session": session_id})
         response = method(url, json=body, headers=headers,
                           verify=self._config['ssl_verify'], timeout=timeout)
 
+        # 403 with reason 5 - the session ID is not valid
+        if session_id is not None and response.status_code == 403:
+            try:
+                if response.json().get('reason') == 5:
+                    raise LoginExpired()
+            except ValueError:
+                pass
+
         if valid_codes and response.status_code not in valid_codes:
             reason = '(no reason)'
             message = '(no message)'
@@ -265,21 +290,22 @@ class APIClient(object):
         Perform API requests to check for job status until it has completed
         or the specified timeout is reached
         """
-        op_timeout = time.time() + timeout
-        while time.time() < op_timeout:
+        def job_complete():
             job_resp = self._request("get", job_uri)
-            if job_resp['status'] == 'complete':
-                if job_resp['job-status-code'] in (200, 201, 204):
-                    return
-                raise ApiClientRequestError(
-                    req_method, req_uri,
-                    job_resp.get('job-status-code', '(no status)'),
-                    job_resp.get('job-reason-code', '(no reason)'),
-                    job_resp.get('job-results', {}).get(
-                        'message', '(no message)')
-                )
-            time.sleep(1)
-        raise ApiClientError('Timed out while waiting for job completion')
+            if job_resp['status'] != 'complete':
+                return False
+            if job_resp['job-status-code'] in (200, 201, 204):
+                return True
+            raise ApiClientRequestError(
+                req_method, req_uri,
+                job_resp.get('job-status-code', '(no status)'),
+                job_resp.get('job-reason-code', '(no reason)'),
+                job_resp.get('job-results', {}).get(
+                    'message', '(no message)')
+            )
+
+        if not poll_until(job_complete, timeout, max_interval=1):
+            raise ApiClientError('Timed out while waiting for job completion')
 
     def cpc_list(self):
         """
@@ -310,22 +336,35 @@ class APIClient(object):
 
     def logon(self):
         """
-        Open a session with the HMC API and store its ID
+        Open a session with the HMC API and store its ID, the ID from the
+        credential cache is used when there is one
         """
         self._session = self._create_session()
+        if self.credentials is not None:
+            self.credentials.get_credentials()
+            return
+        self._session.headers["X-API-Session"] = self.new_session()
+
+    def new_session(self):
+        """
+        Open a new session with the HMC API and return its ID
+        """
         logon_body = {"userid": self.user, "password": self.passwd}
-        logon_resp = self._request("post", "/api/sessions", body=logon_body,
-                                   valid_codes=[200, 201])
-        self._session.headers["X-API-Session"] = logon_resp['api-session']
+        logon_resp = self._send_request(
+            None, "post", "/api/sessions", body=logon_body,
+            valid_codes=[200, 201])
+        return logon_resp['api-session']
 
     def logoff(self):
         """
-        Close/delete the HMC API session
+        Close/delete the HMC API session, the cached session is kept for next
+        runs of the agent
         """
         if self._session is None:
             return
-        self._request("delete", "/api/sessions/this-session",
-                      valid_codes=[204])
+        if self.credentials is None or not self.credentials.enabled():
+            self._request("delete", "/api/sessions/this-session",
+                          valid_codes=[204])
         self._cpc_cache = {}
         self._session = None
 
@@ -430,6 +469,7 @@ def set_opts():
         "read_timeout",
         "ssl_secure",
         "load_on_activate",
+        "cache_ttl",
     ]
 
     all_opt["ipport"]["default"] = APIClient.DEFAULT_CONFIG['port']
@@ -553,6 +593,8 @@ def main():
     }
     try:
         conn = APIClient(hmc_address, hmc_userid, hmc_password, config)
+        conn.credentials = CredentialCache(
+            options, "fence_ibmz", conn.new_session)
         conn.logon()
         atexit.register(disconnect, conn)
         result = fence_action(conn, options, set_power_status,
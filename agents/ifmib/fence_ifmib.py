@@ -14,6 +14,7 @@ sys.path.append("@FENCEAGENTSLIBDIR@")
 from fencing import *
 from fencing import fail_usage, array_to_dict
 from fencing_snmp import FencingSnmp
+from fencing_cache import FencingCache
 
 ### CONSTANTS ###
 # IF-MIB trees for alias, status and port
@@ -30,21 +31,32 @@ STATUS_TESTING = 3
 # Port number converted from port name or index
 port_num = None
 
+# Cache of port indexes - see FencingCache
+cache = None
+
 ### FUNCTIONS ###
 
 # Convert port index or name to port index
 def port2index(conn, port):
-	res = None
-
 	if port.isdigit():
-		res = int(port)
-	else:
-		ports = conn.walk(PORTS_OID, 30)
+		return int(port)
+
+	# Name of port is verified by one GET instead of walk of port table
+	res = cache.get("port:" + port)
+	if res is not None:
+		name = conn.get("%s.%d"%(PORTS_OID, res), stop=False)
+		if name is not None and name[1].strip('"') == port:
+			return res
+		cache.invalidate()
+		res = None
 
-		for x in ports:
-			if x[1].strip('"') == port:
-				res = int(x[0].split('.')[-1])
-				break
+	ports = conn.bulkwalk(PORTS_OID, 30)
+
+	for x in ports:
+		if x[1].strip('"') == port:
+			res = int(x[0].split('.')[-1])
+			cache.set("port:" + port, res)
+			break
 
 	if res == None:
 		fail_usage("Can't find port with name %s!"%(port))
@@ -71,8 +83,8 @@ def set_power_status(conn, options):
 def get_outlets_status(conn, options):
 	result = {}
 
-	res_fc = conn.walk(PORTS_OID, 30)
-	res_aliases = array_to_dict(conn.walk(ALIASES_OID, 30))
+	res_fc = conn.bulkwalk(PORTS_OID, 30)
+	res_aliases = array_to_dict(conn.bulkwalk(ALIASES_OID, 30))
 
 	for x in res_fc:
 		port_number = x[0].split('.')[-1]
@@ -107,6 +119,9 @@ to control the state of an interface."
 	docs["vendorurl"] = "http://www.ietf.org/wg/concluded/ifmib.html"
 	show_docs(options, docs)
 
+	global cache
+	cache = FencingCache(options, "fence_ifmib")
+
 	# Operate the fencing device
 	result = fence_action(FencingSnmp(options), options, set_power_status, get_power_status, get_outlets_status)
 
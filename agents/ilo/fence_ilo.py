@@ -11,12 +11,14 @@
 ##  iLO2 / firmware 1.50 / RIBCL 2.22
 #####
 
-import sys, os, re, pexpect
+import sys, os, re
 import atexit
 from xml.sax.saxutils import quoteattr
 sys.path.append("@FENCEAGENTSLIBDIR@")
 from fencing import *
-from fencing import fail, EC_LOGIN_DENIED
+from fencing import fail, EC_LOGIN_DENIED, lazy_import
+
+pexpect = lazy_import("pexpect")
 
 def get_power_status(conn, options):
 	conn.send("<LOGIN USER_LOGIN = " + quoteattr(options["--username"]) + \
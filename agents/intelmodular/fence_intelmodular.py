@@ -43,7 +43,7 @@ def set_power_status(conn, options):
 def get_outlets_status(conn, options):
 	result = {}
 
-	res_blades = conn.walk(STATUSES_OID, 30)
+	res_blades = conn.bulkwalk(STATUSES_OID, 30)
 
 	for x in res_blades:
 		port_num = x[0].split('.')[-1]
@@ -58,7 +58,7 @@ def get_outlets_status(conn, options):
 # Main agent method
 def main():
 	device_opt = ["ipaddr", "login", "passwd", "no_login", "no_password",
-		       "port", "snmp_version", "snmp"]
+		       "port", "snmp_version", "snmp", "plug_concurrency"]
 
 	atexit.register(atexit_handler)
 
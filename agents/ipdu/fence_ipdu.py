@@ -69,7 +69,7 @@ def ipdu_resolv_port_id(conn, options):
 		if device.has_switches:
 			switch_id = int(options["--switch"])
 	else:
-		table = conn.walk(device.outlet_table_oid, 30)
+		table = conn.bulkwalk(device.outlet_table_oid, 30)
 
 		for x in table:
 			if x[1].strip('"') == options["--plug"]:
@@ -107,7 +107,7 @@ def get_outlets_status(conn, options):
 	if device == None:
 		ipdu_set_device(conn, options)
 
-	res_ports = conn.walk(device.outlet_table_oid, 30)
+	res_ports = conn.bulkwalk(device.outlet_table_oid, 30)
 
 	for x in res_ports:
 		t = x[0].split('.')
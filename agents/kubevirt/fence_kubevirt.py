@@ -7,14 +7,6 @@ sys.path.append("@FENCEAGENTSLIBDIR@")
 from fencing import *
 from fencing import fail, fail_usage, run_delay, EC_STATUS, EC_FETCH_VM_UUID
 
-try:
-    from kubernetes.client.exceptions import ApiException
-except ImportError:
-    try:
-        from kubernetes.client.rest import ApiException
-    except ImportError:
-        logging.error("Couldn\'t import kubernetes.client.exceptions.ApiException or kubernetes.client.rest.ApiException - not found or not accessible")
-
 def _get_namespace(options):
     from kubernetes import config
 
@@ -40,6 +32,15 @@ def get_nodes_list(conn, options):
     return result
 
 def get_power_status(conn, options):
+    try:
+        from kubernetes.client.exceptions import ApiException
+    except ImportError:
+        try:
+            from kubernetes.client.rest import ApiException
+        except ImportError:
+            logging.error("Couldn\'t import kubernetes.client.exceptions.ApiException or kubernetes.client.rest.ApiException - not found or not accessible")
+            fail(EC_STATUS)
+
     logging.debug("Starting get status operation")
     try:
         apiversion = options.get("--apiversion")
@@ -7,11 +7,13 @@
 ##
 #####
 
-import sys, re, pexpect
+import sys, re
 import atexit
 sys.path.append("@FENCEAGENTSLIBDIR@")
 from fencing import *
-from fencing import fail_usage
+from fencing import fail_usage, lazy_import
+
+pexpect = lazy_import("pexpect")
 
 COMMAND_PROMPT_REG = r"\[PEXPECT\]$"
 COMMAND_PROMPT_NEW = "[PEXPECT]"
@@ -89,7 +89,7 @@ def lpdu_resolv_port_id(conn, options):
 		if device.has_switches:
 			switch_id = int(options["--switch"])
 	else:
-		table = conn.walk(device.pdu_table_oid, 30)
+		table = conn.bulkwalk(device.pdu_table_oid, 30)
 
 		for x in table:
 			if x[1].strip('"').split(',')[0] == options["--plug"]:
@@ -161,7 +161,7 @@ def get_outlets_status(conn, options):
 	
 	for switch in pdu_id:
 		table_oid = device.outlet_table_oid % int(switch)
-		res_ports = conn.walk(table_oid, 30)
+		res_ports = conn.bulkwalk(table_oid, 30)
 		status_oid=device.status_oid % int(switch)
 		port_status=conn.walk(status_oid, 30)
 		state=port_status[0][1].strip('"').split(',')
@@ -8,6 +8,11 @@ import time
 import logging
 import atexit
 import ctypes
+
+## fence_mpath_check and fence_mpath_check_hardreboot are run by watchdog without options,
+## fencing must not wait for them on stdin
+STDIN_OPTIONS = not os.path.basename(sys.argv[0]).startswith("fence_mpath_check")
+
 sys.path.append("@FENCEAGENTSLIBDIR@")
 from fencing import fail_usage, run_command, atexit_handler, check_input, process_input, show_docs
 from fencing import fence_action, all_opt, run_delay
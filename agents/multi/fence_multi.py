@@ -0,0 +1,195 @@
+#!@PYTHON@ -tt
+
+# Fence agent which fences a node by several fence devices at once, e.g. a host
+# with two power supplies connected to two PDUs.
+
+import sys, os, re, copy, atexit, signal, logging, tempfile
+sys.path.append("@FENCEAGENTSLIBDIR@")
+import fencing_daemon
+from fencing import *
+from fencing import fail_usage, run_delay, EC_GENERIC_ERROR
+
+## options of the agents as they are before this agent changes them
+AGENT_OPT = copy.deepcopy(all_opt)
+
+## pids of the device agents which are running
+CHILDREN = set()
+
+def get_power_status(conn, options):
+	## "on" when at least one device is on, so the node is off only when all of them are
+	results = run_devices(options, "status")
+
+	if any(code not in [0, 2] for code in results):
+		return None
+	if all(code == 2 for code in results):
+		return "off"
+	return "on"
+
+def set_power_status(conn, options):
+	## all devices have to confirm the action, fence_action() does not switch any
+	## device on during reboot before all of them are off
+	return all(code == 0 for code in run_devices(options, options["--action"]))
+
+def run_devices(options, action):
+	## Run the agents of all devices with action at once and return their exit codes
+	##
+	## The agents are imported once by load_devices(), every device is then run by
+	## a forked child of this process with its options on standard input, like it
+	## was run by fenced.
+	sys.stdout.flush()
+	sys.stderr.flush()
+
+	children = []
+	for device in options["devices"]:
+		output = tempfile.TemporaryFile()
+		request = {"script": device["script"], "argv": [device["script"]], "env": dict(os.environ),
+			"cwd": os.getcwd(), "stdin": device["stdin"] + ["action=%s\n" % action]}
+		fds = [os.open(os.devnull, os.O_RDONLY), os.dup(output.fileno()), os.dup(2)]
+
+		pid = os.fork()
+		if pid == 0:
+			all_opt.clear()
+			all_opt.update(copy.deepcopy(AGENT_OPT))
+			atexit._clear()
+			fencing_daemon.run_agent(request, fds, device["code"], own_group=False)
+
+		CHILDREN.add(pid)
+		for fd in fds:
+			os.close(fd)
+		children.append((device, pid, output))
+
+	results = []
+	for (device, pid, output) in children:
+		(_, status) = os.waitpid(pid, 0)
+		CHILDREN.discard(pid)
+		code = os.WEXITSTATUS(status) if os.WIFEXITED(status) else EC_GENERIC_ERROR
+
+		with output:
+			output.seek(0)
+			for line in output.read().decode("utf-8", "replace").splitlines():
+				print("%s: %s" % (device["name"], line))
+
+		logging.debug("%s: %s %s exited with %d\n", device["name"], os.path.basename(device["script"]), action, code)
+		if code != 0 and not (code == 2 and action == "status"):
+			logging.error("%s: %s failed with exit code %d\n", device["name"], action, code)
+		results.append(code)
+
+	return results
+
+def kill_devices():
+	## no device may be switched after this agent exited, e.g. when it was killed
+	## by fenced after timeout
+	for pid in list(CHILDREN):
+		try:
+			os.kill(pid, signal.SIGKILL)
+			os.waitpid(pid, 0)
+		except OSError:
+			pass
+		CHILDREN.discard(pid)
+
+def load_devices(options):
+	## Devices file has the options of every device in the stdin format of fence
+	## agents, devices are separated by an empty line. "agent" is the fence agent
+	## of the device and "name" is used in the output, e.g.:
+	##
+	##	name=pdu1
+	##	agent=fence_apc_snmp
+	##	ip=pdu1.example.com
+	##	community=private
+	##	plug=3
+	try:
+		with open(options["--devices-file"]) as devices_file:
+			lines = devices_file.readlines()
+	except IOError as e:
+		fail_usage("Failed: Unable to read %s: %s" % (options["--devices-file"], e.strerror))
+
+	devices = []
+	agents = {}
+	device = None
+	for line in lines + [""]:
+		line = line.strip()
+		if len(line) == 0:
+			if device is not None:
+				devices.append(device)
+				device = None
+			continue
+
+		if device is None:
+			device = {"name": "device%d" % (len(devices) + 1), "agent": None, "stdin": []}
+		if line.startswith("#"):
+			continue
+
+		(name, value) = (line + "=").split("=", 1)
+		value = re.sub(r"^\"(.*)\"$", r"\1", value[:-1].strip())
+		if name.strip() in ["name", "agent"]:
+			device[name.strip()] = value
+		elif name.strip() != "action":
+			device["stdin"].append(line + "\n")
+
+	for device in devices:
+		if not device["agent"]:
+			fail_usage("Failed: Missing agent of %s in %s" % (device["name"], options["--devices-file"]))
+		if os.path.isabs(device["agent"]):
+			device["script"] = device["agent"]
+		elif re.match(r"^fence_[a-z0-9_]+$", device["agent"]):
+			device["script"] = os.path.join(os.path.dirname(os.path.realpath(sys.argv[0])), device["agent"])
+		else:
+			fail_usage("Failed: Invalid agent %s of %s" % (device["agent"], device["name"]))
+
+		if device["script"] not in agents:
+			if not os.path.isfile(device["script"]):
+				fail_usage("Failed: Fence agent %s does not exist" % device["script"])
+			agents[device["script"]] = fencing_daemon.load_agent(device["script"])
+		device["code"] = agents[device["script"]]
+
+		if "--verbose" in options:
+			device["stdin"].append("verbose=1\n")
+
+	if len(devices) == 0:
+		fail_usage("Failed: No device in %s" % options["--devices-file"])
+
+	return devices
+
+def define_new_opts():
+	all_opt["devices_file"] = {
+		"getopt" : ":",
+		"longopt" : "devices-file",
+		"help" : "--devices-file=[path]          File with options of the fence devices",
+		"required" : "1",
+		"shortdesc" : "File with options of the fence devices, devices are separated by an empty line",
+		"order" : 1
+	}
+
+def main():
+	device_opt = ["no_password", "devices_file"]
+
+	atexit.register(atexit_handler)
+	atexit.register(kill_devices)
+	signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(EC_GENERIC_ERROR))
+
+	define_new_opts()
+
+	options = check_input(device_opt, process_input(device_opt))
+
+	docs = {}
+	docs["shortdesc"] = "Fence agent for fencing by several devices at once"
+	docs["longdesc"] = "fence_multi fences a node by several fence devices at once, e.g. \
+a host with two power supplies connected to two PDUs. All devices are operated in \
+parallel and during reboot no device is switched on before all of them confirmed \
+that they are off.\
+\n.P\n\
+Options of the devices are read from a file (--devices-file) in the format of \
+standard input of fence agents, with the name of the fence agent in 'agent' \
+and an optional 'name' used in the output. Devices are separated by an empty line."
+	docs["vendorurl"] = ""
+	show_docs(options, docs)
+
+	run_delay(options)
+
+	options["devices"] = load_devices(options)
+
+	result = fence_action(None, options, None, get_power_status, sync_set_power_fn=set_power_status)
+	sys.exit(result)
+
+if __name__ == "__main__":
+	main()
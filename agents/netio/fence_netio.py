@@ -1,10 +1,12 @@
 #!@PYTHON@ -tt
 
-import sys, re, pexpect
+import sys, re
 import atexit
 sys.path.append("@FENCEAGENTSLIBDIR@")
 from fencing import *
-from fencing import fspawn, fail, EC_LOGIN_DENIED, run_delay
+from fencing import ftelnet, fail, EC_LOGIN_DENIED, run_delay, lazy_import
+
+pexpect = lazy_import("pexpect")
 
 def get_power_status(conn, options):
 	conn.send_eol("port %s" % options["--plug"])
@@ -52,6 +54,7 @@ def main():
 	atexit.register(atexit_handler)
 
 	all_opt["ipport"]["default"] = "1234"
+	all_opt["telnet_engine"]["default"] = "native"
 
 	opt = process_input(device_opt)
 	opt["eol"] = "\r\n"
@@ -73,11 +76,11 @@ block any necessary fencing actions."
 	####
 	run_delay(options)
 	try:
-		conn = fspawn(options, options["--telnet-path"])
-		conn.send("set binary\n")
-		conn.send("open %s -%s\n"%(options["--ip"], options["--ipport"]))
+		conn = ftelnet(options)
 
-		conn.read_nonblocking(size=100, timeout=int(options["--shell-timeout"]))
+		## skip messages of the telnet binary
+		if options["--telnet-engine"].lower() != "native":
+			conn.read_nonblocking(size=100, timeout=int(options["--shell-timeout"]))
 		conn.log_expect("100 HELLO .*", int(options["--shell-timeout"]))
 		conn.send_eol("login %s %s" % (options["--username"], options["--password"]))
 		conn.log_expect("250 OK", int(options["--shell-timeout"]))
@@ -7,7 +7,6 @@
 import atexit
 import logging
 import sys
-import time
 import uuid
 import requests
 from requests.adapters import HTTPAdapter
@@ -16,6 +15,8 @@ from requests.packages.urllib3.util.retry import Retry
 sys.path.append("@FENCEAGENTSLIBDIR@")
 from fencing import *
 from fencing import fail, EC_LOGIN_DENIED, EC_GENERIC_ERROR, EC_TIMED_OUT, run_delay, EC_BAD_ARGS
+from fencing import poll_until
+from fencing_cache import CredentialCache, LoginExpired
 
 
 V4_VERSION = '4.0'
@@ -49,6 +50,8 @@ class NutanixClient:
         self.disable_warnings = disable_warnings
         self.session = requests.Session()
         self.session.auth = (self.username, self.password)
+        # CredentialCache keeping the session cookies between runs of the agent
+        self.credentials = None
 
         retry_strategy = Retry(total=MAX_RETRIES,
                                backoff_factor=1,
@@ -57,6 +60,20 @@ class NutanixClient:
         self.session.mount("https://", HTTPAdapter(max_retries=retry_strategy))
 
     def request(self, url, method='GET', headers=None, **kwargs):
+        if self.credentials is None:
+            return self._request(None, url, method, headers, **kwargs)
+        return self.credentials.request(self._request, url, method, headers,
+                                        **kwargs)
+
+    def _request(self, cookies, url, method='GET', headers=None, **kwargs):
+        # with cookies of the session the password does not have to be
+        # verified again
+        self.session.cookies.clear()
+        if cookies:
+            self.session.cookies.update(cookies)
+            self.session.auth = None
+        else:
+            self.session.auth = (self.username, self.password)
 
         if self.disable_warnings:
             requests.packages.urllib3.disable_warnings()
@@ -69,7 +86,11 @@ class NutanixClient:
         try:
             logging.debug("Sending %s request to %s", method, url)
             response = self.session.request(method, url, **kwargs)
+            if cookies and response.status_code == 401:
+                raise LoginExpired()
             response.raise_for_status()
+        except LoginExpired:
+            raise
         except requests.exceptions.SSLError as err:
             logging.error("Secure connection failed, verify SSL certificate")
             logging.error("Error message: %s", err)
@@ -87,6 +108,9 @@ class NutanixClient:
             logging.error("API call returned status code %s", response.status_code)
             raise NutanixClientException(f"API call failed: {response}")
 
+        if not cookies and self.credentials is not None and self.session.cookies:
+            self.credentials.store(self.session.cookies.get_dict())
+
         return response
 
 
@@ -262,9 +286,7 @@ class NutanixV4Client(NutanixClient):
 
         task_url = f"{self.task_url}/{task_uuid}"
         header_str = self._get_headers()
-        task_resp = None
         interval = 5
-        task_status = None
 
         if not timeout:
             timeout = MIN_TIMEOUT
@@ -274,13 +296,7 @@ class NutanixV4Client(NutanixClient):
             except ValueError:
                 timeout = MIN_TIMEOUT
 
-        while task_status != 'SUCCEEDED':
-            if timeout <= 0:
-                raise TaskTimedOutException(f"Task timed out: {task_uuid}")
-
-            time.sleep(interval)
-            timeout = timeout - interval
-
+        def task_succeeded():
             try:
                 task_resp = self.request(url=task_url, method='GET',
                                          headers=header_str, verify=self.verify)
@@ -295,6 +311,11 @@ class NutanixV4Client(NutanixClient):
             if task_status == 'FAILED':
                 raise AHVFenceAgentException(f"Task failed, task uuid: {task_uuid}")
 
+            return task_status == 'SUCCEEDED'
+
+        if not poll_until(task_succeeded, timeout, max_interval=interval):
+            raise TaskTimedOutException(f"Task timed out: {task_uuid}")
+
     def list_vms(self, filter_str=None, limit=None):
         vms = None
         vm_list = {}
@@ -440,6 +461,9 @@ def connect(options):
 
     client = NutanixV4Client(host, username, password,
                              verify_ssl, disable_warnings)
+    # the login is done by the first request without cached cookies
+    client.credentials = CredentialCache(options, "fence_nutanix_ahv",
+                                         lambda: None)
 
     try:
         client.list_vms(limit=1)
@@ -554,7 +578,8 @@ def main():
             "filter",
             "method",
             "disable_timeout",
-            "power_timeout"
+            "power_timeout",
+            "cache_ttl"
             ]
 
     atexit.register(atexit_handler)
@@ -4,18 +4,14 @@ import atexit
 import logging
 import sys
 import os
+import datetime
 
 import urllib3
 
 sys.path.append("@FENCEAGENTSLIBDIR@")
 from fencing import *
 from fencing import fail_usage, run_delay, source_env
-
-try:
-    from novaclient import client
-    from novaclient.exceptions import Conflict, NotFound
-except ImportError:
-    pass
+from fencing_cache import CredentialCache
 
 urllib3.disable_warnings(urllib3.exceptions.SecurityWarning)
 
@@ -74,6 +70,8 @@ def get_nodes_list(conn, options):
 
 
 def get_power_status(conn, options):
+    from novaclient.exceptions import NotFound
+
     logging.info("Running %s action on %s", options["--action"], options["--plug"])
     server = None
     try:
@@ -89,6 +87,8 @@ def get_power_status(conn, options):
 
 
 def set_power_status(conn, options):
+    from novaclient.exceptions import Conflict, NotFound
+
     logging.info("Running %s action on %s", options["--action"], options["--plug"])
     action = options["--action"]
     server = None
@@ -121,9 +121,20 @@ def set_power_status(conn, options):
         logging.info("Called reboot hard API call for " + server.id)
 
 
+def auth_state(auth, session):
+    # token and service catalog of the keystone login, with seconds until the
+    # token expires
+    access = auth.get_access(session)
+    expires_in = None
+    if access.expires:
+        expires_in = int((access.expires - datetime.datetime.now(
+            datetime.timezone.utc)).total_seconds())
+    return (auth.get_auth_state(), expires_in)
+
+
 def nova_login(username, password, projectname, auth_url, user_domain_name,
                project_domain_name, ssl_insecure, cacert, apitimeout,
-               auth_plugin="password", auth_options=None):
+               auth_plugin="password", auth_options=None, credentials=None):
     legacy_import = False
 
     try:
@@ -171,7 +182,25 @@ def nova_login(username, password, projectname, auth_url, user_domain_name,
     elif cacert:
         caverify=cacert
 
+    try:
+        from novaclient import client
+    except ImportError:
+        fail_usage("Failed: Nova client not found or not accessible")
+
     session = ksc_session.Session(auth=auth, verify=caverify, timeout=apitimeout)
+
+    # keystone login is kept between runs of the agent, the session logs in
+    # again when the cached token is refused
+    if credentials is not None and hasattr(auth, "set_auth_state"):
+        credentials.login = lambda: auth_state(auth, session)
+        try:
+            auth.set_auth_state(credentials.get_credentials())
+        except Exception as e:
+            logging.debug("Unable to use cached login: %s", e)
+            credentials = None
+    else:
+        credentials = None
+
     nova = client.Client("2", session=session, timeout=apitimeout)
     apiversion = None
     try:
@@ -183,6 +212,11 @@ def nova_login(username, password, projectname, auth_url, user_domain_name,
     except Exception as e:
         logging.error(e)
     logging.debug("Nova version: %s", apiversion)
+
+    if credentials is not None and apiversion is not None:
+        (state, expires_in) = auth_state(auth, session)
+        if state != credentials.credentials:
+            credentials.store(state, expires_in)
     return nova
 
 
@@ -297,6 +331,7 @@ def main():
         "ssl_insecure",
         "cacert",
         "apitimeout",
+        "cache_ttl",
     ]
 
     atexit.register(atexit_handler)
@@ -386,6 +421,10 @@ This agent calls the python-novaclient and it is mandatory to be installed "
     cacert = options["--cacert"]
     apitimeout = options["--apitimeout"]
 
+    credentials = CredentialCache(options, "fence_openstack", None, key_values=[
+        username, password, projectname, auth_url, user_domain_name,
+        project_domain_name, options["--auth-plugin"], auth_options])
+
     try:
         conn = nova_login(
             username,
@@ -399,6 +438,7 @@ This agent calls the python-novaclient and it is mandatory to be installed "
             apitimeout,
             options["--auth-plugin"],
             auth_options,
+            credentials,
         )
     except Exception as e:
         fail_usage("Failed: Unable to connect to Nova: " + str(e))
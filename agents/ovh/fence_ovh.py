@@ -13,8 +13,6 @@ import shutil, tempfile
 import logging
 import atexit
 from datetime import datetime
-from suds.client import Client
-from suds.xsd.doctor import ImportDoctor, Import
 sys.path.append("@FENCEAGENTSLIBDIR@")
 from fencing import *
 from fencing import fail, fail_usage, EC_LOGIN_DENIED, run_delay
@@ -54,6 +52,9 @@ def reboot_time(conn, options):
 	return result
 
 def soap_login(options):
+	from suds.client import Client
+	from suds.xsd.doctor import ImportDoctor, Import
+
 	imp = Import('http://schemas.xmlsoap.org/soap/encoding/')
 	url = 'https://www.ovh.com/soapi/soapi-re-1.59.wsdl'
 	imp.filter.add('http://soapi.ovh.com/manager')
@@ -1,16 +1,15 @@
 #!@PYTHON@ -tt
 
-import sys, time
+import sys
 import requests
 from requests.adapters import HTTPAdapter
 from requests.exceptions import ConnectionError, Timeout, RequestException
 from json.decoder import JSONDecodeError
 import logging
 import atexit
-import itertools
 sys.path.append("@FENCEAGENTSLIBDIR@")
 from fencing import *
-from fencing import fail, fail_usage, run_delay, EC_GENERIC_ERROR, EC_CONNECTION_LOST, EC_TIMED_OUT
+from fencing import fail, fail_usage, run_delay, poll_until, EC_GENERIC_ERROR, EC_CONNECTION_LOST, EC_TIMED_OUT
 
 state = {"RUNNING" : "on", "STOPPED" : "off", "SUSPENDED" : "off"}
 
@@ -43,23 +42,32 @@ def sync_set_power_status(connection, options):
 		"off" : "kill"
 	}[options["--action"]]
 	job = send_command(connection, options, "/Vm/{}/{}".format(options["--plug"], action), "PUT")
-	for _ in itertools.count(1):
+
+	def job_done():
+		nonlocal job
 		if not job["summaryDone"]:
 			job = send_command(connection, options, "/Job/{}".format(job["id"]["value"]))
-		if job["summaryDone"]:
-			if job["jobRunState"].upper() == "FAILURE":
-				logging.error("Job failed: %s", job["error"])
-				return False
-			elif job["jobRunState"].upper() == "SUCCESS":
-				status = get_power_status(connection, options)
-				if status != options["--action"]:
-					logging.debug("Job succeed, but '%s' power status is %s", options["--plug"], status)
-				else:
-					return True
-		time.sleep(int(options["--stonith-status-sleep"]))
-		if int(options["--power-timeout"]) > 0 and _ >= int(options["--power-timeout"]):
-			logging.error("Job failed: Timed out waiting for %s to power %s", options["--plug"], options["--action"])
-			return False
+		if not job["summaryDone"]:
+			return None
+		if job["jobRunState"].upper() == "FAILURE":
+			return "failure"
+		elif job["jobRunState"].upper() == "SUCCESS":
+			status = get_power_status(connection, options)
+			if status != options["--action"]:
+				logging.debug("Job succeed, but '%s' power status is %s", options["--plug"], status)
+			else:
+				return "success"
+		return None
+
+	result = poll_until(job_done, int(options["--power-timeout"]) or None,
+			max_interval=int(options["--stonith-status-sleep"]))
+	if result is None:
+		logging.error("Job failed: Timed out waiting for %s to power %s", options["--plug"], options["--action"])
+		return False
+	if result == "failure":
+		logging.error("Job failed: %s", job["error"])
+		return False
+	return True
 
 def get_outlet_list(connection, options):
 	virtual_machines = send_command(connection, options, "/Vm")
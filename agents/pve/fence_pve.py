@@ -5,13 +5,12 @@
 # for help with writing and testing this agent.
 
 import sys
-import json
-import pycurl
-import io
 import atexit
 import logging
 sys.path.append("@FENCEAGENTSLIBDIR@")
 from fencing import fail, fail_usage, EC_LOGIN_DENIED, atexit_handler, all_opt, check_input, process_input, show_docs, fence_action, run_delay
+from fencing_cache import CredentialCache, LoginExpired
+from fencing_http import FencingHttp, HttpError
 
 if sys.version_info[0] > 2: import urllib.parse as urllib
 else: import urllib
@@ -80,57 +79,50 @@ def get_outlet_list(conn, options):
 
 def get_ticket(options):
 	post = {'username': options["--username"], 'password': options["--password"]}
-	result = send_cmd(options, "access/ticket", post=post)
+	result = _send_cmd(None, options, "access/ticket", post=post)
 	if type(result) is dict and "data" in result:
 		if type(result["data"]) is dict and "ticket" in result["data"] and "CSRFPreventionToken" in result["data"]:
-			return {
+			## ticket is valid for 2 hours
+			return ({
 				"ticket" : str("PVEAuthCookie=" + result["data"]["ticket"] + "; " + \
 					"version=0; path=/; domain=" + options["--ip"] + \
 					"; port=" + str(options["--ipport"]) + "; path_spec=0; secure=1; " + \
 					"expires=7200; discard=0"),
 				"CSRF_token" : str("CSRFPreventionToken: " + result["data"]["CSRFPreventionToken"])
-				}
+				}, 7200)
 	return None
 
 
 def send_cmd(options, cmd, post=None):
-	url = options["url"] + cmd
-	conn = pycurl.Curl()
-	output_buffer = io.BytesIO()
-	if logging.getLogger().getEffectiveLevel() < logging.WARNING:
-		conn.setopt(pycurl.VERBOSE, True)
-	conn.setopt(pycurl.HTTPGET, 1)
-	conn.setopt(pycurl.URL, url.encode("ascii"))
-	if "auth" in options and options["auth"] is not None:
-		conn.setopt(pycurl.COOKIE, options["auth"]["ticket"])
-		conn.setopt(pycurl.HTTPHEADER, [options["auth"]["CSRF_token"]])
-	if post is not None:
-		if "skiplock" in post:
-			conn.setopt(conn.CUSTOMREQUEST, 'POST')
-		else:
-			conn.setopt(pycurl.POSTFIELDS, urllib.urlencode(post))
-	conn.setopt(pycurl.WRITEFUNCTION, output_buffer.write)
-	conn.setopt(pycurl.TIMEOUT, int(options["--shell-timeout"]))
+	try:
+		return options["auth"].request(_send_cmd, options, cmd, post)
+	except LoginExpired:
+		logging.error("Ticket was refused")
+	return None
 
-	if "--ssl-insecure" in options:
-		conn.setopt(pycurl.SSL_VERIFYPEER, 0)
-		conn.setopt(pycurl.SSL_VERIFYHOST, 0)
-	else:
-		conn.setopt(pycurl.SSL_VERIFYPEER, 1)
-		conn.setopt(pycurl.SSL_VERIFYHOST, 2)
 
-	logging.debug("URL: " + url)
+def _send_cmd(auth, options, cmd, post=None):
+	headers = {}
+	if auth is not None:
+		headers["Cookie"] = auth["ticket"]
+		(name, value) = auth["CSRF_token"].split(": ", 1)
+		headers[name] = value
 
 	try:
-		conn.perform()
-		result = output_buffer.getvalue().decode()
+		if post is None:
+			response = options["http"].get(cmd, headers=headers)
+		elif "skiplock" in post:
+			response = options["http"].post(cmd, "", headers=headers)
+		else:
+			response = options["http"].post(cmd, urllib.urlencode(post), headers=headers)
 
-		logging.debug("RESULT [" + str(conn.getinfo(pycurl.RESPONSE_CODE)) + \
-			"]: " + result)
-		conn.close()
+		if auth is not None and response.code == 401:
+			raise LoginExpired()
 
-		return json.loads(result)
-	except pycurl.error:
+		return response.json()
+	except LoginExpired:
+		raise
+	except HttpError:
 		logging.error("Connection failed")
 	except:
 		logging.error("Cannot parse json")
@@ -182,7 +174,7 @@ def main():
 		"order": 2
 	}
 
-	device_opt = ["ipaddr", "login", "passwd", "ssl", "web", "port", "pve_node", "pve_node_auto", "node_name", "vmtype", "method"]
+	device_opt = ["ipaddr", "login", "passwd", "ssl", "web", "port", "pve_node", "pve_node_auto", "node_name", "vmtype", "method", "cache_ttl"]
 
 	all_opt["login"]["required"] = "0"
 	all_opt["login"]["default"] = "root@pam"
@@ -221,9 +213,11 @@ acting as nodes in a virtualized cluster."
 		options["--method"] = "onoff"
 
 	options["url"] = "https://" + options["--ip"] + ":" + str(options["--ipport"]) + "/api2/json/"
+	options["http"] = FencingHttp(options, options["url"])
+	atexit.register(options["http"].close)
 
-	options["auth"] = get_ticket(options)
-	if options["auth"] is None:
+	options["auth"] = CredentialCache(options, "fence_pve", lambda: get_ticket(options))
+	if options["auth"].get_credentials() is None:
 		fail(EC_LOGIN_DENIED)
 
 	# Workaround for unsupported API call on some Proxmox hosts
@@ -1,10 +1,12 @@
 #!@PYTHON@ -tt
 
-import sys, re, pexpect
+import sys, re
 import atexit
 sys.path.append("@FENCEAGENTSLIBDIR@")
 from fencing import *
-from fencing import fspawn, fail, EC_LOGIN_DENIED, run_delay
+from fencing import ftelnet, fail, EC_LOGIN_DENIED, run_delay, lazy_import
+
+pexpect = lazy_import("pexpect")
 
 def get_power_status(conn, options):
 	conn.send_eol("show -d properties=powerState %s" % options["--plug"])
@@ -34,6 +36,7 @@ def main():
 	opt = process_input(device_opt)
 
 	all_opt["ipport"]["default"] = "23"
+	all_opt["telnet_engine"]["default"] = "native"
 
 	opt["eol"] = "\r\n"
 	options = check_input(device_opt, opt)
@@ -62,10 +65,10 @@ block any necessary fencing actions."
 	## We can not use fence_login(), username and passwd are sent on one line
 	####
 	try:
-		conn = fspawn(options, options["--telnet-path"], encoding="latin1")
-		conn.send("set binary\n")
-		conn.send("open %s -%s\n"%(options["--ip"], options["--ipport"]))
-		conn.read_nonblocking(size=100, timeout=int(options["--shell-timeout"]))
+		conn = ftelnet(options, encoding="latin1")
+		## skip messages of the telnet binary
+		if options["--telnet-engine"].lower() != "native":
+			conn.read_nonblocking(size=100, timeout=int(options["--shell-timeout"]))
 		conn.log_expect("Login.*", int(options["--shell-timeout"]))
 		conn.send_eol("%s" % (options["--username"]))
 		conn.log_expect("Password.*", int(options["--shell-timeout"]))
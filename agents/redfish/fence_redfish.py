@@ -8,20 +8,20 @@ import sys
 import re
 import logging
 import json
-import requests
 import atexit
 sys.path.append("@FENCEAGENTSLIBDIR@")
 
 from fencing import *
-from fencing import fail_usage, run_delay
+from fencing import fail_usage, run_delay, run_async
+from fencing_http import FencingHttp
 
 GET_HEADERS = {'accept': 'application/json', 'OData-Version': '4.0'}
 POST_HEADERS = {'content-type': 'application/json', 'accept': 'application/json',
                 'OData-Version': '4.0'}
 
 
-def get_power_status(conn, options):
-    response = send_get_request(options, options["--systems-uri"])
+async def get_power_status(conn, options):
+    response = await send_get_request(options, options["--systems-uri"])
     if response['ret'] is False:
         fail_usage("Couldn't get power information")
     data = response['data']
@@ -31,12 +31,18 @@ def get_power_status(conn, options):
     except Exception:
         fail_usage("Unable to get PowerState: " + "https://" + options["--ip"] + ":" + str(options["--ipport"]) + options["--systems-uri"])
 
+    # Keep URI of the reset action, so setting of the power does not need to get the resource again
+    try:
+        options["reset-uri"] = data["Actions"]["#ComputerSystem.Reset"]["target"]
+    except (KeyError, TypeError):
+        pass
+
     if data[u'PowerState'].strip() == "Off":
         return "off"
     else:
         return "on"
 
-def set_power_status(conn, options):
+async def set_power_status(conn, options):
     action = {
         'on' : "On",
         'off': "ForceOff",
@@ -46,43 +52,50 @@ def set_power_status(conn, options):
 
     payload = {'ResetType': action}
 
-    # Search for 'Actions' key and extract URI from it
-    response = send_get_request(options, options["--systems-uri"])
-    if response['ret'] is False:
-        return {'ret': False}
-    data = response['data']
-    action_uri = data["Actions"]["#ComputerSystem.Reset"]["target"]
+    action_uri = options.get("reset-uri")
+    if action_uri is None:
+        # Search for 'Actions' key and extract URI from it
+        response = await send_get_request(options, options["--systems-uri"])
+        if response['ret'] is False:
+            return {'ret': False}
+        data = response['data']
+        action_uri = data["Actions"]["#ComputerSystem.Reset"]["target"]
 
-    response = send_post_request(options, action_uri, payload)
+    response = await send_post_request(options, action_uri, payload)
     if response['ret'] is False:
         fail_usage("Error sending power command")
     if options.get("original-action") == "diag":
         return True
     return
 
-def send_get_request(options, uri):
-    full_uri = "https://" + options["--ip"] + ":" + str(options["--ipport"]) + uri
+async def send_get_request(options, uri, stop=True):
+    # with stop=False a failed request returns {'ret': False}
     try:
-        resp = requests.get(full_uri, verify=not "--ssl-insecure" in options,
-                            headers=GET_HEADERS,
-                            auth=(options["--username"], options["--password"]))
-        data = resp.json()
+        response = await options["http"].get_async(uri, headers=GET_HEADERS)
+        if not stop and response.code != 200:
+            return {'ret': False}
+        data = response.json()
     except Exception as e:
+        if not stop:
+            return {'ret': False}
         fail_usage("Failed: send_get_request: " + str(e))
     return {'ret': True, 'data': data}
 
-def send_post_request(options, uri, payload):
-    full_uri = "https://" + options["--ip"] + ":" + str(options["--ipport"]) + uri
+async def send_post_request(options, uri, payload):
     try:
-        requests.post(full_uri, data=json.dumps(payload),
-                      headers=POST_HEADERS, verify=not "--ssl-insecure" in options,
-                      auth=(options["--username"], options["--password"]))
+        await options["http"].post_async(uri, json.dumps(payload), headers=POST_HEADERS)
     except Exception as e:
         fail_usage("Failed: send_post_request: " + str(e))
     return {'ret': True}
 
-def find_systems_resource(options):
-    response = send_get_request(options, options["--redfish-uri"])
+async def find_systems_resource(options):
+    import asyncio
+
+    # Systems collection is at <redfish-uri>/Systems on most controllers, it is
+    # requested together with the service root and used if the root links to it
+    systems_uri = options["--redfish-uri"].rstrip("/") + "/Systems"
+    (response, systems) = await asyncio.gather(send_get_request(options, options["--redfish-uri"]),
+                                               send_get_request(options, systems_uri, stop=False))
     if response['ret'] is False:
         return {'ret': False}
     data = response['data']
@@ -91,10 +104,11 @@ def find_systems_resource(options):
         # Systems resource not found"
         return {'ret': False}
     else:
-        response = send_get_request(options, data["Systems"]["@odata.id"])
-        if response['ret'] is False:
-            return {'ret': False}
-        data = response['data']
+        if systems['ret'] is False or data["Systems"]["@odata.id"].rstrip("/") != systems_uri:
+            systems = await send_get_request(options, data["Systems"]["@odata.id"])
+            if systems['ret'] is False:
+                return {'ret': False}
+        data = systems['data']
 
         # need to be able to handle more than one entry
         for member in data[u'Members']:
@@ -144,18 +158,18 @@ access to control power on a server."
     ## Operate the fencing device
     ####
 
-    # Disable insecure-certificate-warning message
-    if "--ssl-insecure" in opt:
-        import urllib3
-        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-
     # backwards compatibility for <ip>:<port>
     if options["--ip"].count(":") == 1:
         (options["--ip"], options["--ipport"]) = options["--ip"].split(":")
 
+    options["http"] = FencingHttp(options, "https://" + options["--ip"] + ":" + str(options["--ipport"]),
+                                  auth=(options["--username"], options["--password"]),
+                                  timeout=options["--power-timeout"])
+    atexit.register(options["http"].close)
+
     if "--systems-uri" not in opt:
         # Systems URI not provided, find it
-        sysresult = find_systems_resource(options)
+        sysresult = run_async(find_systems_resource(options))
         if sysresult['ret'] is False:
             sys.exit(1)
         else:
@@ -170,7 +184,7 @@ access to control power on a server."
         options["--method"] = "cycle"
         reboot_fn = set_power_status
 
-    result = fence_action(None, options, set_power_status, get_power_status, None, reboot_fn)
+    result = fence_action_async(None, options, set_power_status, get_power_status, None, reboot_fn)
     sys.exit(result)
 
 if __name__ == "__main__":
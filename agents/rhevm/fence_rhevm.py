@@ -1,13 +1,13 @@
 #!@PYTHON@ -tt
 
 import sys, re
-import pycurl, io
 import logging
 import atexit
-import tempfile
 sys.path.append("@FENCEAGENTSLIBDIR@")
 from fencing import *
-from fencing import fail, EC_FETCH_VM_UUID, run_delay
+from fencing import fail, EC_FETCH_VM_UUID, EC_LOGIN_DENIED, run_delay
+from fencing_cache import CredentialCache, LoginExpired
+from fencing_http import FencingHttp
 
 RE_GET_ID = re.compile(r"<vm( .*)? id=\"(.*?)\"", re.IGNORECASE)
 RE_STATUS = re.compile(r"<status>(.*?)</status>", re.IGNORECASE)
@@ -84,75 +84,51 @@ def send_command(opt, command, method="GET"):
 			opt["--api-version"] = "3"
 		logging.debug("auto-detected API version: " + opt["--api-version"])
 
-	## setup correct URL
-	if "--ssl-secure" in opt or "--ssl-insecure" in opt:
-		url = "https:"
-	else:
-		url = "http:"
-	if "--api-path" in opt:
-		api_path = opt["--api-path"]
-	else:
-		api_path = "/ovirt-engine/api"
+	if "session" in opt:
+		try:
+			return opt["session"].request(_send_command, opt, command, method)
+		except LoginExpired:
+			fail(EC_LOGIN_DENIED)
+
+	return _send_command(opt.get("cookie"), opt, command, method)
+
+def login(opt):
+	## cookie of the session, the basic authentication is used only to get it
+	opt.pop("cookie", None)
+	_send_command(None, opt, "")
+	return opt.pop("cookie", None) or None
+
+def _send_command(cookie, opt, command, method="GET"):
 	if "--disable-http-filter" in opt:
 		http_filter = 'false'
 	else:
 		http_filter = 'true'
 
-	url += "//" + opt["--ip"] + ":" + str(opt["--ipport"]) + api_path + "/" + command
-
-	## send command through pycurl
-	conn = pycurl.Curl()
-	web_buffer = io.BytesIO()
-	conn.setopt(pycurl.URL, url.encode("UTF-8"))
-	conn.setopt(pycurl.HTTPHEADER, [
-		"Version: {}".format(opt["--api-version"]),
-		"Content-type: application/xml",
-		"Accept: application/xml",
-		"Prefer: persistent-auth",
-		"Filter: {}".format(http_filter),
-	])
-
-	if "cookie" in opt:
-		conn.setopt(pycurl.COOKIE, opt["cookie"])
-	else:
-		conn.setopt(pycurl.HTTPAUTH, pycurl.HTTPAUTH_BASIC)
-		conn.setopt(pycurl.USERPWD, opt["--username"] + ":" + opt["--password"])
-		if "--use-cookies" in opt:
-			if "--cookie-file" in opt:
-				cookie_file = opt["--cookie-file"]
-			else:
-				cookie_file = tempfile.gettempdir() + "/fence_rhevm_" + opt["--ip"] + "_" + opt["--username"] + "_cookie.dat"
-			conn.setopt(pycurl.COOKIEFILE, cookie_file)
-			conn.setopt(pycurl.COOKIEJAR, cookie_file)
-
-	conn.setopt(pycurl.TIMEOUT, int(opt["--shell-timeout"]))
-
-	if "--ssl-secure" in opt:
-		conn.setopt(pycurl.SSL_VERIFYPEER, 1)
-		conn.setopt(pycurl.SSL_VERIFYHOST, 2)
-	elif "--ssl-insecure" in opt:
-		conn.setopt(pycurl.SSL_VERIFYPEER, 0)
-		conn.setopt(pycurl.SSL_VERIFYHOST, 0)
+	headers = {
+		"Version": opt["--api-version"],
+		"Content-type": "application/xml",
+		"Accept": "application/xml",
+		"Prefer": "persistent-auth",
+		"Filter": http_filter,
+	}
+	if cookie:
+		headers["Cookie"] = cookie
 
+	data = None
 	if method == "POST":
-		conn.setopt(pycurl.POSTFIELDS, "<action />")
+		data = "<action />"
 
-	conn.setopt(pycurl.WRITEFUNCTION, web_buffer.write)
-	conn.perform()
+	response = opt["http"].request(method, command, data, headers=headers, auth=not cookie)
 
-	if "cookie" not in opt and "--use-cookies" in opt:
-		cookie = ""
-		for c in conn.getinfo(pycurl.INFO_COOKIELIST):
-			tokens = c.split("\t",7)
-			cookie = cookie + tokens[5] + "=" + tokens[6] + ";"
+	if cookie and response.code == 401:
+		raise LoginExpired()
 
-		opt["cookie"] = cookie
+	if not cookie and "--use-cookies" in opt:
+		opt["cookie"] = "".join(["%s=%s;" % (name, value) for (name, value) in response.cookies.items()])
 
-	result = web_buffer.getvalue().decode("UTF-8")
+	result = response.text
 
-	logging.debug("url: %s\n", url.encode("UTF-8"))
 	logging.debug("command: %s\n", command.encode("UTF-8"))
-	logging.debug("result: %s\n", result.encode("UTF-8"))
 
 	return result
 
@@ -176,7 +152,7 @@ def define_new_opts():
 		"getopt" : ":",
 		"longopt" : "cookie-file",
 		"help" : "--cookie-file                  Path to cookie file for authentication\n"
-                        "\t\t\t\t  (Default: /tmp/fence_rhevm_ip_username_cookie.dat)",
+                        "\t\t\t\t  (Default: cookies are kept in the cache of fence agents)",
 		"required" : "0",
 		"shortdesc" : "Path to cookie file for authentication",
 		"order" : 2}
@@ -220,6 +196,7 @@ def main():
 		"api_version",
 		"api_path",
 		"disable_http_filter",
+		"cache_ttl",
 	]
 
 	atexit.register(atexit_handler)
@@ -241,6 +218,24 @@ used with RHEV-M REST API to fence virtual machines."
 	## Fence operations
 	####
 	run_delay(options)
+
+	## setup correct URL
+	if "--ssl-secure" in options or "--ssl-insecure" in options:
+		url = "https:"
+	else:
+		url = "http:"
+	url += "//" + options["--ip"] + ":" + str(options["--ipport"]) + options.get("--api-path", "/ovirt-engine/api") + "/"
+
+	cookie_file = None
+	if "--use-cookies" in options and "--cookie-file" in options:
+		cookie_file = options["--cookie-file"]
+	options["http"] = FencingHttp(options, url, auth=(options["--username"], options["--password"]),
+			cookie_file=cookie_file)
+	atexit.register(options["http"].close)
+
+	if "--use-cookies" in options and "--cookie-file" not in options:
+		options["session"] = CredentialCache(options, "fence_rhevm", lambda: login(options), ["--api-path"])
+
 	result = fence_action(None, options, set_power_status, get_power_status, get_list)
 
 	sys.exit(result)
@@ -8,12 +8,14 @@
 ## +-----------------+---------------------------+
 #####
 
-import sys, re, pexpect
+import sys, re
 import logging
 import atexit
 sys.path.append("@FENCEAGENTSLIBDIR@")
 from fencing import *
-from fencing import fail, EC_TIMED_OUT, EC_GENERIC_ERROR
+from fencing import fail, EC_TIMED_OUT, EC_GENERIC_ERROR, lazy_import
+
+pexpect = lazy_import("pexpect")
 
 def get_power_status(conn, options):
 	status_trans = {
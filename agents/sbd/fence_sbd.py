@@ -427,7 +427,8 @@ def main():
     """
     # We need to define "no_password" otherwise we will be ask about it if
     # we don't provide any password.
-    device_opt = ["no_password", "devices", "port", "method", "sbd_path", "crashdump"]
+    device_opt = ["no_password", "devices", "port", "method", "sbd_path", "crashdump",
+            "plug_concurrency", "quorum_policy"]
 
     # close stdout if we get interrupted
     atexit.register(atexit_handler)
@@ -9,6 +9,11 @@ import logging
 import atexit
 import hashlib
 import ctypes
+
+## fence_scsi_check and fence_scsi_check_hardreboot are run by watchdog without options,
+## fencing must not wait for them on stdin
+STDIN_OPTIONS = not os.path.basename(sys.argv[0]).startswith("fence_scsi_check")
+
 sys.path.append("@FENCEAGENTSLIBDIR@")
 from fencing import fail_usage, run_command, atexit_handler, check_input, process_input, show_docs, fence_action, all_opt
 from fencing import run_delay
@@ -1,6 +1,5 @@
 #!@PYTHON@ -tt
 import sys
-import pycurl
 import io
 import json
 import logging
@@ -8,7 +7,9 @@ import atexit
 
 sys.path.append("@FENCEAGENTSLIBDIR@")
 from fencing import *
-from fencing import fail, run_delay, EC_LOGIN_DENIED, EC_STATUS
+from fencing import fail, run_delay, EC_LOGIN_DENIED, EC_STATUS, lazy_import
+
+pycurl = lazy_import("pycurl")
 
 
 state = {True: "on", False: "off"}
@@ -22,12 +22,14 @@
 #	VMware vCenter 4.0.0
 #
 
-import sys, re, pexpect
+import sys, re
 import logging
 import atexit
 sys.path.append("@FENCEAGENTSLIBDIR@")
 from fencing import *
-from fencing import fail, fail_usage, EC_TIMED_OUT, run_delay, frun
+from fencing import fail, fail_usage, EC_TIMED_OUT, run_delay, frun, lazy_import
+
+pexpect = lazy_import("pexpect")
 
 ### CONSTANTS ####
 # VMware type is ESX/ESXi/VC
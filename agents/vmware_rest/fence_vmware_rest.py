@@ -1,12 +1,15 @@
 #!@PYTHON@ -tt
 
 import sys
-import pycurl, io, json
+import io, json
 import logging
 import atexit
 sys.path.append("@FENCEAGENTSLIBDIR@")
 from fencing import *
-from fencing import fail, run_delay, EC_LOGIN_DENIED, EC_STATUS
+from fencing import fail, run_delay, EC_LOGIN_DENIED, EC_STATUS, lazy_import
+from fencing_cache import CredentialCache, LoginExpired
+
+pycurl = lazy_import("pycurl")
 
 if sys.version_info[0] > 2: import urllib.parse as urllib
 else: import urllib
@@ -100,28 +103,43 @@ def connect(opt):
 		conn.setopt(pycurl.SSL_VERIFYPEER, 0)
 		conn.setopt(pycurl.SSL_VERIFYHOST, 0)
 
+	conn.session = CredentialCache(opt, "fence_vmware_rest", lambda: login(conn), ["--api-path"])
 	try:
-		result = send_command(conn, "com/vmware/cis/session", "POST")
+		conn.session.get_credentials()
 	except Exception as e:
 		logging.debug("Failed: {}".format(e))
 		fail(EC_LOGIN_DENIED)
 
-	# set session id for later requests
+	return conn
+
+def login(conn):
 	conn.setopt(pycurl.HTTPHEADER, [
 		"Accept: application/json",
-		"vmware-api-session-id: {}".format(result["value"]),
 	])
 
-	return conn
+	return _send_command(conn, "com/vmware/cis/session", "POST")["value"]
 
 def disconnect(conn):
-	try:
-		send_command(conn, "com/vmware/cis/session", "DELETE")
-	except Exception as e:
-		logging.debug("Failed: {}".format(e))
+	## cached session is used by next runs of the agent
+	if not conn.session.enabled():
+		try:
+			send_command(conn, "com/vmware/cis/session", "DELETE")
+		except Exception as e:
+			logging.debug("Failed: {}".format(e))
 	conn.close()
 
 def send_command(conn, command, method="GET"):
+	def send(session_id):
+		# set session id for the request
+		conn.setopt(pycurl.HTTPHEADER, [
+			"Accept: application/json",
+			"vmware-api-session-id: {}".format(session_id),
+		])
+		return _send_command(conn, command, method, True)
+
+	return conn.session.request(send)
+
+def _send_command(conn, command, method="GET", session=False):
 	url = conn.base_url + command
 
 	conn.setopt(pycurl.URL, url.encode("ascii"))
@@ -150,6 +168,9 @@ def send_command(conn, command, method="GET"):
 	if len(result) > 0:
 		result = json.loads(result)
 
+	if rc == 401 and session:
+		raise LoginExpired()
+
 	if rc != 200:
 		if len(result) > 0:
 			raise Exception("{}: {}".format(rc, 
@@ -195,6 +216,7 @@ def main():
 		"web",
 		"port",
 		"filter",
+		"cache_ttl",
 	]
 
 	atexit.register(atexit_handler)
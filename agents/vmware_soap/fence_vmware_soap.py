@@ -1,15 +1,11 @@
 #!@PYTHON@ -tt
 
 import sys
-import shutil, tempfile, suds
-import logging, requests
+import shutil, tempfile
+import logging
 import atexit, signal
 sys.path.append("@FENCEAGENTSLIBDIR@")
 
-from suds.client import Client
-from suds.sudsobject import Property
-from suds.transport.http import HttpAuthenticated
-from suds.transport import Reply, TransportError
 from fencing import *
 from fencing import fail, fail_usage, EC_STATUS, EC_LOGIN_DENIED, EC_INVALID_PRIVILEGES, EC_WAITING_ON, EC_WAITING_OFF
 from fencing import run_delay
@@ -17,21 +13,28 @@ from fencing import run_delay
 options_global = None
 conn_global = None
 
-class RequestsTransport(HttpAuthenticated):
-	def __init__(self, **kwargs):
-		self.cert = kwargs.pop('cert', None)
-		self.verify = kwargs.pop('verify', True)
-		self.session = requests.Session()
-		# super won't work because not using new style class
-		HttpAuthenticated.__init__(self, **kwargs)
-
-	def send(self, request):
-		self.addcredentials(request)
-		resp = self.session.post(request.url, data=request.message, headers=request.headers, cert=self.cert, verify=self.verify)
-		result = Reply(resp.status_code, resp.headers, resp.content)
-		return result
-
 def soap_login(options):
+	## suds and requests are needed only when we connect to the device
+	import requests
+	from suds.client import Client
+	from suds.sudsobject import Property
+	from suds.transport.http import HttpAuthenticated
+	from suds.transport import Reply
+
+	class RequestsTransport(HttpAuthenticated):
+		def __init__(self, **kwargs):
+			self.cert = kwargs.pop('cert', None)
+			self.verify = kwargs.pop('verify', True)
+			self.session = requests.Session()
+			# super won't work because not using new style class
+			HttpAuthenticated.__init__(self, **kwargs)
+
+		def send(self, request):
+			self.addcredentials(request)
+			resp = self.session.post(request.url, data=request.message, headers=request.headers, cert=self.cert, verify=self.verify)
+			result = Reply(resp.status_code, resp.headers, resp.content)
+			return result
+
 	run_delay(options)
 
 	if "--ssl-secure" in options or "--ssl-insecure" in options:
@@ -92,6 +95,8 @@ def process_results(results, machines, uuid, mappingToUUID):
 	return (machines, uuid, mappingToUUID)
 
 def get_power_status(conn, options):
+	from suds.sudsobject import Property
+
 	mo_ViewManager = Property(options["ServiceContent"].viewManager.value)
 	mo_ViewManager._type = "ViewManager"
 
@@ -185,6 +190,9 @@ def get_power_status(conn, options):
 			fail(EC_STATUS)
 
 def set_power_status(conn, options):
+	import suds
+	from suds.sudsobject import Property
+
 	mo_SearchIndex = Property(options["ServiceContent"].searchIndex.value)
 	mo_SearchIndex._type = "SearchIndex"
 	vm = conn.service.FindByUuid(mo_SearchIndex, vmSearch=1, uuid=options["--uuid"])
@@ -1,13 +1,15 @@
 #!@PYTHON@ -tt
 
 import sys
-import pycurl, io
+import io
 import logging
 import atexit
 import xml.etree.ElementTree as etree
 sys.path.append("@FENCEAGENTSLIBDIR@")
 from fencing import *
-from fencing import fail, run_delay, EC_LOGIN_DENIED, EC_STATUS
+from fencing import fail, run_delay, EC_LOGIN_DENIED, EC_STATUS, lazy_import
+
+pycurl = lazy_import("pycurl")
 
 state = {"POWERED_ON": "on", 'POWERED_OFF': "off", 'SUSPENDED': "off"}
 
@@ -11,12 +11,14 @@
 ##  WTI IPS-800-CE     v1.40h		(no username) ('list' tested)
 #####
 
-import sys, re, pexpect
+import sys, re
 import atexit
 import time
 sys.path.append("@FENCEAGENTSLIBDIR@")
 from fencing import *
-from fencing import fspawn, fail, fail_usage, EC_LOGIN_DENIED
+from fencing import ftelnet, fail, fail_usage, EC_LOGIN_DENIED, lazy_import
+
+pexpect = lazy_import("pexpect")
 
 def get_listing(conn, options, listing_command):
 	listing = ""
@@ -179,6 +181,7 @@ def main():
 
 	all_opt["cmd_prompt"]["default"] = ["RSM>", "MPC>", "IPS>", "TPS>", "NBB>", "NPS>", "VMR>"]
 	all_opt["login_timeout"]["default"] = "10"
+	all_opt["telnet_engine"]["default"] = "native"
 
 	options = check_input(device_opt, process_input(device_opt))
 
@@ -204,9 +207,7 @@ is running because the connection will block any necessary fencing actions."
 
 			options["eol"] = "\r\n"
 
-			conn = fspawn(options, options["--telnet-path"])
-			conn.send("set binary\n")
-			conn.send("open %s -%s\n"%(options["--ip"], options["--ipport"]))
+			conn = ftelnet(options)
 
 			re_login = re.compile(r"(login: )|(Login Name:  )|(username: )|(User Name :)", re.IGNORECASE)
 			re_prompt = re.compile(r"|".join(["(" + x + ")" for x in options["--command-prompt"]]), re.IGNORECASE)
@@ -1,5 +1,7 @@
-import logging, re, time
-from fencing import fail_usage
+import logging, re, time, threading
+from fencing import fail_usage, fail, EC_LOGIN_DENIED
+from fencing_http import FencingHttp, HttpError
+from fencing_cache import CredentialCache, LoginExpired
 
 FENCE_SUBNET_NAME = "fence-subnet"
 FENCE_INBOUND_RULE_NAME = "FENCE_DENY_ALL_INBOUND"
@@ -14,9 +16,17 @@ FENCE_TAG_IP = "FENCE_TAG_IP"
 IP_TYPE_DYNAMIC = "Dynamic"
 MAX_RETRY = 10
 RETRY_WAIT = 5
+NIC_WORKERS = 8
 NETWORK_MGMT_CLIENT_API_VERSION = "2021-05-01"
 AZURE_RHEL8_COMPUTE_VERSION = "27.2.0"
 AZURE_COMPUTE_VERSION_5 = "5.0.0"
+COMPUTE_REST_API_VERSION = "2023-03-01"
+IMDS_TOKEN_URL = "http://169.254.169.254/metadata/identity/oauth2/token?api-version=2018-02-01&resource="
+AZURE_CLOUD_NAMES = {
+    "public": ("AZURE_PUBLIC_CLOUD", "login.microsoftonline.com"),
+    "china": ("AZURE_CHINA_CLOUD", "login.chinacloudapi.cn"),
+    "usgov": ("AZURE_US_GOV_CLOUD", "login.microsoftonline.us")
+}
 
 class AzureSubResource:
     Type = None
@@ -94,10 +104,17 @@ def azure_dep_versions(v):
 
 # Do azure API call to list all virtual machines in a resource group
 def get_vm_list(compute_client,rgName):
+    if isinstance(compute_client, AzureRestClient):
+        return compute_client.list_vms(rgName)
+
     return compute_client.virtual_machines.list(rgName)
 
 # Do azue API call to shutdown a virtual machine
 def do_vm_power_off(compute_client,rgName,vmName, skipShutdown):
+    if isinstance(compute_client, AzureRestClient):
+        compute_client.power_off(rgName, vmName, skipShutdown)
+        return
+
     try:
         # Version is not available in azure-mgmt-compute version 14.0.0 until 27.2.0
         from azure.mgmt.compute import __version__
@@ -114,6 +131,10 @@ def do_vm_power_off(compute_client,rgName,vmName, skipShutdown):
 
 # Do azure API call to start a virtual machine
 def do_vm_start(compute_client,rgName,vmName):
+    if isinstance(compute_client, AzureRestClient):
+        compute_client.start(rgName, vmName)
+        return
+
     try:
         # Version is not available in azure-mgmt-compute version 14.0.0 until 27.2.0
         from azure.mgmt.compute import __version__
@@ -141,11 +162,51 @@ def get_vm_resource(compute_client, rgName, vmName):
 
     return compute_client.virtual_machines.get(resource_group_name=rgName, vm_name=vmName,expand="instanceView")
 
+# Power state of a virtual machine from its instance view (running, deallocated, stopped, ...)
+def get_vm_power_state(compute_client, rgName, vmName):
+    if isinstance(compute_client, AzureRestClient):
+        statuses = compute_client.get_instance_view(rgName, vmName).get("statuses", [])
+        codes = [status.get("code", "") for status in statuses]
+    else:
+        vm = get_vm_resource(compute_client, rgName, vmName)
+        codes = [status.code for status in vm.instance_view.statuses]
+
+    for code in codes:
+        if code.startswith("PowerState"):
+            return code.split("/")[1]
+
+    return "unknown"
+
+# Virtual networks and network security groups are the same for all network
+# interfaces of the VM and they do not change while it is fenced, so they are
+# looked up only once by the agent. Lookups of the same resource by more
+# threads wait for the first one.
+lookupCache = {}
+lookupLocks = {}
+lookupLock = threading.Lock()
+
+def get_cached_resource(resourceId, getFn):
+    key = resourceId.lower()
+    with lookupLock:
+        keyLock = lookupLocks.setdefault(key, threading.Lock())
+
+    with keyLock:
+        if key not in lookupCache:
+            lookupCache[key] = getFn()
+        else:
+            logging.debug("{get_cached_resource} using %s looked up before" % resourceId)
+        return lookupCache[key]
+
+def get_vnet(network_client, subnetResource):
+    vnetId = "/subscriptions/%s/resourceGroups/%s/providers/Microsoft.Network/virtualNetworks/%s" % \
+        (subnetResource.SubscriptionId, subnetResource.ResourceGroupName, subnetResource.ResourceName)
+    return get_cached_resource(vnetId,
+        lambda: network_client.virtual_networks.get(subnetResource.ResourceGroupName, subnetResource.ResourceName))
 
 def get_fence_subnet_for_config(ipConfig, network_client):
     subnetResource = get_azure_resource(ipConfig.subnet.id)
     logging.debug("{get_fence_subnet_for_config} testing virtual network %s in resource group %s for a fence subnet" %(subnetResource.ResourceName, subnetResource.ResourceGroupName))
-    vnet = network_client.virtual_networks.get(subnetResource.ResourceGroupName, subnetResource.ResourceName)
+    vnet = get_vnet(network_client, subnetResource)
     return get_subnet(vnet, FENCE_SUBNET_NAME)
 
 def get_subnet(vnet, subnetName):
@@ -168,7 +229,8 @@ def test_fence_subnet(fenceSubnet, nic, network_client):
         else:
             nsgResource = get_azure_resource(fenceSubnet.network_security_group.id)
             logging.info("{test_fence_subnet} Getting network security group %s in resource group %s" % (nsgResource.ResourceName, nsgResource.ResourceGroupName))
-            nsg = network_client.network_security_groups.get(nsgResource.ResourceGroupName, nsgResource.ResourceName)
+            nsg = get_cached_resource(fenceSubnet.network_security_group.id,
+                lambda: network_client.network_security_groups.get(nsgResource.ResourceGroupName, nsgResource.ResourceName))
             inboundRule = get_inbound_rule_for_nsg(nsg)
             outboundRule = get_outbound_rule_for_nsg(nsg)
             if not outboundRule:
@@ -204,25 +266,41 @@ def get_rule_for_nsg(nsg, ruleName, direction):
 
     return None
 
+# Run fn(nicRef) for all network interfaces of the VM at once, so a VM with more
+# interfaces is not fenced longer than a VM with one. Results are returned in
+# the order of the interfaces.
+def for_each_nic(vm, fn):
+    nicRefs = vm.network_profile.network_interfaces
+    if len(nicRefs) <= 1:
+        return [fn(nicRef) for nicRef in nicRefs]
+
+    import concurrent.futures
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(nicRefs), NIC_WORKERS)) as executor:
+        return list(executor.map(fn, nicRefs))
+
+def get_nic_network_state(network_client, nicRef):
+    nicOK = True
+    nicresource = get_azure_resource(nicRef.id)
+    nic = network_client.network_interfaces.get(nicresource.ResourceGroupName, nicresource.ResourceName)
+    for ipConfig in nic.ip_configurations:
+        logging.info("{get_network_state} Testing ip configuration %s" % ipConfig.name)
+        fenceSubnet = get_fence_subnet_for_config(ipConfig, network_client)
+        testOk = test_fence_subnet(fenceSubnet, nic, network_client)
+        if not testOk:
+            nicOK = False
+        elif fenceSubnet.id.lower() != ipConfig.subnet.id.lower():
+            logging.info("{get_network_state} IP configuration %s is not in fence subnet (ip subnet: %s, fence subnet: %s)" % (ipConfig.name, ipConfig.subnet.id.lower(), fenceSubnet.id.lower()))
+            nicOK = False
+
+    return nicOK
+
 def get_network_state(compute_client, network_client, rgName, vmName):
     result = FENCE_STATE_ON
 
     try:
         vm = get_vm_resource(compute_client, rgName, vmName)
 
-        allNICOK = True
-        for nicRef in vm.network_profile.network_interfaces:
-            nicresource = get_azure_resource(nicRef.id)
-            nic = network_client.network_interfaces.get(nicresource.ResourceGroupName, nicresource.ResourceName)
-            for ipConfig in nic.ip_configurations:
-                logging.info("{get_network_state} Testing ip configuration %s" % ipConfig.name)
-                fenceSubnet = get_fence_subnet_for_config(ipConfig, network_client)
-                testOk = test_fence_subnet(fenceSubnet, nic, network_client)
-                if not testOk:
-                    allNICOK = False
-                elif fenceSubnet.id.lower() != ipConfig.subnet.id.lower():
-                    logging.info("{get_network_state} IP configuration %s is not in fence subnet (ip subnet: %s, fence subnet: %s)" % (ipConfig.name, ipConfig.subnet.id.lower(), fenceSubnet.id.lower()))
-                    allNICOK = False
+        allNICOK = all(for_each_nic(vm, lambda nicRef: get_nic_network_state(network_client, nicRef)))
         if allNICOK:
             logging.info("{get_network_state} All IP configurations of all network interfaces are in the fence subnet. Declaring VM as off")
             result = FENCE_STATE_OFF
@@ -231,74 +309,81 @@ def get_network_state(compute_client, network_client, rgName, vmName):
 
     return result
 
-def set_network_state(compute_client, network_client, rgName, vmName, operation):
+def set_nic_network_state(network_client, nicRef, operation):
     import msrestazure.azure_exceptions
+
+    for attempt in range(0, MAX_RETRY):
+        try:
+            nicresource = get_azure_resource(nicRef.id)
+            nic = network_client.network_interfaces.get(nicresource.ResourceGroupName, nicresource.ResourceName)
+
+            if not nic.tags and operation == "block":
+                nic.tags = {}
+
+            logging.info("{set_network_state} Searching for tags required to unfence this virtual machine")
+            for ipConfig in nic.ip_configurations:
+                if operation == "block":
+                    fenceSubnet = get_fence_subnet_for_config(ipConfig, network_client)
+                    testOk = test_fence_subnet(fenceSubnet, nic, network_client)
+                    if testOk:
+                        logging.info("{set_network_state} Changing subnet of ip config of nic %s" % nic.id)
+                        nic.tags[("%s_%s" % (FENCE_TAG_SUBNET_ID, ipConfig.name))] = ipConfig.subnet.id
+                        nic.tags[("%s_%s" % (FENCE_TAG_IP_TYPE, ipConfig.name))] = ipConfig.private_ip_allocation_method
+                        nic.tags[("%s_%s" % (FENCE_TAG_IP, ipConfig.name))] = ipConfig.private_ip_address
+                        ipConfig.subnet = fenceSubnet
+                        ipConfig.private_ip_allocation_method = IP_TYPE_DYNAMIC
+                    else:
+                        fail_usage("{set_network_state} Network interface id %s does not have a network security group." % nic.id)
+                elif operation == "unblock":
+                    if not nic.tags:
+                        fail_usage("{set_network_state} IP configuration %s is missing the required resource tags (empty)" % ipConfig.name)
+
+                    subnetId = nic.tags.pop("%s_%s" % (FENCE_TAG_SUBNET_ID, ipConfig.name))
+                    ipType = nic.tags.pop("%s_%s" % (FENCE_TAG_IP_TYPE, ipConfig.name))
+                    ipAddress = nic.tags.pop("%s_%s" % (FENCE_TAG_IP, ipConfig.name))
+
+                    if (subnetId and ipType and (ipAddress or (ipType.lower() == IP_TYPE_DYNAMIC.lower()))):
+                        logging.info("{set_network_state} tags found (subnetId: %s, ipType: %s, ipAddress: %s)" % (subnetId, ipType, ipAddress))
+
+                        subnetResource = get_azure_resource(subnetId)
+                        vnet = get_vnet(network_client, subnetResource)
+                        logging.info("{set_network_state} looking for subnet %s" % len(subnetResource.SubResources))
+                        oldSubnet = get_subnet(vnet, subnetResource.SubResources[0].Name)
+                        if not oldSubnet:
+                            fail_usage("{set_network_state} subnet %s not found" % subnetId)
+
+                        ipConfig.subnet = oldSubnet
+                        ipConfig.private_ip_allocation_method = ipType
+                        if ipAddress:
+                            ipConfig.private_ip_address = ipAddress
+                    else:
+                        fail_usage("{set_network_state} IP configuration %s is missing the required resource tags(subnetId: %s, ipType: %s, ipAddress: %s)" % (ipConfig.name, subnetId, ipType, ipAddress))
+
+            logging.info("{set_network_state} updating nic %s" % (nic.id))
+            op = network_client.network_interfaces.create_or_update(nicresource.ResourceGroupName, nicresource.ResourceName, nic)
+            # wait for the update in this thread, the other interfaces are updated meanwhile
+            if hasattr(op, "result"):
+                op.result()
+            logging.info("{set_network_state} nic %s updated" % (nic.id))
+            return True
+        except msrestazure.azure_exceptions.CloudError as cex:
+            logging.error("{set_network_state} CloudError in attempt %s '%s'" % (attempt, cex))
+            if cex.error and cex.error.error and cex.error.error.lower() == "PrivateIPAddressIsBeingCleanedUp":
+                logging.error("{set_network_state} PrivateIPAddressIsBeingCleanedUp")
+            time.sleep(RETRY_WAIT)
+
+        except Exception as ex:
+            logging.error("{set_network_state} Exception of type %s: %s" % (type(ex).__name__, ex))
+            break
+
+    return False
+
+def set_network_state(compute_client, network_client, rgName, vmName, operation):
     logging.info("{set_network_state} Setting state %s for  %s in resource group %s" % (operation, vmName, rgName))
 
     vm = get_vm_resource(compute_client,rgName, vmName)
 
-    operations = []
-    for nicRef in vm.network_profile.network_interfaces:
-        for attempt in range(0, MAX_RETRY):
-            try:
-                nicresource = get_azure_resource(nicRef.id)
-                nic = network_client.network_interfaces.get(nicresource.ResourceGroupName, nicresource.ResourceName)
-
-                if not nic.tags and operation == "block":
-                    nic.tags = {}
-
-                logging.info("{set_network_state} Searching for tags required to unfence this virtual machine")
-                for ipConfig in nic.ip_configurations:
-                    if operation == "block":
-                        fenceSubnet = get_fence_subnet_for_config(ipConfig, network_client)
-                        testOk = test_fence_subnet(fenceSubnet, nic, network_client)
-                        if testOk:
-                            logging.info("{set_network_state} Changing subnet of ip config of nic %s" % nic.id)
-                            nic.tags[("%s_%s" % (FENCE_TAG_SUBNET_ID, ipConfig.name))] = ipConfig.subnet.id
-                            nic.tags[("%s_%s" % (FENCE_TAG_IP_TYPE, ipConfig.name))] = ipConfig.private_ip_allocation_method
-                            nic.tags[("%s_%s" % (FENCE_TAG_IP, ipConfig.name))] = ipConfig.private_ip_address
-                            ipConfig.subnet = fenceSubnet
-                            ipConfig.private_ip_allocation_method = IP_TYPE_DYNAMIC
-                        else:
-                            fail_usage("{set_network_state} Network interface id %s does not have a network security group." % nic.id)
-                    elif operation == "unblock":
-                        if not nic.tags:
-                            fail_usage("{set_network_state} IP configuration %s is missing the required resource tags (empty)" % ipConfig.name)
-
-                        subnetId = nic.tags.pop("%s_%s" % (FENCE_TAG_SUBNET_ID, ipConfig.name))
-                        ipType = nic.tags.pop("%s_%s" % (FENCE_TAG_IP_TYPE, ipConfig.name))
-                        ipAddress = nic.tags.pop("%s_%s" % (FENCE_TAG_IP, ipConfig.name))
-
-                        if (subnetId and ipType and (ipAddress or (ipType.lower() == IP_TYPE_DYNAMIC.lower()))):
-                            logging.info("{set_network_state} tags found (subnetId: %s, ipType: %s, ipAddress: %s)" % (subnetId, ipType, ipAddress))
-
-                            subnetResource = get_azure_resource(subnetId)
-                            vnet = network_client.virtual_networks.get(subnetResource.ResourceGroupName, subnetResource.ResourceName)
-                            logging.info("{set_network_state} looking for subnet %s" % len(subnetResource.SubResources))
-                            oldSubnet = get_subnet(vnet, subnetResource.SubResources[0].Name)
-                            if not oldSubnet:
-                                fail_usage("{set_network_state} subnet %s not found" % subnetId)
-
-                            ipConfig.subnet = oldSubnet
-                            ipConfig.private_ip_allocation_method = ipType
-                            if ipAddress:
-                                ipConfig.private_ip_address = ipAddress
-                        else:
-                            fail_usage("{set_network_state} IP configuration %s is missing the required resource tags(subnetId: %s, ipType: %s, ipAddress: %s)" % (ipConfig.name, subnetId, ipType, ipAddress))
-
-                logging.info("{set_network_state} updating nic %s" % (nic.id))
-                op = network_client.network_interfaces.create_or_update(nicresource.ResourceGroupName, nicresource.ResourceName, nic)
-                operations.append(op)
-                break
-            except msrestazure.azure_exceptions.CloudError as cex:
-                logging.error("{set_network_state} CloudError in attempt %s '%s'" % (attempt, cex))
-                if cex.error and cex.error.error and cex.error.error.lower() == "PrivateIPAddressIsBeingCleanedUp":
-                    logging.error("{set_network_state} PrivateIPAddressIsBeingCleanedUp")
-                time.sleep(RETRY_WAIT)
-
-            except Exception as ex:
-                logging.error("{set_network_state} Exception of type %s: %s" % (type(ex).__name__, ex))
-                break
+    return all(for_each_nic(vm, lambda nicRef: set_nic_network_state(network_client, nicRef, operation)))
 
 def get_azure_config(options):
     config = AzureConfiguration()
@@ -519,3 +604,132 @@ def get_azure_network_client(config):
             api_version=NETWORK_MGMT_CLIENT_API_VERSION
         )
     return network_client
+
+# Endpoints of the cloud without Azure SDK, from get_azure_arm_endpoints() or the
+# metadata endpoint of Azure Stack
+def get_azure_rest_endpoints(config):
+    cloud = (config.Cloud or "public").lower()
+    if cloud == "stack":
+        if not config.MetadataEndpoint:
+            fail_usage("metadata-endpoint not specified")
+        endpoints = get_cloud_from_arm_metadata_endpoint(config.MetadataEndpoint)
+    elif cloud in AZURE_CLOUD_NAMES:
+        endpoints = get_azure_arm_endpoints(*AZURE_CLOUD_NAMES[cloud])
+    else:
+        fail_usage("Cloud %s is not supported by the REST API of Azure Resource Manager" % config.Cloud)
+
+    endpoints["resource_manager"] = endpoints["resource_manager"].rstrip("/")
+    return endpoints
+
+class AzureRestError(Exception):
+    pass
+
+class AzureVirtualMachine:
+    def __init__(self, name):
+        self.name = name
+
+# Client of Azure Resource Manager which does power operations of virtual machines
+# by its REST API, without Azure SDK. It is used instead of the compute client by
+# get_vm_list(), get_vm_power_state(), do_vm_power_off() and do_vm_start().
+#
+# Access token of the managed identity or the service principal is kept by
+# CredentialCache between runs of the agent.
+class AzureRestClient:
+    def __init__(self, options, config):
+        self.config = config
+        self.endpoints = get_azure_rest_endpoints(config)
+        self.http = FencingHttp(options, timeout=options["--power-timeout"])
+        self.token = CredentialCache(options, "azure_arm", self.login,
+            ["--tenantId", "--cloud", "--metadata-endpoint", "--msi"])
+
+    def login(self):
+        import urllib.parse
+
+        scope = self.endpoints["credential_scopes"][0]
+        try:
+            if self.config.UseMSI:
+                resource = scope[:-len("/.default")] if scope.endswith("/.default") else scope
+                response = self.http.get(IMDS_TOKEN_URL + urllib.parse.quote(resource, safe=""),
+                    headers={"Metadata": "true"})
+            else:
+                authority = self.endpoints["authority_hosts"]
+                if "://" not in authority:
+                    authority = "https://" + authority
+                response = self.http.post("%s/%s/oauth2/v2.0/token" % (authority.rstrip("/"), self.config.Tenantid),
+                    urllib.parse.urlencode({
+                        "grant_type": "client_credentials",
+                        "client_id": self.config.ApplicationId,
+                        "client_secret": self.config.ApplicationKey,
+                        "scope": scope
+                    }), headers={"Content-Type": "application/x-www-form-urlencoded"})
+
+            if response.code != 200:
+                logging.error("{AzureRestClient} Unable to get access token: %s %s" % (response.code, response.text))
+                return None
+
+            token = response.json()
+            return ({"access_token": token["access_token"]}, int(token["expires_in"]))
+        except (HttpError, ValueError, KeyError) as e:
+            logging.error("{AzureRestClient} Unable to get access token: %s" % e)
+            return None
+
+    def _request(self, credentials, method, uri, data=None):
+        if credentials is None:
+            fail(EC_LOGIN_DENIED)
+
+        separator = "&" if "?" in uri else "?"
+        if "api-version=" not in uri:
+            uri += "%sapi-version=%s" % (separator, COMPUTE_REST_API_VERSION)
+        if uri.startswith("/"):
+            uri = self.endpoints["resource_manager"] + uri
+
+        response = self.http.request(method, uri, data=data,
+            headers={"Authorization": "Bearer %s" % credentials["access_token"]})
+        if response.code == 401:
+            raise LoginExpired()
+        if response.code >= 400:
+            try:
+                error = response.json()["error"]
+                message = "%s: %s" % (error["code"], error["message"])
+            except (ValueError, KeyError, TypeError):
+                message = response.text
+            raise AzureRestError("%s %s returned %s: %s" % (method, uri.split("?")[0], response.code, message))
+
+        return response.json() if response.body else {}
+
+    def request(self, method, uri, data=None):
+        # uri is relative to the resource manager, or nextLink returned by it
+        try:
+            return self.token.request(self._request, method, uri, data)
+        except LoginExpired:
+            fail(EC_LOGIN_DENIED)
+        except HttpError as e:
+            raise AzureRestError(str(e))
+
+    def vm_uri(self, rgName, vmName=None):
+        uri = "/subscriptions/%s/resourceGroups/%s/providers/Microsoft.Compute/virtualMachines" % \
+            (self.config.SubscriptionId, rgName)
+        return uri if vmName is None else uri + "/" + vmName
+
+    def list_vms(self, rgName):
+        # objects with name of the virtual machine, like those of compute client
+        vms = []
+        uri = self.vm_uri(rgName)
+        while uri:
+            result = self.request("GET", uri)
+            vms.extend([AzureVirtualMachine(vm["name"]) for vm in result.get("value", [])])
+            uri = result.get("nextLink")
+        return vms
+
+    def get_instance_view(self, rgName, vmName):
+        return self.request("GET", self.vm_uri(rgName, vmName) + "/instanceView")
+
+    def power_off(self, rgName, vmName, skipShutdown):
+        # like begin_power_off() of compute client, the agent does not wait for the operation
+        self.request("POST", self.vm_uri(rgName, vmName) + "/powerOff?skipShutdown=%s" % str(bool(skipShutdown)).lower(), "")
+
+    def start(self, rgName, vmName):
+        self.request("POST", self.vm_uri(rgName, vmName) + "/start", "")
+
+    def close(self):
+        self.http.close()
@@ -0,0 +1,42 @@
+## Check that fence agent does not import transport modules or SDKs when only
+## metadata is requested. Such modules have to be imported by lazy_import() or
+## inside of the functions which use them.
+##
+## Usage: ./check_imports.py fence-agent (e.g. wti/fence_wti)
+##
+
+import sys, os, io, runpy
+import importlib.util
+
+HEAVY_MODULES = ["pexpect", "pycurl", "boto3", "botocore.session", "googleapiclient.discovery",
+		"novaclient.client", "kubernetes.client", "suds.client"]
+
+def main():
+	agent = sys.argv[1]
+
+	## metadata has to be created by the agent itself, not by a running daemon
+	os.environ["FENCE_AGENTD_SOCKET"] = ""
+	sys.argv = [agent, "-o", "metadata"]
+
+	stdout = sys.stdout
+	sys.stdout = io.StringIO()
+	try:
+		runpy.run_path(agent, run_name="__main__")
+	except SystemExit:
+		pass
+	finally:
+		sys.stdout = stdout
+
+	## lazy modules are in sys.modules before their first use
+	loaded = [name for name in HEAVY_MODULES if name in sys.modules and \
+			not isinstance(sys.modules[name], importlib.util._LazyModule)]
+
+	if loaded:
+		print("ERROR: %s imports %s when only metadata is requested" % (agent, ", ".join(loaded)))
+		sys.stdout.flush()
+
+	## skip atexit handlers of the agent
+	os._exit(1 if loaded else 0)
+
+if __name__ == "__main__":
+	main()
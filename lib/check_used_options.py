@@ -21,6 +21,9 @@ def main():
 	## add UUID which is derived automatically from --plug if possible
 	available["--uuid"] = True
 
+	## add --plugs which is created from --plug by fence_action()
+	available["--plugs"] = True
+
 	## all_opt defined in fence agent are found
 	agent_file = open(agent)
 	opt_re = re.compile(r"\s*all_opt\[\"([^\"]*)\"\] = {")
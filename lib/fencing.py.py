@@ -1,21 +1,124 @@
 #!@PYTHON@ -tt
 
-import sys, getopt, time, os, uuid, pycurl, stat
-import pexpect, re, syslog
+import sys, time, os, stat, random
+
+RELEASE_VERSION = "@RELEASE_VERSION@"
+
+## Metadata of the installed agents, generated at build time (see make/fenceman.mk)
+METADATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "metadata")
+
+## Control sockets of SSH connections shared by runs of the agents (see --ssh-persist)
+SSH_CONTROL_DIR = "@FENCETMPDIR@/ssh"
+
+##
+## stdin can be read only once, so the early metadata check and
+## _parse_input_stdin() share the lines read here
+##
+## Agents which do not read options from stdin (e.g. the watchdog checks of
+## fence_scsi) set STDIN_OPTIONS = False in the main script before importing
+## fencing, so stdin is not read for them at all.
+#####
+def _reads_stdin():
+	return len(sys.argv) <= 1 and getattr(sys.modules.get("__main__"), "STDIN_OPTIONS", True)
+
+def _read_stdin():
+	if _read_stdin.lines is None:
+		_read_stdin.lines = sys.stdin.readlines()
+	return _read_stdin.lines
+
+_read_stdin.lines = None
+
+def _requested_action():
+	if len(sys.argv) > 1:
+		args = sys.argv[1:]
+		for (i, arg) in enumerate(args):
+			if arg in ["-o", "--action"] and i + 1 < len(args):
+				return args[i + 1]
+			elif arg.startswith("--action="):
+				return arg[len("--action="):]
+			elif arg.startswith("-o") and len(arg) > 2:
+				return arg[2:]
+	elif _reads_stdin():
+		for line in _read_stdin():
+			(name, value) = (line.strip() + "=").split("=", 1)
+			if name.strip() == "action":
+				return value[:-1].strip().strip("\"")
+	return None
+
+##
+## Print metadata generated at build time without importing anything else,
+## if there is no such file the agent creates the metadata as usual
+#####
+def _show_cached_metadata():
+	if _requested_action() != "metadata":
+		return
+
+	try:
+		with open(os.path.join(METADATA_DIR, "%s-%s.xml" % (os.path.basename(sys.argv[0]), RELEASE_VERSION))) as metadata_file:
+			metadata = metadata_file.read()
+	except IOError:
+		return
+
+	sys.stdout.write(metadata)
+	sys.stdout.flush()
+	sys.exit(0)
+
+## Answer metadata requests and hand the invocation over to a running fencing_daemon
+## before the expensive imports
+if os.path.basename(getattr(sys.modules.get("__main__"), "__file__", "")).startswith("fence_"):
+	_show_cached_metadata()
+
+import fencing_daemon
+fencing_daemon.delegate(_read_stdin.lines)
+
+import importlib.util
+import re
 import logging
 import subprocess
 import threading
 import shlex
+import selectors
+import locale
 import socket
 import textwrap
+import contextlib
+import json
+import hashlib
+import atexit
 import __main__
 
 import itertools
 
-RELEASE_VERSION = "@RELEASE_VERSION@"
+##
+## Import module on first use of its attributes, which works like "import name"
+## (the top-level package is returned) but the module is executed only when it
+## is used. The module is registered in sys.modules, so any later import of it
+## gets the same lazy module.
+##
+## Transport modules (pexpect, pycurl) and SDKs are imported this way, so that
+## metadata, help and validate-all do not pay for the modules they do not use.
+## ImportError is raised immediately if the module does not exist.
+#####
+def lazy_import(name):
+	if name not in sys.modules:
+		spec = importlib.util.find_spec(name)
+		if spec is None:
+			raise ImportError("No module named '%s'" % name, name=name)
+		loader = importlib.util.LazyLoader(spec.loader)
+		spec.loader = loader
+		module = importlib.util.module_from_spec(spec)
+		sys.modules[name] = module
+		loader.exec_module(module)
+		if "." in name:
+			(parent, child) = name.rsplit(".", 1)
+			setattr(sys.modules[parent], child, module)
+	return sys.modules[name.split(".")[0]]
+
+pexpect = lazy_import("pexpect")
+pycurl = lazy_import("pycurl")
 
 __all__ = ['atexit_handler', 'check_input', 'process_input', 'all_opt', 'show_docs',
-		'fence_login', 'fence_action', 'fence_logout']
+		'fence_login', 'fence_action', 'fence_action_async', 'fence_logout']
 
 EC_OK = 0
 EC_GENERIC_ERROR = 1
@@ -33,6 +136,12 @@ EC_FETCH_VM_UUID = 12
 
 LOG_FORMAT = "%(asctime)-15s %(levelname)s: %(message)s"
 
+# poll_until() defaults: first polls are done quickly, then the interval grows
+POLL_INTERVAL = 0.25
+POLL_FAST_COUNT = 2
+POLL_BACKOFF = 2
+POLL_JITTER = 0.1
+
 all_opt = {
 	"help"    : {
 		"getopt" : "h",
@@ -74,6 +183,13 @@ all_opt = {
 		"required" : "0",
 		"shortdesc" : "Write debug information to given file",
 		"order" : 53},
+	"timing_file" : {
+		"getopt" : ":",
+		"longopt" : "timing-file",
+		"help" : "--timing-file=[file]           Append timing of fence phases as JSON to file (or \"syslog\")",
+		"required" : "0",
+		"shortdesc" : "Write timing of fence phases as JSON to given file or syslog",
+		"order" : 53},
 	"delay" : {
 		"getopt" : ":",
 		"longopt" : "delay",
@@ -194,6 +310,15 @@ all_opt = {
 		"help" : "--ssh-options=[options]        SSH options to use",
 		"required" : "0",
 		"order" : 1},
+	"ssh_persist" : {
+		"getopt" : ":",
+		"longopt" : "ssh-persist",
+		"type" : "second",
+		"help" : "--ssh-persist=[seconds]        Keep SSH connection open for reuse by next runs for X seconds (0 disables sharing)",
+		"required" : "0",
+		"shortdesc" : "Seconds to keep SSH connection open for next runs of the agent with the same device and credentials",
+		"default" : "0",
+		"order" : 200},
 	"ssl" : {
 		"getopt" : "z",
 		"longopt" : "ssl",
@@ -310,6 +435,24 @@ all_opt = {
 		"help" : "-R, --snmp-priv-passwd-script  Script to run to retrieve privacy password",
 		"required" : "0",
 		"order" : 1},
+	"snmp_engine" : {
+		"getopt" : ":",
+		"longopt" : "snmp-engine",
+		"help" : "--snmp-engine=[engine]         SNMP implementation to use (native|net-snmp)",
+		"required" : "0",
+		"shortdesc" : "SNMP implementation to use",
+		"default" : "native",
+		"choices" : ["native", "net-snmp"],
+		"order" : 1},
+	"snmp_max_repetitions" : {
+		"getopt" : ":",
+		"longopt" : "snmp-max-repetitions",
+		"type" : "integer",
+		"help" : "--snmp-max-repetitions=[num]   Table rows requested at once by SNMPv2c/v3 GETBULK (0 disables GETBULK)",
+		"required" : "0",
+		"shortdesc" : "Table rows requested at once by SNMPv2c/v3 GETBULK",
+		"default" : "10",
+		"order" : 1},
 	"inet4_only" : {
 		"getopt" : "4",
 		"longopt" : "inet4-only",
@@ -329,6 +472,25 @@ all_opt = {
 		"default" : ",",
 		"required" : "0",
 		"order" : 100},
+	"cache_ttl" : {
+		"getopt" : ":",
+		"longopt" : "cache-ttl",
+		"type" : "second",
+		"help" : "--cache-ttl=[seconds]          Keep results of device discovery cached for X seconds (0 disables the cache)",
+		"required" : "0",
+		"shortdesc" : "Seconds to keep results of device discovery cached",
+		"default" : "3600",
+		"order" : 200},
+	"plug_concurrency" : {
+		"getopt" : ":",
+		"longopt" : "plug-concurrency",
+		"type" : "integer",
+		"help" : "--plug-concurrency=[count]     Number of plugs to operate on in parallel "
+				"when more than 1 plug is specified",
+		"shortdesc" : "Number of plugs to operate on in parallel",
+		"default" : "1",
+		"required" : "0",
+		"order" : 100},
 	"separator" : {
 		"getopt" : "C:",
 		"longopt" : "separator",
@@ -378,10 +540,27 @@ all_opt = {
 		"getopt" : ":",
 		"longopt" : "stonith-status-sleep",
 		"type" : "second",
-		"help" : "--stonith-status-sleep=[seconds]   Sleep X seconds between status calls during a STONITH action",
+		"help" : "--stonith-status-sleep=[seconds]   Sleep at most X seconds between status calls during a STONITH action",
 		"default" : "1",
 		"required" : "0",
 		"order" : 200},
+	"quorum_policy" : {
+		"getopt" : ":",
+		"longopt" : "quorum-policy",
+		"help" : "--quorum-policy=[policy]       When to stop waiting for commands run in parallel (all|majority|first)",
+		"required" : "0",
+		"shortdesc" : "When to stop waiting for commands run in parallel",
+		"choices" : ["all", "majority", "first"],
+		"default" : "majority",
+		"order" : 200},
+	"quorum_delay" : {
+		"getopt" : ":",
+		"longopt" : "quorum-delay",
+		"type" : "integer",
+		"help" : "--quorum-delay=[milliseconds]  Wait X milliseconds for all commands before accepting a majority",
+		"default" : "5000",
+		"required" : "0",
+		"order" : 200},
 	"missing_as_off" : {
 		"getopt" : "",
 		"longopt" : "missing-as-off",
@@ -424,6 +603,15 @@ all_opt = {
 		"required" : "0",
 		"default" : "@TELNET_PATH@",
 		"order": 300},
+	"telnet_engine" : {
+		"getopt" : ":",
+		"longopt" : "telnet-engine",
+		"help" : "--telnet-engine=[engine]       Telnet implementation to use (native|telnet)",
+		"required" : "0",
+		"shortdesc" : "Telnet implementation to use",
+		"default" : "telnet",
+		"choices" : ["native", "telnet"],
+		"order" : 1},
 	"ssh_path" : {
 		"getopt" : ":",
 		"longopt" : "ssh-path",
@@ -452,6 +640,13 @@ all_opt = {
 		"required" : "0",
 		"default" : "@SNMPWALK_PATH@",
 		"order" : 300},
+	"snmpbulkwalk_path" : {
+		"getopt" : ":",
+		"longopt" : "snmpbulkwalk-path",
+		"help" : "--snmpbulkwalk-path=[path]     Path to snmpbulkwalk binary",
+		"required" : "0",
+		"default" : "@SNMPBULKWALK_PATH@",
+		"order" : 300},
 	"snmpset_path" : {
 		"getopt" : ":",
 		"longopt" : "snmpset-path",
@@ -494,42 +689,237 @@ DEPENDENCY_OPT = {
 			 "version", "action", "agent", "power_timeout",
 			 "shell_timeout", "login_timeout", "disable_timeout",
 			 "power_wait", "stonith_status_sleep", "retry_on", "delay",
-			 "plug_separator", "quiet"],
+			 "plug_separator", "quiet", "timing_file"],
 		"passwd" : ["passwd_script"],
 		"sudo" : ["sudo_path"],
-		"secure" : ["identity_file", "ssh_options", "ssh_path", "inet4_only", "inet6_only"],
-		"telnet" : ["telnet_path"],
+		"secure" : ["identity_file", "ssh_options", "ssh_path", "ssh_persist", "inet4_only", "inet6_only"],
+		"telnet" : ["telnet_engine", "telnet_path"],
 		"ipaddr" : ["ipport"],
 		"port" : ["separator"],
+		"quorum_policy" : ["quorum_delay"],
 		"ssl" : ["ssl_secure", "ssl_insecure", "gnutlscli_path"],
 		"snmp" : ["snmp_auth_prot", "snmp_sec_level", "snmp_priv_prot", \
-			"snmp_priv_passwd", "snmp_priv_passwd_script", "community", \
-			"snmpset_path", "snmpget_path", "snmpwalk_path"]
+			"snmp_priv_passwd", "snmp_priv_passwd_script", "community", "snmp_engine", \
+			"snmp_max_repetitions", "snmpset_path", "snmpget_path", "snmpwalk_path", "snmpbulkwalk_path", \
+			"cache_ttl"]
 	}
 
-class fspawn(pexpect.spawn):
-	def __init__(self, options, command, **kwargs):
-		if sys.version_info[0] > 2:
-			kwargs.setdefault('encoding', 'utf-8')
-		logging.info("Running command: %s", command)
-		pexpect.spawn.__init__(self, command, **kwargs)
-		self.opt = options
+## pexpect.spawn with logging of the conversation, the class is created when
+## the first connection is spawned as it needs pexpect to be loaded
+def fspawn(options, command, **kwargs):
+	if fspawn.spawn_class is None:
+		class _fspawn(pexpect.spawn):
+			def __init__(self, options, command, **kwargs):
+				if sys.version_info[0] > 2:
+					kwargs.setdefault('encoding', 'utf-8')
+				logging.info("Running command: %s", command)
+				pexpect.spawn.__init__(self, command, **kwargs)
+				self.opt = options
+
+			def log_expect(self, pattern, timeout):
+				result = self.expect(pattern, timeout if timeout != 0 else None)
+				logging.debug("Received: %s", self.before + self.after)
+				return result
+
+			def read_nonblocking(self, size, timeout):
+				return pexpect.spawn.read_nonblocking(self, size=100, timeout=timeout if timeout != 0 else None)
+
+			def send(self, message):
+				logging.debug("Sent: %s", message)
+				return pexpect.spawn.send(self, message)
+
+			# send EOL according to what was detected in login process (telnet)
+			def send_eol(self, message):
+				return self.send(message + self.opt["eol"])
+
+		fspawn.spawn_class = _fspawn
+	return fspawn.spawn_class(options, command, **kwargs)
+
+fspawn.spawn_class = None
+
+## telnet client in the agent process with the interface of fspawn(), it is used
+## instead of the telnet binary when --telnet-engine=native:
+## * option negotiation is answered here, binary transmission, echo and suppress
+##   go ahead are accepted and all other options are refused (only once)
+## * reads wait for the socket, there is no pty and no delay before send
+def _ftelnet(options, **kwargs):
+	if _ftelnet.telnet_class is None:
+		class _telnet(pexpect.spawnbase.SpawnBase):
+			IAC = 255
+			DONT = 254
+			DO = 253
+			WONT = 252
+			WILL = 251
+			SB = 250
+			SE = 240
+			BINARY = 0
+			ECHO = 1
+			SGA = 3
+			REMOTE_OPTIONS = [BINARY, ECHO, SGA]
+			LOCAL_OPTIONS = [BINARY, SGA]
+
+			def __init__(self, options, encoding="utf-8", codec_errors="strict"):
+				pexpect.spawnbase.SpawnBase.__init__(self, encoding=encoding, codec_errors=codec_errors)
+				self.opt = options
+				self.delaybeforesend = None
+				self.delayafterread = None
+				self.local_options = set()
+				self.remote_options = set()
+				self.refused = set()
+				self.pending = b""
+
+				address = (options["--ip"], int(options["--ipport"]))
+				logging.info("Connecting to %s:%d", address[0], address[1])
+				try:
+					self.socket = socket.create_connection(address, int(options["--login-timeout"]) or None)
+				except socket.timeout:
+					raise pexpect.TIMEOUT("Connection to %s:%d timed out" % address)
+				except OSError as e:
+					raise pexpect.EOF("Unable to connect to %s:%d: %s" % (address[0], address[1], e.strerror))
+				self.socket.settimeout(None)
+				self.child_fd = self.socket.fileno()
+				self.selector = selectors.DefaultSelector()
+				self.selector.register(self.socket, selectors.EVENT_READ)
+				self.name = "<telnet %s:%d>" % address
+				self.closed = False
+
+			def log_expect(self, pattern, timeout):
+				result = self.expect(pattern, timeout if timeout != 0 else None)
+				logging.debug("Received: %s", self.before + self.after)
+				return result
+
+			def _reply(self, command, option):
+				self.socket.sendall(bytes([self.IAC, command, option]))
+
+			def _negotiate(self, command, option):
+				## a refused option is refused once, repeated requests are not
+				## answered so the peers can not end in a negotiation loop (RFC 854)
+				if (command, option) in self.refused:
+					return
+				if command == self.WILL and option not in self.remote_options:
+					if option in self.REMOTE_OPTIONS:
+						self.remote_options.add(option)
+						self._reply(self.DO, option)
+					else:
+						self.refused.add((command, option))
+						self._reply(self.DONT, option)
+				elif command == self.WONT and option in self.remote_options:
+					self.remote_options.remove(option)
+					self._reply(self.DONT, option)
+				elif command == self.DO and option not in self.local_options:
+					if option in self.LOCAL_OPTIONS:
+						self.local_options.add(option)
+						self._reply(self.WILL, option)
+					else:
+						self.refused.add((command, option))
+						self._reply(self.WONT, option)
+				elif command == self.DONT and option in self.local_options:
+					self.local_options.remove(option)
+					self._reply(self.WONT, option)
+
+			def _telnet_data(self, data):
+				## data without telnet commands, incomplete command is kept for next read
+				data = self.pending + data
+				result = bytearray()
+				pos = 0
+				while pos < len(data):
+					if data[pos] != self.IAC:
+						end = data.find(bytes([self.IAC]), pos)
+						end = len(data) if end == -1 else end
+						result += data[pos:end]
+						pos = end
+					elif pos + 1 == len(data):
+						break
+					elif data[pos + 1] == self.IAC:
+						result.append(self.IAC)
+						pos += 2
+					elif data[pos + 1] in [self.WILL, self.WONT, self.DO, self.DONT]:
+						if pos + 2 == len(data):
+							break
+						self._negotiate(data[pos + 1], data[pos + 2])
+						pos += 3
+					elif data[pos + 1] == self.SB:
+						end = data.find(bytes([self.IAC, self.SE]), pos)
+						if end == -1:
+							break
+						pos = end + 2
+					else:
+						pos += 2
+				self.pending = data[pos:]
+				if self.BINARY not in self.remote_options:
+					result = result.replace(b"\r\0", b"\r")
+				return bytes(result)
+
+			def read_nonblocking(self, size, timeout):
+				if timeout == -1:
+					timeout = self.timeout
+				deadline = time.monotonic() + timeout if timeout else None
+				while True:
+					wait = None if deadline is None else max(deadline - time.monotonic(), 0)
+					if not self.selector.select(wait):
+						raise pexpect.TIMEOUT("Timeout exceeded.")
+					try:
+						data = self.socket.recv(max(size, 100))
+					except OSError as e:
+						self.flag_eof = True
+						raise pexpect.EOF(str(e))
+					if not data:
+						self.flag_eof = True
+						raise pexpect.EOF("Connection closed by foreign host.")
+					data = self._telnet_data(data)
+					if data:
+						break
+
+				data = self._decoder.decode(data, final=False)
+				self._log(data, "read")
+				return data
+
+			def send(self, message):
+				logging.debug("Sent: %s", message)
+				message = self._coerce_send_string(message)
+				self._log(message, "send")
+				data = self._encoder.encode(message, final=False).replace(b"\xff", b"\xff\xff")
+				if self.BINARY not in self.local_options:
+					## CR without LF is sent as CR NUL (RFC 854)
+					data = re.sub(b"\r(?!\n)", b"\r\0", data)
+				try:
+					self.socket.sendall(data)
+				except OSError as e:
+					raise pexpect.EOF(str(e))
+				return len(data)
+
+			def sendline(self, message=""):
+				return self.send(message + self.linesep)
 
-	def log_expect(self, pattern, timeout):
-		result = self.expect(pattern, timeout if timeout != 0 else None)
-		logging.debug("Received: %s", self.before + self.after)
-		return result
+			# send EOL according to what was detected in login process (telnet)
+			def send_eol(self, message):
+				return self.send(message + self.opt["eol"])
 
-	def read_nonblocking(self, size, timeout):
-		return pexpect.spawn.read_nonblocking(self, size=100, timeout=timeout if timeout != 0 else None)
+			def isalive(self):
+				return not self.closed and not self.flag_eof
 
-	def send(self, message):
-		logging.debug("Sent: %s", message)
-		return pexpect.spawn.send(self, message)
+			def close(self):
+				if not self.closed:
+					self.selector.close()
+					self.socket.close()
+					self.child_fd = -1
+					self.closed = True
 
-	# send EOL according to what was detected in login process (telnet)
-	def send_eol(self, message):
-		return self.send(message + self.opt["eol"])
+		_ftelnet.telnet_class = _telnet
+	return _ftelnet.telnet_class(options, **kwargs)
+
+_ftelnet.telnet_class = None
+
+## telnet connection to --ip:--ipport, by the telnet binary or by the client in
+## the agent process (see _ftelnet) according to --telnet-engine
+def ftelnet(options, **kwargs):
+	if options.get("--telnet-engine", "telnet").lower() == "native":
+		return _ftelnet(options, **kwargs)
+
+	conn = fspawn(options, options["--telnet-path"], **kwargs)
+	conn.send("set binary\n")
+	conn.send("open %s -%s\n"%(options["--ip"], options["--ipport"]))
+	return conn
 
 def frun(command, timeout=30, withexitstatus=False, events=None,
 	 extra_args=None, logfile=None, cwd=None, env=None, **kwargs):
@@ -791,6 +1181,9 @@ def check_input(device_opt, opt, other_conditions = False):
 			logging.error("Unable to create file %s", options["--debug-file"])
 			fail_usage("Failed: Unable to create file " + options["--debug-file"])
 
+	if "--timing-file" in options:
+		_register_timing(options)
+
 	if "--snmp-priv-passwd-script" in options:
 		options["--snmp-priv-passwd"] = os.popen(options["--snmp-priv-passwd-script"]).read().rstrip()
 
@@ -811,109 +1204,331 @@ def check_input(device_opt, opt, other_conditions = False):
 
 	return options
 
+## Set --plug (and --uuid if plug is UUID) for a single plug
+######
+def _set_plug_options(options, plug):
+	import uuid
+
+	try:
+		options["--uuid"] = str(uuid.UUID(plug))
+	except ValueError:
+		pass
+	except KeyError:
+		pass
+
+	options["--plug"] = plug
+	return options
+
+## Run plug_fn(options) for every plug and return results in order of plugs
+##
+## Plugs are processed one after another unless the agent has "plug_concurrency"
+## in device_opt (it is safe to use its connection from more threads) and
+## --plug-concurrency is greater than 1. In such case every thread gets its
+## own copy of options, so callbacks can not overwrite --plug of each other.
+######
+def _plug_workers(options, plugs):
+	try:
+		return min(int(options.get("--plug-concurrency", 1)), len(plugs))
+	except ValueError:
+		return 1
+
+def _for_each_plug(options, plug_fn):
+	plugs = options["--plugs"] if "--plugs" in options else [""]
+	workers = _plug_workers(options, plugs)
+
+	if workers <= 1:
+		return [plug_fn(_set_plug_options(options, plug)) for plug in plugs]
+
+	import concurrent.futures
+
+	logging.debug("Processing %d plugs with %d threads", len(plugs), workers)
+	with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+		return list(executor.map(lambda plug: plug_fn(_set_plug_options(dict(options), plug)), plugs))
+
+## _for_each_plug() of coroutine plug_fn, plugs are processed by the event loop
+## concurrently up to --plug-concurrency
+######
+async def _for_each_plug_async(options, plug_fn):
+	import asyncio
+
+	plugs = options["--plugs"] if "--plugs" in options else [""]
+	workers = _plug_workers(options, plugs)
+
+	if workers <= 1:
+		return [await plug_fn(_set_plug_options(options, plug)) for plug in plugs]
+
+	semaphore = asyncio.Semaphore(workers)
+	async def run_plug(plug):
+		async with semaphore:
+			return await plug_fn(_set_plug_options(dict(options), plug))
+
+	logging.debug("Processing %d plugs with %d coroutines", len(plugs), workers)
+	return list(await asyncio.gather(*[run_plug(plug) for plug in plugs]))
+
+## Agents which can get or set status of all plugs (options["--plugs"]) in one
+## request pass get_plugs_power_fn/set_plugs_power_fn to fence_action(). They
+## are used instead of per-plug callbacks when more than one plug is fenced;
+## get_plugs_power_fn returns list of statuses in order of plugs.
+######
+def _batch_plugs(options, plugs_fn):
+	return plugs_fn is not None and len(options.get("--plugs", [])) > 1
+
 ## Obtain a power status from possibly more than one plug
 ##	"on" is returned if at least one plug is ON
 ######
-def get_multi_power_fn(connection, options, get_power_fn):
+def get_multi_power_fn(connection, options, get_power_fn, get_plugs_power_fn=None):
+	def get_plug(plug_options):
+		with timing_phase("status", plug_options):
+			return get_power_fn(connection, plug_options)
+
 	status = "off"
-	plugs = options["--plugs"] if "--plugs" in options else [""]
 
-	for plug in plugs:
-		try:
-			options["--uuid"] = str(uuid.UUID(plug))
-		except ValueError:
-			pass
-		except KeyError:
-			pass
+	if _batch_plugs(options, get_plugs_power_fn):
+		with timing_phase("status", options):
+			statuses = get_plugs_power_fn(connection, options)
+	else:
+		statuses = _for_each_plug(options, get_plug)
 
-		options["--plug"] = plug
-		plug_status = get_power_fn(connection, options)
+	for plug_status in statuses:
 		if plug_status != "off":
 			status = plug_status
 
 	return status
 
-def async_set_multi_power_fn(connection, options, set_power_fn, get_power_fn, retry_attempts):
-	plugs = options["--plugs"] if "--plugs" in options else [""]
-
-	for _ in range(retry_attempts):
-		for plug in plugs:
-			try:
-				options["--uuid"] = str(uuid.UUID(plug))
-			except ValueError:
-				pass
-			except KeyError:
-				pass
-
-			options["--plug"] = plug
-			set_power_fn(connection, options)
+def async_set_multi_power_fn(connection, options, set_power_fn, get_power_fn, retry_attempts,
+		set_plugs_power_fn=None, get_plugs_power_fn=None):
+	def set_plug(plug_options):
+		with timing_phase("set", plug_options, attempt):
+			set_power_fn(connection, plug_options)
+		with timing_phase("power_wait", plug_options, attempt):
 			time.sleep(int(options["--power-wait"]))
 
-		for _ in itertools.count(1):
-			if get_multi_power_fn(connection, options, get_power_fn) != options["--action"]:
-				time.sleep(int(options["--stonith-status-sleep"]))
-			else:
-				return True
+	for attempt in range(retry_attempts):
+		if _batch_plugs(options, set_plugs_power_fn):
+			with timing_phase("set", options, attempt):
+				set_plugs_power_fn(connection, options)
+			with timing_phase("power_wait", options, attempt):
+				time.sleep(int(options["--power-wait"]))
+		else:
+			_for_each_plug(options, set_plug)
 
-			if int(options["--power-timeout"]) > 0 and _ >= int(options["--power-timeout"]):
-				break
+		with timing_phase("verify", attempt=attempt):
+			verified = poll_until(lambda: get_multi_power_fn(connection, options, get_power_fn, get_plugs_power_fn) == options["--action"],
+					int(options["--power-timeout"]) or None, max_interval=int(options["--stonith-status-sleep"]))
+		if verified:
+			return True
 
 	return False
 
 def sync_set_multi_power_fn(connection, options, sync_set_power_fn, retry_attempts):
-	success = True
-	plugs = options["--plugs"] if "--plugs" in options else [""]
-
-	for plug in plugs:
-		try:
-			options["--uuid"] = str(uuid.UUID(plug))
-		except ValueError:
-			pass
-		except KeyError:
-			pass
-
-		options["--plug"] = plug
+	def set_plug(plug_options):
+		success = True
 		for retry in range(retry_attempts):
-			if sync_set_power_fn(connection, options):
+			with timing_phase("set", plug_options, retry):
+				done = sync_set_power_fn(connection, plug_options)
+			if done:
 				break
 			if retry == retry_attempts-1:
 				success = False
-		time.sleep(int(options["--power-wait"]))
+		with timing_phase("power_wait", plug_options):
+			time.sleep(int(options["--power-wait"]))
+		return success
 
-	return success
+	return all(_for_each_plug(options, set_plug))
 
 
-def set_multi_power_fn(connection, options, set_power_fn, get_power_fn, sync_set_power_fn, retry_attempts=1):
+def set_multi_power_fn(connection, options, set_power_fn, get_power_fn, sync_set_power_fn, retry_attempts=1,
+		set_plugs_power_fn=None, get_plugs_power_fn=None):
 
 	if set_power_fn != None:
 		if get_power_fn != None:
-			return async_set_multi_power_fn(connection, options, set_power_fn, get_power_fn, retry_attempts)
+			return async_set_multi_power_fn(connection, options, set_power_fn, get_power_fn, retry_attempts,
+					set_plugs_power_fn, get_plugs_power_fn)
 	elif sync_set_power_fn != None:
 		return sync_set_multi_power_fn(connection, options, sync_set_power_fn, retry_attempts)
 
 	return False
 
 def multi_reboot_cycle_fn(connection, options, reboot_cycle_fn, retry_attempts=1):
-	success = True
-	plugs = options["--plugs"] if "--plugs" in options else [""]
+	def reboot_plug(plug_options):
+		success = True
+		for retry in range(retry_attempts):
+			with timing_phase("reboot_cycle", plug_options, retry):
+				done = reboot_cycle_fn(connection, plug_options)
+			if done:
+				break
+			if retry == retry_attempts-1:
+				success = False
+		with timing_phase("power_wait", plug_options):
+			time.sleep(int(options["--power-wait"]))
+		return success
 
-	for plug in plugs:
-		try:
-			options["--uuid"] = str(uuid.UUID(plug))
-		except ValueError:
-			pass
-		except KeyError:
-			pass
+	return all(_for_each_plug(options, reboot_plug))
+
+## Coroutine variants of the multi-plug functions above, used by fence_action_async()
+######
+async def get_multi_power_async(connection, options, get_power_fn, get_plugs_power_fn=None):
+	async def get_plug(plug_options):
+		with timing_phase("status", plug_options):
+			return await get_power_fn(connection, plug_options)
+
+	status = "off"
+
+	if _batch_plugs(options, get_plugs_power_fn):
+		with timing_phase("status", options):
+			statuses = await get_plugs_power_fn(connection, options)
+	else:
+		statuses = await _for_each_plug_async(options, get_plug)
 
-		options["--plug"] = plug
+	for plug_status in statuses:
+		if plug_status != "off":
+			status = plug_status
+
+	return status
+
+async def async_set_multi_power_async(connection, options, set_power_fn, get_power_fn, retry_attempts,
+		set_plugs_power_fn=None, get_plugs_power_fn=None):
+	import asyncio
+
+	async def set_plug(plug_options):
+		with timing_phase("set", plug_options, attempt):
+			await set_power_fn(connection, plug_options)
+		with timing_phase("power_wait", plug_options, attempt):
+			await asyncio.sleep(int(options["--power-wait"]))
+
+	async def check():
+		return await get_multi_power_async(connection, options, get_power_fn, get_plugs_power_fn) == options["--action"]
+
+	for attempt in range(retry_attempts):
+		if _batch_plugs(options, set_plugs_power_fn):
+			with timing_phase("set", options, attempt):
+				await set_plugs_power_fn(connection, options)
+			with timing_phase("power_wait", options, attempt):
+				await asyncio.sleep(int(options["--power-wait"]))
+		else:
+			await _for_each_plug_async(options, set_plug)
+
+		with timing_phase("verify", attempt=attempt):
+			verified = await poll_until_async(check, int(options["--power-timeout"]) or None,
+					max_interval=int(options["--stonith-status-sleep"]))
+		if verified:
+			return True
+
+	return False
+
+async def sync_set_multi_power_async(connection, options, sync_set_power_fn, retry_attempts):
+	import asyncio
+
+	async def set_plug(plug_options):
+		success = True
 		for retry in range(retry_attempts):
-			if reboot_cycle_fn(connection, options):
+			with timing_phase("set", plug_options, retry):
+				done = await sync_set_power_fn(connection, plug_options)
+			if done:
 				break
 			if retry == retry_attempts-1:
 				success = False
-		time.sleep(int(options["--power-wait"]))
+		with timing_phase("power_wait", plug_options):
+			await asyncio.sleep(int(options["--power-wait"]))
+		return success
 
-	return success
+	return all(await _for_each_plug_async(options, set_plug))
+
+async def set_multi_power_async(connection, options, set_power_fn, get_power_fn, sync_set_power_fn, retry_attempts=1,
+		set_plugs_power_fn=None, get_plugs_power_fn=None):
+
+	if set_power_fn != None:
+		if get_power_fn != None:
+			return await async_set_multi_power_async(connection, options, set_power_fn, get_power_fn, retry_attempts,
+					set_plugs_power_fn, get_plugs_power_fn)
+	elif sync_set_power_fn != None:
+		return await sync_set_multi_power_async(connection, options, sync_set_power_fn, retry_attempts)
+
+	return False
+
+async def multi_reboot_cycle_async(connection, options, reboot_cycle_fn, retry_attempts=1):
+	import asyncio
+
+	async def reboot_plug(plug_options):
+		success = True
+		for retry in range(retry_attempts):
+			with timing_phase("reboot_cycle", plug_options, retry):
+				done = await reboot_cycle_fn(connection, plug_options)
+			if done:
+				break
+			if retry == retry_attempts-1:
+				success = False
+		with timing_phase("power_wait", plug_options):
+			await asyncio.sleep(int(options["--power-wait"]))
+		return success
+
+	return all(await _for_each_plug_async(options, reboot_plug))
+
+## Call check_fn() until it returns a true value and return that value
+##
+## The first POLL_FAST_COUNT polls are done every 'interval' seconds, after that
+## the interval grows exponentially (with a random jitter, so several agents do
+## not query a device at the same moment) up to 'max_interval'. Polling stops
+## when 'timeout' seconds of wall-clock time passed; timeout None means to poll
+## forever. None is returned in case of timeout.
+######
+def poll_until(check_fn, timeout, interval=POLL_INTERVAL, max_interval=None):
+	delays = _poll_delays(timeout, interval, max_interval)
+
+	while True:
+		result = check_fn()
+		if result:
+			return result
+
+		delay = next(delays, None)
+		if delay is None:
+			return None
+		time.sleep(delay)
+
+## poll_until() of coroutine check_fn
+######
+async def poll_until_async(check_fn, timeout, interval=POLL_INTERVAL, max_interval=None):
+	import asyncio
+
+	delays = _poll_delays(timeout, interval, max_interval)
+
+	while True:
+		result = await check_fn()
+		if result:
+			return result
+
+		delay = next(delays, None)
+		if delay is None:
+			return None
+		await asyncio.sleep(delay)
+
+## Delays between the polls of poll_until(), it stops at timeout
+######
+def _poll_delays(timeout, interval, max_interval):
+	deadline = time.monotonic() + float(timeout) if timeout is not None else None
+	if max_interval is not None:
+		## e.g. --stonith-status-sleep=0 must not turn polling into a busy loop
+		max_interval = max(max_interval, POLL_INTERVAL)
+		interval = min(interval, max_interval)
+
+	def delays(interval):
+		for attempt in itertools.count(1):
+			if attempt > POLL_FAST_COUNT:
+				interval = interval * POLL_BACKOFF
+				if max_interval is not None:
+					interval = min(interval, max_interval)
+			delay = interval * random.uniform(1 - POLL_JITTER, 1 + POLL_JITTER)
+
+			if deadline is not None:
+				time_left = deadline - time.monotonic()
+				if time_left <= 0:
+					logging.debug("Stop polling after %s second(s)", str(timeout))
+					return
+				delay = min(delay, time_left)
+
+			yield delay
+
+	return delays(interval)
 
 def show_docs(options, docs=None):
 	device_opt = options["device_opt"]
@@ -943,7 +1558,75 @@ def show_docs(options, docs=None):
 		print(RELEASE_VERSION)
 		sys.exit(0)
 
-def fence_action(connection, options, set_power_fn, get_power_fn, get_outlet_list=None, reboot_cycle_fn=None, sync_set_power_fn=None):
+def fence_action(connection, options, set_power_fn, get_power_fn, get_outlet_list=None, reboot_cycle_fn=None, sync_set_power_fn=None,
+		get_plugs_power_fn=None, set_plugs_power_fn=None):
+	return _fence_action(options,
+		get_outlet_list and (lambda: get_outlet_list(connection, options)),
+		lambda: get_multi_power_fn(connection, options, get_power_fn, get_plugs_power_fn),
+		lambda retry_attempts: set_multi_power_fn(connection, options, set_power_fn, get_power_fn, sync_set_power_fn,
+				retry_attempts, set_plugs_power_fn, get_plugs_power_fn),
+		reboot_cycle_fn and (lambda retry_attempts: multi_reboot_cycle_fn(connection, options, reboot_cycle_fn, retry_attempts)))
+
+## Coroutine agents
+##
+## fence_action_async() takes the same arguments as fence_action(), but the
+## callbacks are coroutine functions (async def) and they are run by the event
+## loop of the agent (run_async()). Plugs are processed concurrently up to
+## --plug-concurrency without threads, and callbacks can overlap their own
+## requests by asyncio.gather(). Output and exit codes are the same as of
+## fence_action().
+##
+## Blocking callbacks are run in a thread by async_callback(), so an agent can
+## be ported one callback after another.
+#####
+def fence_action_async(connection, options, set_power_fn, get_power_fn, get_outlet_list=None, reboot_cycle_fn=None,
+		sync_set_power_fn=None, get_plugs_power_fn=None, set_plugs_power_fn=None):
+	(set_power_fn, get_power_fn, get_outlet_list, reboot_cycle_fn, sync_set_power_fn, get_plugs_power_fn, set_plugs_power_fn) = \
+		[async_callback(fn) for fn in [set_power_fn, get_power_fn, get_outlet_list, reboot_cycle_fn, sync_set_power_fn,
+				get_plugs_power_fn, set_plugs_power_fn]]
+
+	return _fence_action(options,
+		get_outlet_list and (lambda: run_async(get_outlet_list(connection, options))),
+		lambda: run_async(get_multi_power_async(connection, options, get_power_fn, get_plugs_power_fn)),
+		lambda retry_attempts: run_async(set_multi_power_async(connection, options, set_power_fn, get_power_fn,
+				sync_set_power_fn, retry_attempts, set_plugs_power_fn, get_plugs_power_fn)),
+		reboot_cycle_fn and (lambda retry_attempts: run_async(multi_reboot_cycle_async(connection, options,
+				reboot_cycle_fn, retry_attempts))))
+
+## Run coroutine in the event loop of the agent and return its result
+##
+## The loop is created on first use and it is kept for the whole run, so the
+## coroutines of main() and of fence_action_async() share it.
+######
+def run_async(coroutine):
+	import asyncio
+
+	if run_async.loop is None:
+		run_async.loop = asyncio.new_event_loop()
+		asyncio.set_event_loop(run_async.loop)
+	return run_async.loop.run_until_complete(coroutine)
+run_async.loop = None
+
+## Return coroutine function running blocking fn in a thread of the event loop
+######
+def async_callback(fn):
+	import inspect
+
+	if fn is None or inspect.iscoroutinefunction(fn):
+		return fn
+
+	async def callback(*args):
+		import asyncio
+		return await asyncio.get_event_loop().run_in_executor(None, fn, *args)
+	return callback
+
+## Process options of fence_action(), the callbacks do not take any arguments:
+##	outlets_fn() returns outlets for list/list-status (None if not supported)
+##	status_fn() returns "on"/"off" of all plugs
+##	set_fn(retry_attempts) sets --action on all plugs and returns success
+##	reboot_fn(retry_attempts) reboots all plugs by --method=cycle (None if not supported)
+######
+def _fence_action(options, outlets_fn, status_fn, set_fn, reboot_fn):
 	result = EC_OK
 
 	try:
@@ -958,7 +1641,7 @@ def fence_action(connection, options, set_power_fn, get_power_fn, get_outlet_lis
 
 			if 0 == options["device_opt"].count("port"):
 				print("N/A")
-			elif get_outlet_list == None:
+			elif outlets_fn == None:
 				## @todo: exception?
 				## This is just temporal solution, we will remove default value
 				## None as soon as all existing agent will support this operation
@@ -966,7 +1649,7 @@ def fence_action(connection, options, set_power_fn, get_power_fn, get_outlet_lis
 			else:
 				options["--original-action"] = options["--action"]
 				options["--action"] = "list"
-				outlets = get_outlet_list(connection, options)
+				outlets = outlets_fn()
 				options["--action"] = options["--original-action"]
 				del options["--original-action"]
 
@@ -996,7 +1679,7 @@ def fence_action(connection, options, set_power_fn, get_power_fn, get_outlet_lis
 
 		status = None
 		if not "no_status" in options["device_opt"]:
-			status = get_multi_power_fn(connection, options, get_power_fn)
+			status = status_fn()
 			if status != "on" and status != "off":
 				fail(EC_STATUS)
 
@@ -1006,20 +1689,20 @@ def fence_action(connection, options, set_power_fn, get_power_fn, get_outlet_lis
 				return result
 
 		if options["--action"] == "on":
-			if set_multi_power_fn(connection, options, set_power_fn, get_power_fn, sync_set_power_fn, 1 + int(options["--retry-on"])):
+			if set_fn(1 + int(options["--retry-on"])):
 				print("Success: Powered ON")
 			else:
 				fail(EC_WAITING_ON)
 		elif options["--action"] == "off":
-			if set_multi_power_fn(connection, options, set_power_fn, get_power_fn, sync_set_power_fn):
+			if set_fn(1):
 				print("Success: Powered OFF")
 			else:
 				fail(EC_WAITING_OFF)
 		elif options["--action"] == "reboot":
 			power_on = False
-			if options.get("--method", "").lower() == "cycle" and reboot_cycle_fn is not None:
+			if options.get("--method", "").lower() == "cycle" and reboot_fn is not None:
 				try:
-					power_on = multi_reboot_cycle_fn(connection, options, reboot_cycle_fn, 1 + int(options["--retry-on"]))
+					power_on = reboot_fn(1 + int(options["--retry-on"]))
 				except Exception as ex:
 					# an error occured during reboot action
 					logging.warning("%s", str(ex))
@@ -1030,13 +1713,13 @@ def fence_action(connection, options, set_power_fn, get_power_fn, get_outlet_lis
 			else:
 				if status != "off":
 					options["--action"] = "off"
-					if not set_multi_power_fn(connection, options, set_power_fn, get_power_fn, sync_set_power_fn):
+					if not set_fn(1):
 						fail(EC_WAITING_OFF)
 
 				options["--action"] = "on"
 
 				try:
-					power_on = set_multi_power_fn(connection, options, set_power_fn, get_power_fn, sync_set_power_fn, int(options["--retry-on"]))
+					power_on = set_fn(int(options["--retry-on"]))
 				except Exception as ex:
 					# an error occured during power ON phase in reboot
 					# fence action was completed succesfully even in that case
@@ -1078,22 +1761,26 @@ def fence_login(options, re_login_string=r"(login\s*: )|((?!Last )Login Name:  )
 	if "--command-prompt" in options and type(options["--command-prompt"]) is not list:
 		options["--command-prompt"] = [options["--command-prompt"]]
 
-	try:
-		if "--ssl" in options:
-			conn = _open_ssl_connection(options)
-		elif "--ssh" in options and "--identity-file" not in options:
-			conn = _login_ssh_with_password(options, re_login_string)
-		elif "--ssh" in options and "--identity-file" in options:
-			conn = _login_ssh_with_identity_file(options)
-		else:
-			conn = _login_telnet(options, re_login_string)
-	except pexpect.EOF as exception:
-		logging.debug("%s", str(exception))
-		fail(EC_LOGIN_DENIED)
-	except pexpect.TIMEOUT as exception:
-		logging.debug("%s", str(exception))
-		fail(EC_LOGIN_DENIED)
-	return conn
+	for attempt in range(2):
+		try:
+			with timing_phase("login"):
+				if "--ssl" in options:
+					conn = _open_ssl_connection(options)
+				elif "--ssh" in options and "--identity-file" not in options:
+					conn = _login_ssh_with_password(options, re_login_string)
+				elif "--ssh" in options and "--identity-file" in options:
+					conn = _login_ssh_with_identity_file(options)
+				else:
+					conn = _login_telnet(options, re_login_string)
+			return conn
+		except pexpect.EOF as exception:
+			logging.debug("%s", str(exception))
+		except pexpect.TIMEOUT as exception:
+			logging.debug("%s", str(exception))
+
+		## shared SSH connection might be broken (e.g. the device was restarted)
+		if attempt > 0 or "--ssl" in options or not _ssh_stop_master(options):
+			fail(EC_LOGIN_DENIED)
 
 def is_executable(path):
 	if os.path.exists(path):
@@ -1103,17 +1790,10 @@ def is_executable(path):
 	return False
 
 def run_commands(options, commands, timeout=None, env=None, log_command=None):
-	# inspired by psutils.wait_procs (BSD License)
-	def check_gone(proc, timeout):
-		try:
-			returncode = proc.wait(timeout=timeout)
-		except subprocess.TimeoutExpired:
-			pass
-		else:
-			if returncode is not None or not proc.is_running():
-				proc.returncode = returncode
-				gone.add(proc)
-
+	## Wait for the processes in one selector loop: process exits are reported
+	## by pidfd (or by the end of their output on systems without pidfd) and
+	## stdout/stderr are read as soon as there is data, so no child can block
+	## on a full pipe.
 	if timeout is None and "--power-timeout" in options:
 		timeout = options["--power-timeout"]
 	if timeout == 0:
@@ -1121,87 +1801,106 @@ def run_commands(options, commands, timeout=None, env=None, log_command=None):
 	if timeout is not None:
 		timeout = float(timeout)
 
-	time_start = time.time()
+	time_start = time.monotonic()
 	procs = []
 	status = None
-	pipe_stdout = ""
-	pipe_stderr = ""
+	output = {}
 
 	for command in commands:
 		logging.info("Executing: %s\n", log_command or command)
 
 		try:
-			process = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env,
-					# decodes newlines and in python3 also converts bytes to str
-					universal_newlines=(sys.version_info[0] > 2))
+			process = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
 		except OSError:
 			fail_usage("Unable to run %s\n" % command)
 
 		procs.append(process)
 
-	gone = set()
-	alive = set(procs)
+	selector = selectors.DefaultSelector()
+	pidfds = {}
+	for proc in procs:
+		for pipe in [proc.stdout, proc.stderr]:
+			os.set_blocking(pipe.fileno(), False)
+			output[pipe] = b""
+			selector.register(pipe, selectors.EVENT_READ, proc)
+		try:
+			pidfds[proc] = os.pidfd_open(proc.pid)
+			selector.register(pidfds[proc], selectors.EVENT_READ, proc)
+		except (AttributeError, OSError):
+			pass
 
-	while True:
-		if alive:
-			max_timeout = 2.0 / len(alive)
-			for proc in alive:
-				if timeout is not None:
-					if time.time()-time_start >= timeout:
-						# quickly go over the rest
-						max_timeout = 0
-				check_gone(proc, max_timeout)
-			alive = alive - gone
-
-		if not alive:
+	gone = []
+	alive = list(procs)
+	policy = options.get("--quorum-policy", "majority")
+	quorum_delay = int(options.get("--quorum-delay", 5000)) / 1000.0
+
+	while alive:
+		now = time.monotonic() - time_start
+		good_cnt = len([proc for proc in gone if proc.returncode == 0])
+		if policy == "first" and good_cnt > 0:
+			logging.info("Quorum policy first: command succeeded after %.3fs, %d still running\n", now, len(alive))
+			break
+		# majority: give it at least --quorum-delay to get a complete answer
+		# afterwards we're OK with a positive result from more than half
+		if policy == "majority" and now >= quorum_delay and good_cnt > len(procs)/2:
+			logging.info("Quorum policy majority: %d of %d commands succeeded after %.3fs\n", good_cnt, len(procs), now)
 			break
 
-		if time.time()-time_start < 5.0:
-			# give it at least 5s to get a complete answer
-			# afterwards we're OK with a quorate answer
-			continue
+		if timeout is not None and now >= timeout:
+			logging.debug("Stop waiting after %s\n", str(timeout))
+			break
 
-		if len(gone) > len(alive):
-			good_cnt = 0
-			for proc in gone:
-				if proc.returncode == 0:
-					good_cnt += 1
-			# a positive result from more than half is fine
-			if good_cnt > len(procs)/2:
-				break
+		wait = None if timeout is None else timeout - now
+		if policy == "majority" and now < quorum_delay and good_cnt > len(procs)/2:
+			wait = quorum_delay - now if wait is None else min(wait, quorum_delay - now)
+		if len(pidfds) < len(procs):
+			wait = 0.1 if wait is None else min(wait, 0.1)
 
-		if timeout is not None:
-			if time.time() - time_start >= timeout:
-				logging.debug("Stop waiting after %s\n", str(timeout))
-				break
+		for (key, _) in selector.select(wait):
+			if key.fileobj in output:
+				_read_pipe(key.fileobj, output, selector)
+
+		for proc in list(alive):
+			if proc.poll() is not None:
+				alive.remove(proc)
+				gone.append(proc)
+				if proc in pidfds:
+					selector.unregister(pidfds[proc])
 
 	logging.debug("Done: %d gone, %d alive\n", len(gone), len(alive))
+	if not alive:
+		logging.info("Quorum policy %s: all %d commands finished\n", policy, len(procs))
 
+	for proc in alive:
+		proc.kill()
+
+	pipe_stdout = ""
+	pipe_stderr = ""
 	for proc in gone:
-		if (status != 0):
+		if policy == "all":
+			# all commands have to succeed, hand over the first failure
+			if status is None or status == 0:
+				status = proc.returncode
+		elif (status != 0):
 			status = proc.returncode
-		# hand over the best status we have
+		# otherwise hand over the best status we have
 		# but still collect as much stdout/stderr feedback
 		# avoid communicate as we know already process
 		# is gone and it seems to block when there
 		# are D state children we don't get rid off
-		os.set_blocking(proc.stdout.fileno(), False)
-		os.set_blocking(proc.stderr.fileno(), False)
-		try:
-			pipe_stdout += proc.stdout.read()
-		except:
-			pass
-		try:
-			pipe_stderr += proc.stderr.read()
-		except:
-			pass
+		_read_pipe(proc.stdout, output, selector)
+		_read_pipe(proc.stderr, output, selector)
+		pipe_stdout += _decode_output(output[proc.stdout])
+		pipe_stderr += _decode_output(output[proc.stderr])
+
+	for proc in procs:
 		proc.stdout.close()
 		proc.stderr.close()
+	for pidfd in pidfds.values():
+		os.close(pidfd)
+	selector.close()
 
-	for proc in alive:
-		proc.kill()
-
-	if status is None:
+	if status is None or (policy == "all" and alive and status == 0):
 		fail(EC_TIMED_OUT, stop=(int(options.get("retry", 0)) < 1))
 		status = EC_TIMED_OUT
 		pipe_stdout = ""
@@ -1211,6 +1910,26 @@ def run_commands(options, commands, timeout=None, env=None, log_command=None):
 
 	return (status, pipe_stdout, pipe_stderr)
 
+def _read_pipe(pipe, output, selector):
+	## Read everything that is available now from non-blocking pipe
+	while not pipe.closed:
+		try:
+			data = os.read(pipe.fileno(), 65536)
+		except BlockingIOError:
+			return
+		except OSError:
+			data = b""
+
+		if not data:
+			selector.unregister(pipe)
+			pipe.close()
+			return
+		output[pipe] += data
+
+def _decode_output(data):
+	## same result as universal_newlines=True in subprocess
+	return data.decode(locale.getpreferredencoding(False), errors="replace").replace("\r\n", "\n").replace("\r", "\n")
+
 def run_command(options, command, timeout=None, env=None, log_command=None):
 	if timeout is None and "--power-timeout" in options:
 		timeout = options["--power-timeout"]
@@ -1243,6 +1962,64 @@ def run_command(options, command, timeout=None, env=None, log_command=None):
 
 	return (status, pipe_stdout, pipe_stderr)
 
+##
+## Timing of fence phases
+##
+## Every phase (delay, login, status, set, power_wait, verify, ...) is recorded with
+## its start (relative to the start of the agent), duration, action, plug and retry
+## attempt.
+## With --timing-file the record of the whole run is written as one JSON line
+## when the agent exits.
+#####
+_timing = {"start": time.monotonic(), "phases": [], "options": None}
+
+@contextlib.contextmanager
+def timing_phase(name, options=None, attempt=None):
+	## yields the record of the phase, details of the phase can be added to it
+	start = time.monotonic()
+	phase = {"phase": name}
+	try:
+		yield phase
+	finally:
+		phase.update({"start": round(start - _timing["start"], 6),
+			"duration": round(time.monotonic() - start, 6)})
+		if options and "--action" in options:
+			phase["action"] = options["--action"]
+		if options and options.get("--plug"):
+			phase["plug"] = options["--plug"]
+		if attempt is not None:
+			phase["attempt"] = attempt
+		_timing["phases"].append(phase)
+
+## check_input() can be called more times, the record is written only once with
+## the last options
+def _register_timing(options):
+	if _timing["options"] is None:
+		atexit.register(_write_timing)
+	_timing["options"] = options
+
+def _write_timing():
+	options = _timing["options"]
+	record = json.dumps({
+		"agent": os.path.basename(sys.argv[0]),
+		"action": options.get("--action"),
+		"plugs": options.get("--plugs", [options["--plug"]] if "--plug" in options else []),
+		"pid": os.getpid(),
+		"time": round(time.time() - (time.monotonic() - _timing["start"]), 6),
+		"total": round(time.monotonic() - _timing["start"], 6),
+		"phases": _timing["phases"]}, sort_keys=True)
+
+	if options["--timing-file"] == "syslog":
+		import syslog
+		syslog.syslog(syslog.LOG_INFO, "fence-timing: " + record)
+		return
+
+	try:
+		with open(options["--timing-file"], "a") as timing_file:
+			timing_file.write(record + "\n")
+	except IOError as ex:
+		logging.error("Unable to write timing to %s: %s", options["--timing-file"], str(ex))
+
 def run_delay(options, reserve=0, result=0):
 	## Delay is important for two-node clusters fencing
 	## but we do not need to delay 'status' operations
@@ -1255,7 +2032,8 @@ def run_delay(options, reserve=0, result=0):
 		time_left = 1 + int(options["--delay"]) - (time.time() - run_delay.time_start) - reserve
 		if time_left > 0:
 			logging.info("Delay %d second(s) before logging in to the fence device", time_left)
-			time.sleep(time_left)
+			with timing_phase("delay", options):
+				time.sleep(time_left)
 # mark time when fence-agent is started
 run_delay.time_start = time.time()
 
@@ -1264,9 +2042,10 @@ def fence_logout(conn, logout_string, sleep=0):
 	# In some cases our 'exit' command is faster and we can not close connection as it
 	# was already closed by fencing device
 	try:
-		conn.send_eol(logout_string)
-		time.sleep(sleep)
-		conn.close()
+		with timing_phase("logout"):
+			conn.send_eol(logout_string)
+			time.sleep(sleep)
+			conn.close()
 	except OSError:
 		pass
 	except pexpect.ExceptionPexpect:
@@ -1292,6 +2071,8 @@ class SyslogLibHandler(logging.StreamHandler):
 	A handler class that correctly push messages into syslog
 	"""
 	def emit(self, record):
+		import syslog
+
 		syslog_level = {
 			logging.CRITICAL:syslog.LOG_CRIT,
 			logging.ERROR:syslog.LOG_ERR,
@@ -1330,6 +2111,64 @@ def _open_ssl_connection(options):
 
 	return conn
 
+## Shared SSH connection (--ssh-persist)
+##
+## The first run starts an ssh master connection which stays in the background
+## for --ssh-persist seconds after the last session. Next runs with the same
+## device and credentials open their session through its control socket, so
+## they skip the key exchange and the authentication. There is one socket per
+## device and credentials in SSH_CONTROL_DIR, which is accessible only by its
+## owner. A master connection that does not work anymore is stopped by
+## _ssh_stop_master() and the login is repeated with a new one.
+#####
+def _ssh_control_path(options):
+	if "--ssh" not in options or int(options.get("--ssh-persist", 0)) <= 0:
+		return None
+
+	try:
+		os.makedirs(SSH_CONTROL_DIR, 0o700, exist_ok=True)
+		stats = os.lstat(SSH_CONTROL_DIR)
+	except OSError as e:
+		logging.debug("Unable to create %s: %s", SSH_CONTROL_DIR, e.strerror)
+		return None
+
+	if stats.st_uid != os.geteuid() or stats.st_mode & 0o077:
+		logging.debug("Directory %s is accessible by other users, SSH connection is not shared", SSH_CONTROL_DIR)
+		return None
+
+	key = [options.get(x) for x in ["--ip", "--ipport", "--username", "--password", \
+			"--identity-file", "--ssh-options", "--inet4-only", "--inet6-only"]]
+	## ssh appends 17 characters to the path while it creates the socket, sun_path has 108 bytes
+	return os.path.join(SSH_CONTROL_DIR, hashlib.sha256(json.dumps(key).encode()).hexdigest()[:32])
+
+def _ssh_control_options(options):
+	path = _ssh_control_path(options)
+	if path is None:
+		return ""
+
+	return " -o ControlMaster=auto -o ControlPath=%s -o ControlPersist=%d" % \
+			(path, int(options["--ssh-persist"]))
+
+def _ssh_stop_master(options):
+	## returns True when there was a shared connection to stop
+	path = _ssh_control_path(options)
+	if path is None or not os.path.exists(path):
+		return False
+
+	logging.debug("Stopping shared SSH connection %s", path)
+	try:
+		subprocess.run([options["--ssh-path"], "-o", "ControlPath=" + path, "-O", "exit", options["--ip"]], \
+				stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, \
+				timeout=int(options["--login-timeout"]) or None)
+	except (OSError, subprocess.TimeoutExpired) as e:
+		logging.debug("Unable to stop shared SSH connection: %s", str(e))
+
+	try:
+		os.unlink(path)
+	except OSError:
+		pass
+	return True
+
 def _login_ssh_with_identity_file(options):
 	if "--inet6-only" in options:
 		force_ipvx = "-6 "
@@ -1341,6 +2180,7 @@ def _login_ssh_with_identity_file(options):
 	command = '%s %s %s@%s -i %s -p %s' % \
 		(options["--ssh-path"], force_ipvx, options["--username"], options["--ip"], \
 		options["--identity-file"], options["--ipport"])
+	command += _ssh_control_options(options)
 	if "--ssh-options" in options:
 		command += ' ' + options["--ssh-options"]
 
@@ -1367,9 +2207,7 @@ def _login_telnet(options, re_login_string):
 	re_login = re.compile(re_login_string, re.IGNORECASE)
 	re_pass = re.compile(r"(password)|(pass phrase)", re.IGNORECASE)
 
-	conn = fspawn(options, options["--telnet-path"])
-	conn.send("set binary\n")
-	conn.send("open %s -%s\n"%(options["--ip"], options["--ipport"]))
+	conn = ftelnet(options)
 
 	conn.log_expect(re_login, int(options["--login-timeout"]))
 	conn.send_eol(options["--username"])
@@ -1417,6 +2255,8 @@ def _login_ssh_with_password(options, re_login_string):
 
 	command = '%s %s %s@%s -p %s -o PubkeyAuthentication=no' % \
 			(options["--ssh-path"], force_ipvx, options["--username"], options["--ip"], options["--ipport"])
+	control_options = _ssh_control_options(options)
+	command += control_options
 	if "--ssh-options" in options:
 		command += ' ' + options["--ssh-options"]
 
@@ -1435,12 +2275,16 @@ def _login_ssh_with_password(options, re_login_string):
 		conn.sendline(options["--username"])
 		conn.log_expect(re_pass, int(options["--login-timeout"]))
 	else:
+		## session of a shared connection is already authenticated
 		result = conn.log_expect( \
-				["ssword:", "Are you sure you want to continue connecting (yes/no)?"],
+				["ssword:", "Are you sure you want to continue connecting (yes/no)?"] + \
+				(options["--command-prompt"] if control_options else []),
 				int(options["--login-timeout"]))
 		if result == 1:
 			conn.sendline("yes")
 			conn.log_expect("ssword:", int(options["--login-timeout"]))
+		elif result > 1:
+			return conn
 
 	conn.sendline(options["--password"])
 	conn.log_expect(options["--command-prompt"], int(options["--login-timeout"]))
@@ -1607,7 +2451,7 @@ def _parse_input_stdin(avail_opt):
 
 	mapping_longopt_names = dict([(all_opt[o].get("longopt"), o) for o in avail_opt])
 
-	for line in sys.stdin.readlines():
+	for line in _read_stdin():
 		line = line.strip()
 		if (line.startswith("#")) or (len(line) == 0):
 			continue
@@ -1641,6 +2485,8 @@ def _parse_input_stdin(avail_opt):
 	return opt
 
 def _parse_input_cmdline(avail_opt):
+	import getopt
+
 	filtered_opts = {}
 	_verify_unique_getopt(avail_opt)
 	(getopt_string, longopt_list) = _prepare_getopt_args(avail_opt)
@@ -0,0 +1,204 @@
+#!@PYTHON@ -tt
+
+## On-disk cache of device discovery
+##
+## Agents look up the same things on every run: the model of the device, the
+## index of a port with given name, ... FencingCache keeps such results between
+## runs of the agent:
+##
+## * there is one file per device in CACHE_DIR, named by a hash of the agent
+##   name, the address and the credentials, so a different login never sees
+##   the data of another one
+## * the directory is created with mode 0700 and the files with mode 0600,
+##   readers and writers of a file are serialized by fcntl.flock()
+## * entries expire after --cache-ttl seconds, --cache-ttl=0 disables the cache
+##
+## The cache is only an optimization. When it can not be read or written, the
+## agent works as without it. A cached value that turned out to be wrong has to
+## be dropped by invalidate() and looked up again.
+##
+## CredentialCache keeps the login of the agent (session ID, token, cookie, ...)
+## in the same way, so the agent logs in only when there is no valid login
+## cached. A login that the device refused (e.g. HTTP 401) is done again.
+
+import os, time, json, fcntl, hashlib, logging
+
+__all__ = ["FencingCache", "CredentialCache", "LoginExpired"]
+
+CACHE_DIR = "@FENCETMPDIR@/cache"
+
+KEY_OPTIONS = ["--ip", "--ipport", "--username", "--password", "--community",
+		"--snmp-version", "--snmp-sec-level", "--snmp-auth-prot", "--snmp-priv-prot",
+		"--snmp-priv-passwd"]
+
+class FencingCache:
+	def __init__(self, options, name, key_options=None, key_values=None):
+		## key_values are other values identifying the device and the login (e.g. from config file)
+		self.ttl = int(options.get("--cache-ttl", 0))
+		self.path = None
+
+		if self.ttl <= 0:
+			return
+
+		key = [name] + [options.get(x) for x in KEY_OPTIONS + (key_options or [])] + list(key_values or [])
+		digest = hashlib.sha256(json.dumps(key).encode()).hexdigest()
+		self.path = os.path.join(CACHE_DIR, digest[:40] + ".json")
+
+	def enabled(self):
+		return self.path is not None
+
+	def _open(self, lock):
+		try:
+			os.makedirs(CACHE_DIR, 0o700, exist_ok=True)
+			stat = os.lstat(CACHE_DIR)
+			if stat.st_uid != os.geteuid() or stat.st_mode & 0o077:
+				logging.debug("Cache directory %s is accessible by other users, cache is not used\n", CACHE_DIR)
+				return None
+
+			fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+		except OSError as e:
+			logging.debug("Unable to open cache %s: %s\n", self.path, e.strerror)
+			return None
+
+		fcntl.flock(fd, lock)
+		return os.fdopen(fd, "r+")
+
+	def _read(self, cache_file):
+		cache_file.seek(0)
+		try:
+			data = json.loads(cache_file.read() or "{}")
+		except ValueError:
+			return {}
+
+		now = time.time()
+		return dict([(k, v) for (k, v) in data.items() if isinstance(v, list) and len(v) == 2 and v[0] > now])
+
+	def _write(self, cache_file, data):
+		cache_file.seek(0)
+		cache_file.truncate()
+		json.dump(data, cache_file)
+
+	def get(self, key):
+		## cached value of key, None when it is not cached or it has expired
+		if not self.path:
+			return None
+
+		cache_file = self._open(fcntl.LOCK_SH)
+		if cache_file is None:
+			return None
+
+		with cache_file:
+			entry = self._read(cache_file).get(key)
+
+		if entry is None:
+			return None
+
+		logging.debug("Using cached %s\n", key)
+		return entry[1]
+
+	def set(self, key, value, ttl=None):
+		## value has to be JSON serializable, ttl shorter than --cache-ttl can be used
+		## for values that expire sooner
+		self.update({key: value}, ttl)
+
+	def update(self, values, ttl=None):
+		if not self.path:
+			return
+
+		if ttl is not None and ttl < self.ttl:
+			if ttl <= 0:
+				return
+		else:
+			ttl = self.ttl
+
+		cache_file = self._open(fcntl.LOCK_EX)
+		if cache_file is None:
+			return
+
+		with cache_file:
+			data = self._read(cache_file)
+			expires = time.time() + ttl
+			for (key, value) in values.items():
+				data[key] = [expires, value]
+			try:
+				self._write(cache_file, data)
+			except (IOError, OSError) as e:
+				logging.debug("Unable to write cache %s: %s\n", self.path, e.strerror)
+
+	def invalidate(self, key=None):
+		## drop key from cache, or all cached values of the device when key is None
+		if not self.path:
+			return
+
+		cache_file = self._open(fcntl.LOCK_EX)
+		if cache_file is None:
+			return
+
+		with cache_file:
+			data = {}
+			if key is not None:
+				data = self._read(cache_file)
+				data.pop(key, None)
+			self._write(cache_file, data)
+
+class LoginExpired(Exception):
+	## raised by request of the agent when the device refused its login (e.g. HTTP 401)
+	pass
+
+class CredentialCache(FencingCache):
+	## login() logs in to the device and returns the credentials for next requests,
+	## or (credentials, seconds until they expire). It returns None when it failed.
+
+	## cached login is not used in last seconds before it expires
+	EXPIRY_MARGIN = 60
+
+	def __init__(self, options, name, login, key_options=None, key_values=None):
+		FencingCache.__init__(self, options, name, key_options, key_values)
+		self.login = login
+		self.credentials = None
+		self.cached = False
+		self.loaded = False
+
+	def get_credentials(self):
+		if not self.loaded:
+			self.loaded = True
+			self.credentials = self.get("credentials")
+			self.cached = self.credentials is not None
+			if not self.cached:
+				self.refresh()
+
+		return self.credentials
+
+	def refresh(self):
+		## drop cached login and log in again
+		if self.cached:
+			self.invalidate("credentials")
+
+		result = self.login()
+		if isinstance(result, tuple):
+			(credentials, expires_in) = result
+		else:
+			(credentials, expires_in) = (result, None)
+
+		self.store(credentials, expires_in)
+		return credentials
+
+	def store(self, credentials, expires_in=None):
+		## credentials changed by the agent (e.g. renewed by the client library)
+		self.credentials = credentials
+		self.cached = False
+		if credentials is not None:
+			self.set("credentials", credentials, None if expires_in is None else expires_in - self.EXPIRY_MARGIN)
+
+	def request(self, fn, *args, **kwargs):
+		## fn(credentials, *args, **kwargs) is repeated with a new login once, when
+		## it raises LoginExpired for a cached login
+		credentials = self.get_credentials()
+		try:
+			return fn(credentials, *args, **kwargs)
+		except LoginExpired:
+			if not self.cached:
+				raise
+
+		logging.debug("Cached login is not valid anymore, logging in again\n")
+		return fn(self.refresh(), *args, **kwargs)
@@ -0,0 +1,372 @@
+#!@PYTHON@ -tt
+
+## Persistent fence agent daemon
+##
+## Starting a fence agent means starting a new interpreter that imports
+## fencing, pexpect, pycurl and often a large SDK before doing any real work.
+## The daemon keeps those modules imported and runs the agents for its clients:
+##
+## * the daemon listens on a UNIX socket (SOCKET_PATH) and, on request, loads
+##   the agent module once (the agent is not executed, only its imports)
+## * every invocation is run in a forked child of the daemon, so agents keep
+##   their process-global state (all_opt, logging, atexit) to themselves
+## * the fence_* command stays the entry point: fencing.py calls delegate()
+##   when it is imported, which passes argv, environment and the stdin/stdout/
+##   stderr descriptors to the daemon and exits with the agent's exit code
+##
+## When the socket does not exist or the daemon does not answer, the agent
+## runs in its own interpreter as before.
+##
+## The daemon is started by fence-agentd.service, which calls main().
+
+import sys, os, time, json, socket, struct, signal, selectors, logging, atexit
+
+RELEASE_VERSION = "@RELEASE_VERSION@"
+SOCKET_PATH = "@FENCETMPDIR@/fence-agentd.sock"
+SOCKET_ENV = "FENCE_AGENTD_SOCKET"
+CONNECT_TIMEOUT = 5
+HEADER = struct.Struct("!I")
+
+EC_GENERIC_ERROR = 1
+
+def _send_message(sock, data, fds=None):
+	payload = json.dumps(data).encode()
+	if fds:
+		socket.send_fds(sock, [HEADER.pack(len(payload))], fds)
+	else:
+		sock.sendall(HEADER.pack(len(payload)))
+	sock.sendall(payload)
+
+def _recv_exact(sock, length):
+	data = b""
+	while len(data) < length:
+		chunk = sock.recv(length - len(data))
+		if not chunk:
+			return None
+		data += chunk
+	return data
+
+def _recv_message(sock, maxfds=0):
+	fds = []
+	if maxfds:
+		header, fds, _, _ = socket.recv_fds(sock, HEADER.size, maxfds)
+		if len(header) < HEADER.size:
+			rest = _recv_exact(sock, HEADER.size - len(header))
+			header = None if rest is None else header + rest
+	else:
+		header = _recv_exact(sock, HEADER.size)
+	if not header:
+		return (None, fds)
+	payload = _recv_exact(sock, HEADER.unpack(header)[0])
+	if payload is None:
+		return (None, fds)
+	return (json.loads(payload.decode()), fds)
+
+def library_version():
+	"""Version of the installed library, it is sent by the client with the request
+
+	The daemon refuses the request when it has another one loaded (e.g. after
+	upgrade of the package), the mtime catches rebuilds of the same version."""
+	try:
+		mtime = int(os.stat(os.path.join(os.path.dirname(os.path.abspath(__file__)), "fencing.py")).st_mtime)
+	except OSError:
+		mtime = 0
+	return "%s-%d" % (RELEASE_VERSION, mtime)
+
+def delegate(stdin=None):
+	"""Run the current fence agent in the daemon, if one is listening.
+
+	stdin are the lines already read from standard input, if any. Does not
+	return when the daemon ran the agent, returns None when the agent has to
+	run in this process."""
+	path = os.environ.get(SOCKET_ENV, SOCKET_PATH)
+	if not path or not hasattr(socket, "send_fds") or not os.path.exists(path):
+		return
+
+	## Only fence agents are delegated, not the daemon or scripts importing fencing
+	script = getattr(sys.modules.get("__main__"), "__file__", None)
+	if not script or not os.path.basename(script).startswith("fence_"):
+		return
+
+	sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	try:
+		sock.settimeout(CONNECT_TIMEOUT)
+		sock.connect(path)
+		_send_message(sock, {
+			"script": os.path.abspath(script),
+			"argv": sys.argv,
+			"env": dict(os.environ),
+			"cwd": os.getcwd(),
+			"stdin": stdin,
+			"version": library_version()}, [0, 1, 2])
+		started, _ = _recv_message(sock)
+	except (OSError, ValueError):
+		sock.close()
+		return
+
+	if not started or "pid" not in started:
+		sock.close()
+		return
+
+	## From now on the agent is running and owns stdin/stdout/stderr
+	sock.settimeout(None)
+	try:
+		result, _ = _recv_message(sock)
+	except (OSError, ValueError):
+		result = None
+	os._exit(result["status"] if result else EC_GENERIC_ERROR)
+
+def load_agent(script):
+	"""Import the agent (without running main()) and return its code object
+
+	The code object is run by run_agent() in a forked child."""
+	with open(script) as source:
+		code = compile(source.read(), script, "exec")
+	try:
+		exec(code, {"__name__": "fence_agentd_preload", "__file__": script})
+	except Exception as ex:
+		logging.warning("Unable to preload %s: %s", script, ex)
+	return code
+
+def load_lazy_modules():
+	"""Load the modules imported by fencing.lazy_import() and the agents
+
+	They would be loaded again by every forked child on their first use."""
+	import importlib.util
+	lazy_type = getattr(importlib.util, "_LazyModule", None)
+	if lazy_type is None:
+		return
+
+	tried = set()
+	while True:
+		lazy = [name for (name, module) in list(sys.modules.items())
+				if issubclass(type(module), lazy_type) and name not in tried]
+		if not lazy:
+			return
+		for name in lazy:
+			tried.add(name)
+			try:
+				## any attribute loads the module
+				getattr(sys.modules[name], "__doc__")
+			except Exception as ex:
+				logging.warning("Unable to preload %s: %s", name, ex)
+
+class AgentDaemon(object):
+	def __init__(self, path):
+		self.path = path
+		self.agents = {}
+		self.selector = selectors.DefaultSelector()
+		self.children = {}
+		self.server = None
+		self.version = library_version()
+
+	def load_agent(self, script):
+		script = os.path.realpath(script)
+		if script not in self.agents:
+			self.agents[script] = load_agent(script)
+			load_lazy_modules()
+		return self.agents[script]
+
+	def listen(self):
+		if os.path.exists(self.path):
+			os.unlink(self.path)
+		self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		old_umask = os.umask(0o177)
+		try:
+			self.server.bind(self.path)
+		finally:
+			os.umask(old_umask)
+		self.server.listen(64)
+		self.selector.register(self.server, selectors.EVENT_READ, self.accept)
+
+	def close(self):
+		for pid in list(self.children):
+			self.kill(pid)
+		if self.server:
+			self.selector.unregister(self.server)
+			self.server.close()
+			self.server = None
+			if os.path.exists(self.path):
+				os.unlink(self.path)
+
+	def serve_forever(self):
+		while self.server:
+			## SIGCHLD wakes up select() on systems without pidfd support
+			for key, _ in self.selector.select(None if hasattr(os, "pidfd_open") else 0.1):
+				key.data(key.fileobj)
+			if not hasattr(os, "pidfd_open"):
+				for pid in list(self.children):
+					self.reap(pid)
+
+	def accept(self, server):
+		conn, _ = server.accept()
+		fds = []
+		try:
+			## Only the daemon's user (or root) may run agents as that user
+			_, uid, _ = struct.unpack("3i", conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")))
+			if uid not in (0, os.getuid()):
+				raise PermissionError("connection from uid %d refused" % uid)
+			conn.settimeout(CONNECT_TIMEOUT)
+			request, fds = _recv_message(conn, 3)
+			if not request or len(fds) != 3:
+				raise ValueError("incomplete request")
+			if request.get("version") != self.version:
+				## the client runs the agent itself
+				_send_message(conn, {"error": "library version %s differs from %s of the daemon" % \
+						(request.get("version"), self.version)})
+				raise ValueError("library version %s differs from %s, restart of the daemon is needed" % \
+						(request.get("version"), self.version))
+			code = self.load_agent(request["script"])
+			sys.stdout.flush()
+			sys.stderr.flush()
+			pid = os.fork()
+			if pid == 0:
+				self.server.close()
+				conn.close()
+				run_agent(request, fds, code)
+			try:
+				os.setpgid(pid, pid)
+			except OSError:
+				pass
+		except Exception as ex:
+			logging.error("Unable to start agent: %s", ex)
+			conn.close()
+			return
+		finally:
+			for fd in fds:
+				os.close(fd)
+
+		conn.settimeout(None)
+		pidfd = os.pidfd_open(pid) if hasattr(os, "pidfd_open") else None
+		self.children[pid] = (conn, pidfd)
+		self.selector.register(conn, selectors.EVENT_READ, lambda c, pid=pid: self.kill(pid))
+		if pidfd is not None:
+			self.selector.register(pidfd, selectors.EVENT_READ, lambda fd, pid=pid: self.reap(pid))
+		logging.debug("Started %s (pid %d)", " ".join(request["argv"]), pid)
+		try:
+			_send_message(conn, {"pid": pid})
+		except OSError:
+			self.kill(pid)
+
+	def kill(self, pid):
+		## Client went away (e.g. fenced timed out and killed it), so does the agent
+		if pid not in self.children:
+			return
+		try:
+			os.killpg(pid, signal.SIGKILL)
+		except OSError:
+			pass
+		self.reap(pid, True)
+
+	def reap(self, pid, block=False):
+		if pid not in self.children:
+			return
+		try:
+			(waited, status) = os.waitpid(pid, 0 if block else os.WNOHANG)
+		except ChildProcessError:
+			(waited, status) = (pid, EC_GENERIC_ERROR << 8)
+		if waited == 0:
+			return
+
+		(conn, pidfd) = self.children.pop(pid)
+		self.selector.unregister(conn)
+		if pidfd is not None:
+			self.selector.unregister(pidfd)
+			os.close(pidfd)
+		status = os.WEXITSTATUS(status) if os.WIFEXITED(status) else EC_GENERIC_ERROR
+		logging.debug("Agent %d exited with %d", pid, status)
+		try:
+			_send_message(conn, {"status": status})
+		except OSError:
+			pass
+		conn.close()
+
+def run_agent(request, fds, code, own_group=True):
+	"""Run agent in the forked child exactly as if it was started by the client
+
+	With own_group=False the child stays in the process group of its parent,
+	so it is killed together with it (e.g. devices of fence_multi)."""
+	status = EC_GENERIC_ERROR
+	try:
+		if own_group:
+			os.setpgid(0, 0)
+		for (target, fd) in enumerate(fds):
+			os.dup2(fd, target)
+			os.close(fd)
+		sys.stdin = open(0, "r", closefd=False)
+		sys.stdout = open(1, "w", closefd=False)
+		sys.stderr = open(2, "w", closefd=False)
+
+		for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+			signal.signal(signum, signal.SIG_DFL)
+		logging.getLogger().handlers = []
+		logging.getLogger().setLevel(logging.WARNING)
+
+		os.environ.clear()
+		os.environ.update(request["env"])
+		try:
+			os.chdir(request["cwd"])
+		except OSError:
+			pass
+		sys.argv = request["argv"]
+
+		import fencing
+		fencing.run_delay.time_start = time.time()
+		fencing._timing.update({"start": time.monotonic(), "phases": []})
+		fencing._read_stdin.lines = request.get("stdin")
+
+		exec(code, {"__name__": "__main__", "__file__": request["script"], "__builtins__": __builtins__})
+		status = 0
+	except SystemExit as ex:
+		if ex.code is None:
+			status = 0
+		elif isinstance(ex.code, int):
+			status = ex.code
+		else:
+			sys.stderr.write("%s\n" % ex.code)
+	except BaseException:
+		import traceback
+		traceback.print_exc()
+	finally:
+		try:
+			atexit._run_exitfuncs()
+			sys.stdout.flush()
+			sys.stderr.flush()
+		except Exception:
+			pass
+		os._exit(status)
+
+def main():
+	import argparse
+
+	parser = argparse.ArgumentParser(prog="fence-agentd", description="Run fence agents in a persistent process")
+	parser.add_argument("-s", "--socket", default=os.environ.get(SOCKET_ENV, SOCKET_PATH),
+			help="UNIX socket to listen on (default: %(default)s)")
+	parser.add_argument("-p", "--preload", action="append", default=[], metavar="AGENT",
+			help="Path of a fence agent to load on startup, can be repeated")
+	parser.add_argument("-v", "--verbose", action="store_true", help="Verbose logging")
+	args = parser.parse_args()
+
+	logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.DEBUG if args.verbose else logging.INFO)
+
+	## Warm up the library for all agents
+	import fencing
+
+	daemon = AgentDaemon(args.socket)
+	load_lazy_modules()
+	for agent in args.preload:
+		daemon.load_agent(agent)
+
+	def stop(signum, frame):
+		sys.exit(0)
+	signal.signal(signal.SIGTERM, stop)
+	signal.signal(signal.SIGINT, stop)
+	if not hasattr(os, "pidfd_open"):
+		signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+
+	daemon.listen()
+	logging.info("Listening on %s", args.socket)
+	try:
+		daemon.serve_forever()
+	finally:
+		daemon.close()
@@ -0,0 +1,224 @@
+#!@PYTHON@ -tt
+
+## HTTP client of REST/XML agents
+##
+## FencingHttp sends all requests of the agent through pycurl handles which are
+## kept for the whole run:
+##
+## * connections are kept alive and reused by next requests, the TLS sessions
+##   and DNS results are shared by the handles of all threads (--plug-concurrency)
+## * HTTP/2 is negotiated by ALPN when the device supports it
+## * TLS verification, proxy and timeouts are set from the standard options
+##   (--ssl-secure/--ssl-insecure, --proxy, --shell-timeout)
+## * every request is recorded as "http" phase for --timing-file together with
+##   its status code, the time of TCP connect and TLS handshake and whether the
+##   connection was reused
+##
+## Errors of the transport are raised as HttpError, the HTTP status code has to
+## be checked by the agent. Coroutines of agents use request_async() and
+## get_async()/post_async() instead.
+
+import io
+import json
+import logging
+import threading
+from fencing import lazy_import, timing_phase
+
+pycurl = lazy_import("pycurl")
+
+__all__ = ["FencingHttp", "HttpResponse", "HttpError"]
+
+class HttpError(Exception):
+	pass
+
+class HttpResponse:
+	def __init__(self, code, headers, body):
+		self.code = code
+		## list of (name, value), names are in lowercase
+		self.header_list = headers
+		self.headers = dict(headers)
+		self.body = body
+
+	@property
+	def text(self):
+		return self.body.decode("utf-8", "replace")
+
+	@property
+	def cookies(self):
+		cookies = {}
+		for (name, value) in self.header_list:
+			if name == "set-cookie" and "=" in value:
+				(cookie, content) = value.split(";", 1)[0].split("=", 1)
+				cookies[cookie.strip()] = content.strip()
+		return cookies
+
+	def json(self):
+		return json.loads(self.text)
+
+class FencingHttp:
+	def __init__(self, options, base_url="", headers=None, auth=None, timeout=None, http2=True,
+			cookie_file=None, **tls):
+		## auth is (username, password) for basic authentication, tls are paths of
+		## client certificate, its key and CA certificates: cert=, key=, cacert=
+		## With cookie_file the cookies are stored by libcurl in the file ("" keeps
+		## them in memory) and sent with next requests.
+		self.options = options
+		self.base_url = base_url
+		self.headers = dict(headers or {})
+		self.auth = auth
+		self.timeout = int(timeout if timeout is not None else options.get("--shell-timeout", 0))
+		self.http2 = http2
+		self.tls = tls
+		self.cookie_file = cookie_file
+		self.local = threading.local()
+		self.handles = []
+		self.lock = threading.Lock()
+		self.share = None
+
+	def _handle(self):
+		## one handle per thread, pycurl handles can not be used by more threads at once
+		handle = getattr(self.local, "handle", None)
+		if handle is not None:
+			return handle
+
+		with self.lock:
+			if self.share is None:
+				self.share = pycurl.CurlShare()
+				self.share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_DNS)
+				self.share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_SSL_SESSION)
+				if hasattr(pycurl, "LOCK_DATA_CONNECT"):
+					self.share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_CONNECT)
+				if self.cookie_file is not None:
+					self.share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_COOKIE)
+
+			handle = pycurl.Curl()
+			self.handles.append(handle)
+
+		handle.setopt(pycurl.SHARE, self.share)
+		handle.setopt(pycurl.NOSIGNAL, 1)
+		handle.setopt(pycurl.TCP_KEEPALIVE, 1)
+		if self.http2 and hasattr(pycurl, "CURL_HTTP_VERSION_2TLS"):
+			handle.setopt(pycurl.HTTP_VERSION, pycurl.CURL_HTTP_VERSION_2TLS)
+		else:
+			handle.setopt(pycurl.HTTP_VERSION, pycurl.CURL_HTTP_VERSION_1_1)
+
+		if "--ssl-insecure" in self.options:
+			handle.setopt(pycurl.SSL_VERIFYPEER, 0)
+			handle.setopt(pycurl.SSL_VERIFYHOST, 0)
+		else:
+			handle.setopt(pycurl.SSL_VERIFYPEER, 1)
+			handle.setopt(pycurl.SSL_VERIFYHOST, 2)
+		for (name, curl_option) in [("cert", pycurl.SSLCERT), ("key", pycurl.SSLKEY), ("cacert", pycurl.CAINFO)]:
+			if self.tls.get(name):
+				handle.setopt(curl_option, self.tls[name])
+
+		if self.cookie_file is not None:
+			handle.setopt(pycurl.COOKIEFILE, self.cookie_file)
+			if self.cookie_file:
+				handle.setopt(pycurl.COOKIEJAR, self.cookie_file)
+
+		if self.options.get("--proxy"):
+			handle.setopt(pycurl.PROXY, self.options["--proxy"])
+		if "--unix-socket" in self.options:
+			handle.setopt(pycurl.UNIX_SOCKET_PATH, self.options["--unix-socket"])
+		if int(self.options.get("--verbose-level", 0)) > 1:
+			handle.setopt(pycurl.VERBOSE, 1)
+
+		self.local.handle = handle
+		return handle
+
+	def request(self, method, url, data=None, json_data=None, headers=None, auth=True, timeout=None):
+		## url relative to base_url, auth=False sends the request without basic authentication
+		handle = self._handle()
+		url = self.base_url + url
+
+		headers = dict(self.headers, **(headers or {}))
+		if json_data is not None:
+			data = json.dumps(json_data)
+			headers.setdefault("Content-Type", "application/json")
+		if isinstance(data, str):
+			data = data.encode("utf-8")
+
+		handle.setopt(pycurl.URL, url.encode("utf-8"))
+		if data is not None or method in ["POST", "PUT", "PATCH"]:
+			handle.setopt(pycurl.POSTFIELDS, data or b"")
+		else:
+			handle.setopt(pycurl.HTTPGET, 1)
+		handle.setopt(pycurl.NOBODY, 1 if method == "HEAD" else 0)
+		if method in ["GET", "POST", "HEAD"]:
+			handle.unsetopt(pycurl.CUSTOMREQUEST)
+		else:
+			handle.setopt(pycurl.CUSTOMREQUEST, method)
+		## no "Expect: 100-continue" round trip
+		handle.setopt(pycurl.HTTPHEADER, ["%s: %s" % (k, v) for (k, v) in headers.items()] + ["Expect:"])
+
+		if auth and self.auth is not None:
+			handle.setopt(pycurl.HTTPAUTH, pycurl.HTTPAUTH_BASIC)
+			handle.setopt(pycurl.USERPWD, "%s:%s" % self.auth)
+		else:
+			handle.unsetopt(pycurl.USERPWD)
+
+		handle.setopt(pycurl.TIMEOUT, int(timeout if timeout is not None else self.timeout))
+
+		body = io.BytesIO()
+		response_headers = []
+		def header_line(line):
+			line = line.decode("iso-8859-1").strip()
+			if line.startswith("HTTP/"):
+				## headers of the final response only (e.g. after 100 Continue or redirect)
+				del response_headers[:]
+			elif ":" in line:
+				(name, value) = line.split(":", 1)
+				response_headers.append((name.strip().lower(), value.strip()))
+		handle.setopt(pycurl.WRITEFUNCTION, body.write)
+		handle.setopt(pycurl.HEADERFUNCTION, header_line)
+
+		logging.debug("%s %s\n", method, url)
+		with timing_phase("http", self.options) as phase:
+			try:
+				handle.perform()
+			except pycurl.error as e:
+				raise HttpError("%s %s: %s" % (method, url, e.args[-1]))
+
+			response = HttpResponse(handle.getinfo(pycurl.RESPONSE_CODE), response_headers, body.getvalue())
+			phase.update({"method": method, "code": response.code,
+				"connect": round(handle.getinfo(pycurl.CONNECT_TIME), 6),
+				"tls": round(handle.getinfo(pycurl.APPCONNECT_TIME), 6),
+				"reused": handle.getinfo(pycurl.NUM_CONNECTS) == 0})
+
+		logging.debug("%d %s\n", response.code, response.text)
+		return response
+
+	def get(self, url, **kwargs):
+		return self.request("GET", url, **kwargs)
+
+	def post(self, url, data=None, **kwargs):
+		return self.request("POST", url, data, **kwargs)
+
+	def delete(self, url, **kwargs):
+		return self.request("DELETE", url, **kwargs)
+
+	async def request_async(self, method, url, **kwargs):
+		## request() for coroutines of fence_action_async(), it runs in a thread, so
+		## more requests are sent concurrently on their own connections
+		import asyncio
+		import functools
+
+		return await asyncio.get_event_loop().run_in_executor(None,
+				functools.partial(self.request, method, url, **kwargs))
+
+	async def get_async(self, url, **kwargs):
+		return await self.request_async("GET", url, **kwargs)
+
+	async def post_async(self, url, data=None, **kwargs):
+		return await self.request_async("POST", url, data=data, **kwargs)
+
+	def close(self):
+		with self.lock:
+			for handle in self.handles:
+				handle.close()
+			self.handles = []
+			if self.share is not None:
+				self.share.close()
+				self.share = None
+		self.local = threading.local()
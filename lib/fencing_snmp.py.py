@@ -2,10 +2,16 @@
 
 # For example of use please see fence_cisco_mds
 
-import re, pexpect
+import re
+import time
+import socket
 import logging
 from fencing import *
-from fencing import fail, fail_usage, EC_TIMED_OUT, run_delay, frun
+from fencing import fail, fail_usage, EC_TIMED_OUT, run_delay, frun, lazy_import
+from fencing_snmp_engine import SnmpEngine, SnmpError, SnmpTimeout, privacy_available
+from fencing_cache import FencingCache
+
+pexpect = lazy_import("pexpect")
 
 __all__ = ['FencingSnmp']
 
@@ -13,6 +19,10 @@ __all__ = ['FencingSnmp']
 class FencingSnmp:
 	def __init__(self, options):
 		self.options = options
+		self.engine = None
+		self.usm_cache = None
+		self.usm_state = None
+		self.usm_args = None
 		run_delay(options)
 
 	def quote_for_run(self, string):
@@ -44,6 +54,122 @@ class FencingSnmp:
 			if res:
 				exec(val[1])
 
+	def native_engine(self):
+		## in-process engine, None when the net-snmp tools have to be used
+		if self.engine is None:
+			self.complete_missed_params()
+			self.engine = False
+
+			if self.options.get("--snmp-engine", "native").lower() != "native":
+				return None
+			if self.options.get("--snmp-version") == "3" and \
+					self.options.get("--snmp-sec-level", "").lower() == "authpriv" and not privacy_available():
+				logging.debug("python cryptography module is not available, using net-snmp tools for SNMPv3 privacy\n")
+				return None
+
+			self.engine = self.new_engine()
+			self.load_usm_state(self.engine)
+
+		return self.engine or None
+
+	def new_engine(self):
+		family = socket.AF_UNSPEC
+		if "--inet6-only" in self.options:
+			family = socket.AF_INET6
+		if "--inet4-only" in self.options:
+			family = socket.AF_INET
+
+		try:
+			return SnmpEngine(self.options["--ip"], self.options.get("--ipport", 161),
+					version=self.options.get("--snmp-version", "3"),
+					community=self.options.get("--community", "public"), family=family,
+					username=self.options.get("--username", ""),
+					sec_level=self.options.get("--snmp-sec-level", "noAuthNoPriv"),
+					auth_prot=self.options.get("--snmp-auth-prot", "MD5"),
+					auth_passwd=self.options.get("--password", ""),
+					priv_prot=self.options.get("--snmp-priv-prot", "DES"),
+					priv_passwd=self.options.get("--snmp-priv-passwd", ""))
+		except SnmpError as e:
+			fail_usage(str(e))
+
+	def load_usm_state(self, engine):
+		## SNMPv3 engine ID, boots and time offset of the device from previous runs, so
+		## the discovery is not repeated by every run. The cache is shared by all SNMP agents.
+		if self.options.get("--snmp-version") != "3":
+			return
+
+		self.usm_cache = FencingCache(self.options, "snmp")
+		self.usm_state = self.usm_cache.get("usm")
+		if self.usm_state is not None:
+			(engine_id, boots, offset) = self.usm_state
+			engine.set_usm_state(bytes.fromhex(engine_id), boots, offset + int(time.time()))
+
+	def save_usm_state(self, engine):
+		state = engine.usm_state()
+		if state is None:
+			## discovery of the engine failed
+			if self.usm_state is not None:
+				self.usm_cache.invalidate("usm")
+				self.usm_state = None
+			return
+
+		state = [state[0].hex(), state[1], state[2] - int(time.time())]
+		if self.usm_state is None or state[:2] != self.usm_state[:2] or abs(state[2] - self.usm_state[2]) > 1:
+			self.usm_cache.set("usm", state)
+			self.usm_state = state
+
+	def prepare_usm_args(self):
+		## net-snmp tools get the state of SNMPv3 engine by -e and -Z and skip the discovery,
+		## it is discovered once by the in-process engine when it is not cached yet. This
+		## is done only when the native engine is not available for privacy, with explicit
+		## --snmp-engine=net-snmp the tools do the discovery themselves.
+		if self.usm_args is None:
+			self.usm_args = ""
+			if self.options.get("--snmp-engine", "native").lower() != "native":
+				return self.usm_args
+
+			engine = self.new_engine()
+			self.load_usm_state(engine)
+			if self.usm_state is None:
+				try:
+					engine.discover(int(self.options["--shell-timeout"]) + int(self.options["--login-timeout"]))
+					self.save_usm_state(engine)
+				except SnmpError as e:
+					logging.debug("%s\n", str(e))
+				engine.close()
+
+			if self.usm_state is not None:
+				(engine_id, boots, offset) = self.usm_state
+				self.usm_args = " -e 0x%s -Z %d,%d" % (engine_id, boots, offset + int(time.time()))
+
+		return self.usm_args
+
+	def run_engine(self, command, args, additional_timeout=0, stop=True, **kwargs):
+		timeout = int(self.options["--shell-timeout"]) + int(self.options["--login-timeout"]) + additional_timeout
+		def flatten(value):
+			if isinstance(value, (list, tuple)):
+				return " ".join([flatten(x) for x in value])
+			return str(value)
+
+		logging.debug("snmp%s %s\n", command, flatten(args))
+
+		try:
+			output = getattr(self.native_engine(), command)(*args, timeout=timeout, **kwargs)
+		except SnmpTimeout as e:
+			logging.error("%s\n", str(e))
+			fail(EC_TIMED_OUT)
+		except SnmpError as e:
+			if stop:
+				fail_usage(str(e.args[0]))
+			logging.debug("%s\n", str(e.args[0]))
+			return None
+		finally:
+			if self.usm_cache is not None:
+				self.save_usm_state(self.native_engine())
+
+		logging.debug("%s\n", "\n".join([" ".join(x) for x in output]))
+		return output
+
 	def prepare_cmd(self, command):
 		cmd = "%s -m '' -Oeqn "% (command)
 
@@ -65,6 +191,8 @@ class FencingSnmp:
 				if "--"+item[0] in self.options:
 					cmd += " -%s '%s'"% (item[1], self.quote_for_run(self.options["--" + item[0]]))
 
+			cmd += self.prepare_usm_args()
+
 		force_ipvx = ""
 
 		if "--inet6-only" in self.options:
@@ -77,7 +205,7 @@ class FencingSnmp:
 				"--ipport" in self.options and self.quote_for_run(":" + str(self.options["--ipport"])) or "")
 		return cmd
 
-	def run_command(self, command, additional_timeout=0):
+	def run_command(self, command, additional_timeout=0, stop=True):
 		try:
 			logging.debug("%s\n", command)
 
@@ -87,42 +215,106 @@ class FencingSnmp:
 					additional_timeout, True)
 
 			if res_code == None:
+				if self.usm_args and self.usm_args in command:
+					self.usm_cache.invalidate("usm")
 				fail(EC_TIMED_OUT)
 
 			logging.debug("%s\n", res_output)
 
 			if (res_code != 0) or (re.search(r"^Error ", res_output, re.MULTILINE) != None):
-				fail_usage("Returned %d: %s"% (res_code, res_output))
+				if self.usm_args and self.usm_args in command and \
+						re.search(r"Unknown Engine ID|Not in time window", res_output, re.IGNORECASE):
+					## cached state of SNMPv3 engine is not valid anymore
+					self.usm_cache.invalidate("usm")
+					command = command.replace(self.usm_args, "")
+					self.usm_args = ""
+					return self.run_command(command, additional_timeout, stop)
+
+				if stop:
+					fail_usage("Returned %d: %s"% (res_code, res_output))
+				return None
 		except pexpect.ExceptionPexpect:
 			fail_usage("Cannot run command %s"%(command))
 
 		return res_output
 
-	def get(self, oid, additional_timeout=0):
+	def get(self, oid, additional_timeout=0, stop=True):
+		## with stop=False an error reported by the device returns None
+		if self.native_engine():
+			output = self.run_engine("get", [[oid]], additional_timeout, stop)
+			return output and output[-1]
+
 		cmd = "%s '%s'"% (self.prepare_cmd(self.options["--snmpget-path"]), self.quote_for_run(oid))
 
-		output = self.run_command(cmd, additional_timeout).splitlines()
+		output = self.run_command(cmd, additional_timeout, stop)
+		if output is None:
+			return None
+
+		output = output.splitlines()
 
 		return output[len(output)-1].split(None, 1)
 
+	def get_many(self, oids, additional_timeout=0):
+		## all oids in one request, returns [oid, value] in order of oids
+		if self.native_engine():
+			return self.run_engine("get", [oids], additional_timeout)
+
+		cmd = "%s %s"% (self.prepare_cmd(self.options["--snmpget-path"]),
+				" ".join(["'%s'" % self.quote_for_run(oid) for oid in oids]))
+
+		output = self.run_command(cmd, additional_timeout).splitlines()
+
+		return [x.split(None, 1) for x in output if x.startswith(".")]
+
 	def set(self, oid, value, additional_timeout=0):
+		self.set_many([(oid, value)], additional_timeout)
+
+	def set_many(self, values, additional_timeout=0):
+		## values is list of (oid, value), all of them are set in one request
+		if self.native_engine():
+			self.run_engine("set", [values], additional_timeout)
+			return
+
 		mapping = ((int, 'i'), (str, 's'))
 
-		type_of_value = ''
+		cmd = self.prepare_cmd(self.options["--snmpset-path"])
 
-		for item in mapping:
-			if isinstance(value, item[0]):
-				type_of_value = item[1]
-				break
+		for (oid, value) in values:
+			type_of_value = ''
+
+			for item in mapping:
+				if isinstance(value, item[0]):
+					type_of_value = item[1]
+					break
 
-		cmd = "%s '%s' %s '%s'" % (self.prepare_cmd(self.options["--snmpset-path"]),
-				self.quote_for_run(oid), type_of_value, self.quote_for_run(str(value)))
+			cmd += " '%s' %s '%s'" % (self.quote_for_run(oid), type_of_value, self.quote_for_run(str(value)))
 
 		self.run_command(cmd, additional_timeout)
 
 	def walk(self, oid, additional_timeout=0):
+		if self.native_engine():
+			return self.run_engine("walk", [oid], additional_timeout)
+
 		cmd = "%s '%s'"% (self.prepare_cmd(self.options["--snmpwalk-path"]), self.quote_for_run(oid))
 
 		output = self.run_command(cmd, additional_timeout).splitlines()
 
 		return [x.split(None, 1) for x in output if x.startswith(".")]
+
+	def bulkwalk(self, oid, additional_timeout=0):
+		## walk of whole table with GETBULK requests, SNMPv1 has no GETBULK and uses walk()
+		self.complete_missed_params()
+		max_repetitions = int(self.options.get("--snmp-max-repetitions", 10))
+
+		if max_repetitions < 1 or self.options.get("--snmp-version") == "1":
+			return self.walk(oid, additional_timeout)
+
+		if self.native_engine():
+			return self.run_engine("walk", [oid], additional_timeout, max_repetitions=max_repetitions)
+
+		cmd = "%s '%s'"% (self.prepare_cmd("%s -Cr%d" % (self.options["--snmpbulkwalk-path"], max_repetitions)),
+				self.quote_for_run(oid))
+
+		output = self.run_command(cmd, additional_timeout).splitlines()
+
+		return [x.split(None, 1) for x in output if x.startswith(".")]
@@ -0,0 +1,648 @@
+#!@PYTHON@ -tt
+
+## In-process SNMP v1/v2c/v3 client
+##
+## FencingSnmp uses this engine instead of running snmpget, snmpset and
+## snmpwalk for every request:
+##
+## * requests are BER encoded here and sent over one UDP socket per thread,
+##   which is reused for all requests of the agent
+## * values are returned formatted as the net-snmp tools print them with
+##   -Oeqn (numeric OIDs, quoted strings, numeric enums), so the agents get
+##   the same strings from both implementations
+## * SNMPv3 supports the USM with MD5/SHA authentication, DES/AES privacy
+##   needs the python cryptography module (see privacy_available())
+##
+## Errors are raised as SnmpError (SnmpTimeout when the device does not answer)
+## with the message the net-snmp tools would print.
+
+import time, socket, struct, random, hashlib, hmac, threading
+import importlib.util
+
+__all__ = ["SnmpEngine", "SnmpError", "SnmpTimeout", "privacy_available"]
+
+BER_INTEGER = 0x02
+BER_OCTET_STRING = 0x04
+BER_NULL = 0x05
+BER_OID = 0x06
+BER_SEQUENCE = 0x30
+BER_IPADDRESS = 0x40
+BER_COUNTER32 = 0x41
+BER_GAUGE32 = 0x42
+BER_TIMETICKS = 0x43
+BER_OPAQUE = 0x44
+BER_COUNTER64 = 0x46
+BER_NO_SUCH_OBJECT = 0x80
+BER_NO_SUCH_INSTANCE = 0x81
+BER_END_OF_MIB_VIEW = 0x82
+
+SNMP_GET = 0xa0
+SNMP_GETNEXT = 0xa1
+SNMP_RESPONSE = 0xa2
+SNMP_SET = 0xa3
+SNMP_GETBULK = 0xa5
+SNMP_REPORT = 0xa8
+
+SNMP_VERSIONS = {"1": 0, "2c": 1, "3": 3}
+
+## net-snmp defaults: every request is sent again after 1 second
+RETRY_INTERVAL = 1.0
+MAX_MESSAGE_SIZE = 65507
+
+ERROR_STATUS = ["noError", "tooBig", "noSuchName", "badValue", "readOnly", "genErr",
+		"noAccess", "wrongType", "wrongLength", "wrongEncoding", "wrongValue",
+		"noCreation", "inconsistentValue", "resourceUnavailable", "commitFailed",
+		"undoFailed", "authorizationError", "notWritable", "inconsistentName"]
+
+EXCEPTIONS = {
+	BER_NO_SUCH_OBJECT : "No Such Object available on this agent at this OID",
+	BER_NO_SUCH_INSTANCE : "No Such Instance currently exists at this OID",
+	BER_END_OF_MIB_VIEW : "No more variables left in this MIB View (It is past the end of the MIB tree)"
+}
+
+USM_STATS = ".1.3.6.1.6.3.15.1.1."
+USM_NOT_IN_TIME_WINDOW = USM_STATS + "2.0"
+USM_UNKNOWN_ENGINE_ID = USM_STATS + "4.0"
+USM_WRONG_DIGEST = USM_STATS + "5.0"
+USM_REPORTS = {
+	USM_STATS + "1.0" : "Unsupported security level",
+	USM_NOT_IN_TIME_WINDOW : "Not in time window",
+	USM_STATS + "3.0" : "Unknown user name",
+	USM_UNKNOWN_ENGINE_ID : "Unknown engine ID",
+	USM_WRONG_DIGEST : "Authentication failure (incorrect password, community or key)",
+	USM_STATS + "6.0" : "Decryption error"
+}
+
+MSG_FLAG_AUTH = 0x01
+MSG_FLAG_PRIV = 0x02
+MSG_FLAG_REPORTABLE = 0x04
+USM_SECURITY_MODEL = 3
+AUTH_PARAMS_LENGTH = 12
+
+class SnmpError(Exception):
+	pass
+
+class SnmpTimeout(SnmpError):
+	pass
+
+def privacy_available():
+	""" DES and AES are implemented by the cryptography module, which is optional """
+	return importlib.util.find_spec("cryptography") is not None
+
+##
+## BER encoding
+#####
+def _oid_tuple(oid):
+	try:
+		return tuple([int(x) for x in oid.strip().strip(".").split(".")])
+	except ValueError:
+		raise SnmpError("%s: Unknown Object Identifier" % oid)
+
+def ber_encode(tag, value):
+	""" Encode value, constructed values (sequences, PDUs) are lists of encoded items """
+	if tag in [BER_INTEGER, BER_COUNTER32, BER_GAUGE32, BER_TIMETICKS, BER_COUNTER64]:
+		payload = value.to_bytes(max(1, (value + (value < 0)).bit_length() // 8 + 1), "big", signed=True)
+	elif tag == BER_OID:
+		ids = _oid_tuple(value)
+		if len(ids) < 2:
+			ids = ids + (0,) * (2 - len(ids))
+		payload = bytes([ids[0] * 40 + ids[1]])
+		for x in ids[2:]:
+			chunk = [x & 0x7f]
+			x >>= 7
+			while x:
+				chunk.insert(0, 0x80 | (x & 0x7f))
+				x >>= 7
+			payload += bytes(chunk)
+	elif tag == BER_IPADDRESS:
+		payload = socket.inet_aton(value)
+	elif tag & 0x20:
+		payload = b"".join(value)
+	elif value is None:
+		payload = b""
+	else:
+		payload = value.encode() if isinstance(value, str) else value
+
+	if len(payload) < 0x80:
+		length = bytes([len(payload)])
+	else:
+		size = (len(payload).bit_length() + 7) // 8
+		length = bytes([0x80 | size]) + len(payload).to_bytes(size, "big")
+	return bytes([tag]) + length + payload
+
+def _ber_header(data, pos):
+	""" Return (tag, length, position of content) """
+	try:
+		tag = data[pos]
+		length = data[pos + 1]
+		pos += 2
+		if length & 0x80:
+			size = length & 0x7f
+			if pos + size > len(data):
+				raise IndexError()
+			length = int.from_bytes(data[pos:pos + size], "big")
+			pos += size
+	except IndexError:
+		raise SnmpError("Truncated BER encoding")
+	if pos + length > len(data):
+		raise SnmpError("Truncated BER encoding")
+	return (tag, length, pos)
+
+def ber_decode(data, pos=0):
+	""" Return (tag, value, next position), constructed values are lists of (tag, value) """
+	(tag, length, pos) = _ber_header(data, pos)
+	payload = data[pos:pos + length]
+	end = pos + length
+
+	if tag == BER_INTEGER:
+		return (tag, int.from_bytes(payload, "big", signed=True), end)
+	elif tag in [BER_COUNTER32, BER_GAUGE32, BER_TIMETICKS, BER_COUNTER64]:
+		return (tag, int.from_bytes(payload, "big"), end)
+	elif tag == BER_OID:
+		if not payload:
+			raise SnmpError("Empty object identifier")
+		ids = [min(payload[0] // 40, 2), payload[0] - min(payload[0] // 40, 2) * 40]
+		x = 0
+		for byte in payload[1:]:
+			x = (x << 7) | (byte & 0x7f)
+			if not byte & 0x80:
+				ids.append(x)
+				x = 0
+		return (tag, "." + ".".join([str(i) for i in ids]), end)
+	elif tag & 0x20:
+		items = []
+		while pos < end:
+			(item_tag, item, pos) = ber_decode(data, pos)
+			items.append((item_tag, item))
+		return (tag, items, end)
+	return (tag, payload, end)
+
+##
+## Output in the format of net-snmp -Oeqn
+#####
+def _format_string(value):
+	## isprint() or isspace() of the C locale
+	if all([0x20 <= c < 0x7f or 0x09 <= c <= 0x0d for c in value]):
+		return '"%s"' % value.decode("ascii").replace("\\", "\\\\").replace('"', '\\"')
+	return "".join(["%02X " % c for c in value])
+
+def format_value(tag, value):
+	if tag in [BER_INTEGER, BER_COUNTER32, BER_GAUGE32, BER_COUNTER64]:
+		return str(value)
+	elif tag == BER_OCTET_STRING:
+		return _format_string(value)
+	elif tag == BER_OID:
+		return value
+	elif tag == BER_IPADDRESS:
+		return ".".join([str(c) for c in value])
+	elif tag == BER_TIMETICKS:
+		(seconds, centiseconds) = divmod(value, 100)
+		(minutes, seconds) = divmod(seconds, 60)
+		(hours, minutes) = divmod(minutes, 60)
+		(days, hours) = divmod(hours, 24)
+		return "%d:%d:%02d:%02d.%02d" % (days, hours, minutes, seconds, centiseconds)
+	elif tag == BER_NULL:
+		return "NULL"
+	elif tag in EXCEPTIONS:
+		return EXCEPTIONS[tag]
+	return "".join(["%02X " % c for c in value])
+
+##
+## SNMPv3 user-based security model (RFC 3414, RFC 3826)
+#####
+def password_to_key(password, engine_id, digest):
+	""" Localized key of password for the authoritative engine_id """
+	password = password.encode() if isinstance(password, str) else password
+	data = password * (1048576 // len(password) + 1)
+	key = hashlib.new(digest, data[:1048576]).digest()
+	return hashlib.new(digest, key + engine_id + key).digest()
+
+class _Usm(object):
+	""" Security parameters of one user at one authoritative engine """
+	def __init__(self, username, sec_level, auth_prot, auth_passwd, priv_prot, priv_passwd):
+		self.username = username
+		## values of options with choices are upper case
+		self.auth = sec_level.lower() in ["authnopriv", "authpriv"]
+		self.priv = sec_level.lower() == "authpriv"
+		for (used, passwd) in [(self.auth, auth_passwd), (self.priv, priv_passwd)]:
+			if used and len(passwd or "") < 8:
+				raise SnmpError("Error: passphrase chosen is below the length requirements of the USM (min=8).")
+		self.digest = {"MD5": "md5", "SHA": "sha1"}[(auth_prot or "MD5").upper()]
+		self.priv_prot = (priv_prot or "DES").upper()
+		self.auth_passwd = auth_passwd
+		self.priv_passwd = priv_passwd
+		self.engine_id = None
+		self.restored = False
+		self.boots = 0
+		self.engine_time = 0
+		self.synced = 0
+		self.auth_key = None
+		self.priv_key = None
+		self.salt = random.getrandbits(63)
+		self.lock = threading.Lock()
+
+	def discovered(self, engine_id, boots, engine_time):
+		with self.lock:
+			if engine_id != self.engine_id:
+				self.engine_id = engine_id
+				if self.auth:
+					self.auth_key = password_to_key(self.auth_passwd, engine_id, self.digest)
+				if self.priv:
+					self.priv_key = password_to_key(self.priv_passwd, engine_id, self.digest)
+			self.boots = boots
+			self.engine_time = engine_time
+			self.synced = time.monotonic()
+
+	def flags(self):
+		return (self.auth and MSG_FLAG_AUTH or 0) | (self.priv and MSG_FLAG_PRIV or 0)
+
+	def clock(self):
+		with self.lock:
+			return (self.boots, self.engine_time + int(time.monotonic() - self.synced))
+
+	def sign(self, message):
+		return hmac.new(self.auth_key, message, self.digest).digest()[:AUTH_PARAMS_LENGTH]
+
+	def _cipher(self, iv):
+		from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+		try:
+			from cryptography.hazmat.decrepit.ciphers.algorithms import TripleDES
+			from cryptography.hazmat.decrepit.ciphers.modes import CFB
+		except ImportError:
+			(TripleDES, CFB) = (algorithms.TripleDES, modes.CFB)
+		if self.priv_prot == "AES":
+			return Cipher(algorithms.AES(self.priv_key[:16]), CFB(iv))
+		## 3DES with three identical keys is DES
+		return Cipher(TripleDES(self.priv_key[:8] * 3), modes.CBC(iv))
+
+	def _iv(self, salt, boots, engine_time):
+		if self.priv_prot == "AES":
+			return struct.pack(">II", boots, engine_time) + salt
+		return bytes([a ^ b for (a, b) in zip(self.priv_key[8:16], salt)])
+
+	def encrypt(self, data, boots, engine_time):
+		""" Return (privacy parameters, encrypted data) """
+		with self.lock:
+			self.salt = (self.salt + 1) & 0xffffffffffffffff
+			salt = self.salt
+		if self.priv_prot == "AES":
+			salt = struct.pack(">Q", salt)
+		else:
+			salt = struct.pack(">II", boots, salt & 0xffffffff)
+			data += b"\0" * (-len(data) % 8)
+		encryptor = self._cipher(self._iv(salt, boots, engine_time)).encryptor()
+		return (salt, encryptor.update(data) + encryptor.finalize())
+
+	def decrypt(self, data, salt, boots, engine_time):
+		if len(salt) != 8 or (self.priv_prot == "DES" and len(data) % 8):
+			raise SnmpError("Decryption error")
+		decryptor = self._cipher(self._iv(salt, boots, engine_time)).decryptor()
+		return decryptor.update(data) + decryptor.finalize()
+
+##
+## Engine
+#####
+class SnmpEngine(object):
+	""" SNMP client of one device, methods return lists of [oid, value] as printed by net-snmp """
+	def __init__(self, host, port=161, version="2c", community="public", family=socket.AF_UNSPEC,
+			username="", sec_level="noAuthNoPriv", auth_prot="MD5", auth_passwd="",
+			priv_prot="DES", priv_passwd=""):
+		if version.lower() not in SNMP_VERSIONS:
+			raise SnmpError("Invalid version specified after -v flag: %s" % version)
+		self.host = host
+		self.port = int(port)
+		self.version = SNMP_VERSIONS[version.lower()]
+		self.community = community
+		self.family = family
+		self.usm = None
+		if self.version == 3:
+			self.usm = _Usm(username, sec_level, auth_prot, auth_passwd, priv_prot, priv_passwd)
+		self.request_id = random.getrandbits(30)
+		self.lock = threading.Lock()
+		## UDP socket of every thread, responses are matched by request id
+		self.local = threading.local()
+
+	def _socket(self):
+		if getattr(self.local, "socket", None) is None:
+			try:
+				addresses = socket.getaddrinfo(self.host, self.port, self.family, socket.SOCK_DGRAM)
+			except socket.gaierror:
+				raise SnmpError("Unknown host (%s)" % self.host)
+			(family, socktype, proto, _, address) = addresses[0]
+			sock = socket.socket(family, socktype, proto)
+			sock.connect(address)
+			self.local.socket = sock
+		return self.local.socket
+
+	def close(self):
+		sock = getattr(self.local, "socket", None)
+		if sock is not None:
+			sock.close()
+			self.local.socket = None
+
+	def _next_id(self):
+		with self.lock:
+			self.request_id = (self.request_id + 1) & 0x7fffffff
+			return self.request_id
+
+	##
+	## messages
+	#####
+	def _pdu(self, pdu_type, request_id, varbinds, non_repeaters=0, max_repetitions=0):
+		encoded = [ber_encode(BER_SEQUENCE, [ber_encode(BER_OID, oid), ber_encode(tag, value)]) \
+				for (oid, tag, value) in varbinds]
+		if pdu_type == SNMP_GETBULK:
+			(error_status, error_index) = (non_repeaters, max_repetitions)
+		else:
+			(error_status, error_index) = (0, 0)
+		return ber_encode(pdu_type, [
+				ber_encode(BER_INTEGER, request_id),
+				ber_encode(BER_INTEGER, error_status),
+				ber_encode(BER_INTEGER, error_index),
+				ber_encode(BER_SEQUENCE, encoded)])
+
+	def _encode(self, pdu, request_id, discovery=False):
+		if self.version != 3:
+			return ber_encode(BER_SEQUENCE, [
+					ber_encode(BER_INTEGER, self.version),
+					ber_encode(BER_OCTET_STRING, self.community),
+					pdu])
+
+		usm = self.usm
+		if discovery:
+			(engine_id, boots, engine_time, username, flags) = (b"", 0, 0, b"", 0)
+		else:
+			(engine_id, username, flags) = (usm.engine_id, usm.username, usm.flags())
+			(boots, engine_time) = usm.clock()
+
+		data = ber_encode(BER_SEQUENCE, [
+				ber_encode(BER_OCTET_STRING, engine_id),
+				ber_encode(BER_OCTET_STRING, b""),
+				pdu])
+		priv_params = b""
+		if flags & MSG_FLAG_PRIV:
+			(priv_params, data) = usm.encrypt(data, boots, engine_time)
+			data = ber_encode(BER_OCTET_STRING, data)
+
+		security = [
+				ber_encode(BER_OCTET_STRING, engine_id),
+				ber_encode(BER_INTEGER, boots),
+				ber_encode(BER_INTEGER, engine_time),
+				ber_encode(BER_OCTET_STRING, username)]
+		auth_params = ber_encode(BER_OCTET_STRING, b"\0" * AUTH_PARAMS_LENGTH if flags & MSG_FLAG_AUTH else b"")
+		message = ber_encode(BER_SEQUENCE, [
+				ber_encode(BER_INTEGER, 3),
+				ber_encode(BER_SEQUENCE, [
+					ber_encode(BER_INTEGER, request_id),
+					ber_encode(BER_INTEGER, MAX_MESSAGE_SIZE),
+					ber_encode(BER_OCTET_STRING, bytes([flags | MSG_FLAG_REPORTABLE])),
+					ber_encode(BER_INTEGER, USM_SECURITY_MODEL)]),
+				ber_encode(BER_OCTET_STRING, ber_encode(BER_SEQUENCE,
+					security + [auth_params, ber_encode(BER_OCTET_STRING, priv_params)])),
+				data])
+
+		if flags & MSG_FLAG_AUTH:
+			position = message.find(b"".join(security) + auth_params) + len(b"".join(security)) + 2
+			message = message[:position] + usm.sign(message) + message[position + AUTH_PARAMS_LENGTH:]
+		return message
+
+	def _decode_v3(self, data, message, request_id, discovery=False):
+		""" Return PDU of SNMPv3 message or None when it is not the response to request_id
+
+		Messages with lower security level than the one of the user are dropped
+		(RFC 3414, 3.2), so a spoofed unauthenticated response is never used.
+		Unauthenticated reports are accepted for discovery of the engine only.
+		"""
+		usm = self.usm
+		((_, _), (_, header), (_, security), (data_tag, scoped)) = message
+		((_, msg_id), (_, _), (_, flags), (_, _)) = header
+		if msg_id != request_id:
+			return None
+		flags = flags and flags[0] or 0
+
+		(_, _, pos) = _ber_header(security, 0)
+		fields = []
+		while pos < len(security):
+			start = pos
+			(_, value, pos) = ber_decode(security, pos)
+			fields.append((start, value))
+		((_, engine_id), (_, boots), (_, engine_time), (_, _), (auth_start, auth_params), (_, priv_params)) = fields
+
+		if flags & MSG_FLAG_AUTH:
+			if usm.auth_key is None or len(auth_params) != AUTH_PARAMS_LENGTH:
+				return None
+			position = data.find(security) + _ber_header(security, auth_start)[2]
+			if not hmac.compare_digest(auth_params, usm.sign(data[:position] +
+					b"\0" * AUTH_PARAMS_LENGTH + data[position + AUTH_PARAMS_LENGTH:])):
+				## some agents sign reports of wrong digests with the right key
+				self.local.unverified = USM_WRONG_DIGEST
+				return None
+			usm.discovered(engine_id, boots, engine_time)
+
+		if flags & MSG_FLAG_PRIV:
+			if data_tag != BER_OCTET_STRING or usm.priv_key is None:
+				return None
+			scoped = usm.decrypt(scoped, priv_params, boots, engine_time)
+			(_, scoped, _) = ber_decode(scoped)
+		elif data_tag != BER_SEQUENCE:
+			return None
+
+		required = 0 if discovery else usm.flags()
+		weaker = (flags & (MSG_FLAG_AUTH | MSG_FLAG_PRIV)) & required != required
+
+		((_, _), (_, _), pdu) = scoped
+		if pdu[0] != SNMP_REPORT:
+			if weaker:
+				return None
+		else:
+			oids = [vb[0][1] for (_, vb) in pdu[1][3][1]]
+			if weaker and USM_UNKNOWN_ENGINE_ID not in oids:
+				## e.g. wrong digest or unknown user, reported when no valid response arrives
+				self.local.unverified = oids and oids[0] or USM_WRONG_DIGEST
+				return None
+			if USM_UNKNOWN_ENGINE_ID in oids or (USM_NOT_IN_TIME_WINDOW in oids and flags & MSG_FLAG_AUTH):
+				usm.discovered(engine_id, boots, engine_time)
+		return pdu
+
+	def _request(self, pdu_type, varbinds, timeout, non_repeaters=0, max_repetitions=0, discovery=False):
+		""" Send request until response arrives, return (error status, error index, [(oid, tag, value)]) """
+		sock = self._socket()
+		request_id = self._next_id()
+		message = self._encode(self._pdu(pdu_type, request_id, varbinds, non_repeaters, max_repetitions),
+				request_id, discovery)
+		if len(message) > MAX_MESSAGE_SIZE:
+			raise SnmpError("Error: message too long")
+
+		self.local.unverified = None
+		deadline = time.monotonic() + timeout
+		while True:
+			now = time.monotonic()
+			if now >= deadline:
+				if self.local.unverified:
+					raise SnmpError(USM_REPORTS.get(self.local.unverified,
+							"Error: received report %s" % self.local.unverified))
+				raise SnmpTimeout("Timeout: No Response from %s" % self.host)
+			try:
+				sock.send(message)
+			except OSError as e:
+				raise SnmpError("Error sending request to %s: %s" % (self.host, e))
+			resend = min(deadline, now + RETRY_INTERVAL)
+			while True:
+				wait = resend - time.monotonic()
+				if wait <= 0:
+					break
+				sock.settimeout(wait)
+				try:
+					data = sock.recv(MAX_MESSAGE_SIZE)
+				except socket.timeout:
+					break
+				except ConnectionRefusedError:
+					## ICMP port unreachable, net-snmp also keeps trying until the timeout
+					time.sleep(min(wait, RETRY_INTERVAL))
+					break
+				pdu = self._response(data, request_id, discovery)
+				if pdu is not None:
+					return pdu
+
+	def _response(self, data, request_id, discovery=False):
+		try:
+			(_, message, _) = ber_decode(data)
+			if self.version == 3:
+				pdu = self._decode_v3(data, message, request_id, discovery)
+				if pdu is None:
+					return None
+			else:
+				((_, version), (_, community), pdu) = message
+				if version != self.version:
+					return None
+			(pdu_type, ((_, response_id), (_, error_status), (_, error_index), (_, varbinds))) = pdu
+			varbinds = [(vb[0][1], vb[1][0], vb[1][1]) for (_, vb) in varbinds]
+		except (ValueError, IndexError, TypeError, SnmpError):
+			## not a valid response, e.g. a late answer to a previous request
+			return None
+
+		if pdu_type == SNMP_REPORT:
+			return (-1, 0, varbinds)
+		if pdu_type != SNMP_RESPONSE or (self.version != 3 and response_id != request_id):
+			return None
+		return (error_status, error_index, varbinds)
+
+	def discover(self, timeout):
+		""" SNMPv3 discovery of the authoritative engine ID, boots and time """
+		self._request(SNMP_GET, [], timeout, discovery=True)
+		if self.usm.engine_id is None:
+			raise SnmpError("Error: Failed to discover the authoritative engine ID of %s" % self.host)
+
+	def usm_state(self):
+		""" (engine ID, boots, time) of the authoritative engine, None before discovery """
+		if self.version != 3 or self.usm.engine_id is None:
+			return None
+		(boots, engine_time) = self.usm.clock()
+		return (self.usm.engine_id, boots, engine_time)
+
+	def set_usm_state(self, engine_id, boots, engine_time):
+		""" Use the state of the engine known from a previous run instead of discovery
+
+		A wrong state is corrected by the unknownEngineID or notInTimeWindow
+		report of the agent and the request is sent again.
+		"""
+		self.usm.discovered(engine_id, boots, max(engine_time, 0))
+		self.usm.restored = True
+
+	def _request_synced(self, pdu_type, varbinds, timeout, non_repeaters=0, max_repetitions=0):
+		""" _request() sent again after the engine ID or time was corrected by a report """
+		for _ in range(2):
+			(error_status, error_index, result) = self._request(pdu_type, varbinds, timeout,
+					non_repeaters, max_repetitions)
+			if error_status != -1:
+				return (error_status, error_index, result)
+			report = result and result[0][0] or ""
+			if report not in [USM_NOT_IN_TIME_WINDOW, USM_UNKNOWN_ENGINE_ID]:
+				raise SnmpError(USM_REPORTS.get(report, "Error: received report %s" % report))
+		raise SnmpError(USM_REPORTS[report])
+
+	def request(self, pdu_type, varbinds, timeout, non_repeaters=0, max_repetitions=0):
+		""" Run request, SNMPv3 engine discovery and time synchronization are done when needed """
+		if self.version == 3 and self.usm.engine_id is None:
+			self.discover(timeout)
+
+		if self.version == 3 and self.usm.restored:
+			## not every agent reports an unknown engine ID, so the state from set_usm_state()
+			## is given a short time and the engine is discovered again when it does not work
+			deadline = time.monotonic() + timeout
+			self.usm.restored = False
+			try:
+				(error_status, error_index, result) = self._request_synced(pdu_type, varbinds,
+						min(timeout, 2 * RETRY_INTERVAL), non_repeaters, max_repetitions)
+			except SnmpError:
+				self.usm.engine_id = None
+				self.discover(max(deadline - time.monotonic(), RETRY_INTERVAL))
+				(error_status, error_index, result) = self._request_synced(pdu_type, varbinds,
+						max(deadline - time.monotonic(), RETRY_INTERVAL), non_repeaters, max_repetitions)
+		else:
+			(error_status, error_index, result) = self._request_synced(pdu_type, varbinds, timeout,
+					non_repeaters, max_repetitions)
+
+		if error_status != 0:
+			reason = error_status < len(ERROR_STATUS) and ERROR_STATUS[error_status] or str(error_status)
+			failed = 0 < error_index <= len(varbinds) and varbinds[error_index - 1][0] or ""
+			raise SnmpError("Error in packet.\nReason: (%s)\nFailed object: %s" % (reason, failed),
+					error_status)
+		return result
+
+	##
+	## net-snmp commands
+	#####
+	def get(self, oids, timeout):
+		""" snmpget """
+		return [[oid, format_value(tag, value)] for (oid, tag, value) in \
+				self.request(SNMP_GET, [(oid, BER_NULL, None) for oid in oids], timeout)]
+
+	def set(self, values, timeout):
+		""" snmpset of list of (oid, value), value is INTEGER for int and OCTET STRING for str """
+		varbinds = [(oid, isinstance(value, int) and BER_INTEGER or BER_OCTET_STRING, value) for (oid, value) in values]
+		return [[oid, format_value(tag, value)] for (oid, tag, value) in \
+				self.request(SNMP_SET, varbinds, timeout)]
+
+	def walk(self, oid, timeout, max_repetitions=0):
+		""" snmpwalk, or snmpbulkwalk when max_repetitions is set (SNMPv2c/v3 only)
+
+		The agent is asked for the value of oid itself when subtree is empty.
+		"""
+		if self.version == 0:
+			max_repetitions = 0
+		root = _oid_tuple(oid)
+		current = oid
+		result = []
+		while True:
+			try:
+				if max_repetitions > 0:
+					varbinds = self.request(SNMP_GETBULK, [(current, BER_NULL, None)], timeout, 0, max_repetitions)
+				else:
+					varbinds = self.request(SNMP_GETNEXT, [(current, BER_NULL, None)], timeout)
+			except SnmpError as e:
+				## SNMPv1 agents report the end of MIB as noSuchName
+				if self.version == 0 and len(e.args) > 1 and e.args[1] == 2:
+					break
+				raise
+
+			finished = not varbinds
+			for (name, tag, value) in varbinds:
+				if tag == BER_END_OF_MIB_VIEW or _oid_tuple(name)[:len(root)] != root:
+					finished = True
+					break
+				if _oid_tuple(name) <= _oid_tuple(current):
+					raise SnmpError("Error: OID not increasing: %s\n >= %s" % (current, name))
+				result.append([name, format_value(tag, value)])
+				current = name
+			if finished:
+				break
+
+		if not result:
+			try:
+				result = self.get([oid], timeout)
+			except SnmpTimeout:
+				raise
+			except SnmpError:
+				pass
+		return result
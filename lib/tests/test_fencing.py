@@ -2,9 +2,20 @@
 
 import unittest
 import sys
+import atexit
+import json
 sys.path.append("..")
 import fencing
+import fencing_daemon
+import fencing_snmp_engine
+import fencing_cache
+import fencing_http
 import copy
+import os
+import socket
+import stat
+import tempfile
+import time
 
 class Test_join2(unittest.TestCase):
 	def test_single(self):
@@ -119,5 +130,369 @@ class Test_set_default_values(unittest.TestCase):
 		options = self._prepare_options(["ipaddr", "telnet"])
 		self.assertTrue("--telnet-path" in options)
 
+class Test_multi_plug(unittest.TestCase):
+	def _prepare_options(self, plugs, concurrency=None):
+		options = {"--plugs" : plugs, "--power-wait" : "0"}
+		if concurrency is not None:
+			options["--plug-concurrency"] = concurrency
+		return options
+
+	def test_sequential(self):
+		options = self._prepare_options(["1", "2", "3"])
+		self.assertEqual(fencing._for_each_plug(options, lambda o: o["--plug"]), ["1", "2", "3"])
+		self.assertEqual(options["--plug"], "3")
+
+	def test_parallel(self):
+		options = self._prepare_options(["1", "2", "3"], "3")
+		self.assertEqual(fencing._for_each_plug(options, lambda o: o["--plug"]), ["1", "2", "3"])
+		self.assertNotIn("--plug", options)
+
+	def test_status_any_on(self):
+		status = {"1" : "off", "2" : "on", "3" : "off"}
+		for concurrency in [None, "2"]:
+			options = self._prepare_options(["1", "2", "3"], concurrency)
+			self.assertEqual(fencing.get_multi_power_fn(None, options, lambda c, o: status[o["--plug"]]), "on")
+
+	def test_sync_set_failure(self):
+		options = self._prepare_options(["1", "2"], "2")
+		self.assertFalse(fencing.sync_set_multi_power_fn(None, options, lambda c, o: o["--plug"] == "1", 2))
+		self.assertTrue(fencing.sync_set_multi_power_fn(None, options, lambda c, o: True, 1))
+
+	def test_async_parallel(self):
+		import asyncio
+		running = []
+		async def get_plug(connection, options):
+			running.append(options["--plug"])
+			await asyncio.sleep(0.01)
+			## all plugs are started before the first one finishes
+			return "on" if options["--plug"] == "1" and len(running) == 3 else "off"
+
+		options = self._prepare_options(["1", "2", "3"], "3")
+		self.assertEqual(fencing.run_async(fencing.get_multi_power_async(None, options, get_plug)), "on")
+		self.assertNotIn("--plug", options)
+
+	def test_async_callback(self):
+		options = self._prepare_options(["1", "2"], "2")
+		set_plug = fencing.async_callback(lambda c, o: o["--plug"] == "1")
+		self.assertFalse(fencing.run_async(fencing.sync_set_multi_power_async(None, options, set_plug, 2)))
+		self.assertTrue(fencing.run_async(fencing.sync_set_multi_power_async(None, options,
+				fencing.async_callback(lambda c, o: True), 1)))
+
+class Test_poll_until(unittest.TestCase):
+	def test_success(self):
+		results = iter([None, False, "done"])
+		self.assertEqual(fencing.poll_until(lambda: next(results), 5, interval=0.01), "done")
+
+	def test_timeout(self):
+		calls = []
+		self.assertIsNone(fencing.poll_until(lambda: calls.append(1), 0.1, interval=0.01, max_interval=0.02))
+		self.assertTrue(len(calls) > 1)
+
+	def test_zero_max_interval(self):
+		calls = []
+		self.assertIsNone(fencing.poll_until(lambda: calls.append(1), 0.6, max_interval=0))
+		self.assertTrue(1 < len(calls) < 5)
+
+	def test_single_check(self):
+		calls = []
+		self.assertIsNone(fencing.poll_until(lambda: calls.append(1), 0))
+		self.assertEqual(len(calls), 1)
+
+class Test_timing(unittest.TestCase):
+	def test_phases(self):
+		del fencing._timing["phases"][:]
+		options = self._prepare_options(["1", "2"])
+		self.assertFalse(fencing.sync_set_multi_power_fn(None, options, lambda c, o: o["--plug"] == "2", 2))
+		phases = [(p["phase"], p.get("plug"), p.get("attempt")) for p in fencing._timing["phases"]]
+		self.assertEqual(phases, [("set", "1", 0), ("set", "1", 1), ("power_wait", "1", None),
+				("set", "2", 0), ("power_wait", "2", None)])
+		self.assertEqual(fencing._timing["phases"][0]["action"], "off")
+
+	def test_timing_file_once(self):
+		with tempfile.NamedTemporaryFile("r") as timing_file:
+			callbacks = atexit._ncallbacks()
+			try:
+				for action in ["status", "off"]:
+					fencing._register_timing({"--timing-file": timing_file.name, "--action": action})
+				self.assertEqual(atexit._ncallbacks(), callbacks + 1)
+				fencing._write_timing()
+			finally:
+				atexit.unregister(fencing._write_timing)
+				fencing._timing["options"] = None
+			records = [json.loads(line) for line in timing_file]
+		self.assertEqual([r["action"] for r in records], ["off"])
+
+	def _prepare_options(self, plugs):
+		return {"--plugs": plugs, "--action": "off", "--power-wait": "0"}
+
+class Test_run_commands(unittest.TestCase):
+	def test_status(self):
+		self.assertEqual(fencing.run_commands({}, ["false", "true"])[0], 0)
+		self.assertEqual(fencing.run_commands({}, ["sh -c 'exit 3'"])[0], 3)
+
+	def test_large_output(self):
+		(status, out, err) = fencing.run_commands({"--power-timeout": "10"},
+				["sh -c 'yes fence | head -n 100000; echo done >&2'"])
+		self.assertEqual(status, 0)
+		self.assertEqual(len(out), 600000)
+		self.assertEqual(err, "done\n")
+
+	def test_quorum_policy(self):
+		start = time.time()
+		options = {"--quorum-policy": "first"}
+		self.assertEqual(fencing.run_commands(options, ["sleep 10", "true"])[0], 0)
+		options = {"--quorum-policy": "majority", "--quorum-delay": "0"}
+		self.assertEqual(fencing.run_commands(options, ["sleep 10", "true", "true"])[0], 0)
+		self.assertTrue(time.time() - start < 5)
+
+	def test_quorum_policy_status(self):
+		commands = ["true", "sh -c 'sleep 0.2; exit 3'", "sh -c 'sleep 0.4; exit 4'"]
+		for (policy, status) in [("first", 0), ("majority", 0), ("all", 3)]:
+			options = {"--quorum-policy": policy, "--quorum-delay": "0"}
+			self.assertEqual(fencing.run_commands(options, commands)[0], status)
+
+		options = {"--quorum-policy": "all", "--power-timeout": "1", "retry": "1"}
+		self.assertEqual(fencing.run_commands(options, ["true", "sleep 10"])[0], fencing.EC_TIMED_OUT)
+
+class Test_requested_action(unittest.TestCase):
+	def setUp(self):
+		self.argv = sys.argv
+		self.stdin = fencing._read_stdin.lines
+
+	def tearDown(self):
+		sys.argv = self.argv
+		fencing._read_stdin.lines = self.stdin
+
+	def test_cmdline(self):
+		for args in [["-o", "metadata"], ["-ometadata"], ["--action", "metadata"], ["-n", "1", "--action=metadata"]]:
+			sys.argv = ["fence_dummy"] + args
+			self.assertEqual(fencing._requested_action(), "metadata")
+		sys.argv = ["fence_dummy", "-n", "metadata"]
+		self.assertIsNone(fencing._requested_action())
+
+	def test_stdin(self):
+		sys.argv = ["fence_dummy"]
+		fencing._read_stdin.lines = ["# comment\n", "port=metadata\n", "action=\"metadata\"\n"]
+		self.assertEqual(fencing._requested_action(), "metadata")
+		fencing._read_stdin.lines = ["action=status\n"]
+		self.assertEqual(fencing._requested_action(), "status")
+
+	def test_no_stdin_options(self):
+		sys.argv = ["fence_dummy_check"]
+		fencing._read_stdin.lines = ["action=metadata\n"]
+		sys.modules["__main__"].STDIN_OPTIONS = False
+		try:
+			self.assertIsNone(fencing._requested_action())
+		finally:
+			del sys.modules["__main__"].STDIN_OPTIONS
+
+class Test_lazy_import(unittest.TestCase):
+	def test_transports_not_loaded(self):
+		import subprocess
+		## fresh interpreter, other tests may have used pexpect already
+		script = "import sys, importlib.util, fencing\n" \
+			"lazy = lambda: [isinstance(sys.modules[m], importlib.util._LazyModule) for m in ['pexpect', 'pycurl']]\n" \
+			"print(lazy())\n" \
+			"fencing.pexpect.spawn\n" \
+			"print(lazy())\n"
+		env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(fencing.__file__)))
+		output = subprocess.check_output([sys.executable, "-c", script], env=env)
+		self.assertEqual(output.decode().split("\n")[:2], ["[True, True]", "[False, True]"])
+
+	def test_missing_module(self):
+		self.assertRaises(ImportError, fencing.lazy_import, "fencing_no_such_module")
+
+class Test_snmp_engine(unittest.TestCase):
+	def test_password_to_key(self):
+		## RFC 3414, A.3
+		engine_id = bytes.fromhex("000000000000000000000002")
+		self.assertEqual(fencing_snmp_engine.password_to_key("maplesyrup", engine_id, "md5").hex(),
+				"526f5eed9fcce26f8964c2930787d82b")
+		self.assertEqual(fencing_snmp_engine.password_to_key("maplesyrup", engine_id, "sha1").hex(),
+				"6695febc9288e36282235fc7151f128497b38f3f")
+
+	def test_net_snmp_format(self):
+		for (tag, value, output) in [
+				(fencing_snmp_engine.BER_INTEGER, -2, "-2"),
+				(fencing_snmp_engine.BER_OCTET_STRING, b'Outlet "1"', '"Outlet \\"1\\""'),
+				(fencing_snmp_engine.BER_OCTET_STRING, b"\x00\x1a", "00 1A "),
+				(fencing_snmp_engine.BER_OID, ".1.3.6.1.4.1.318", ".1.3.6.1.4.1.318"),
+				(fencing_snmp_engine.BER_TIMETICKS, 9000123, "1:1:00:01.23"),
+				(fencing_snmp_engine.BER_NO_SUCH_INSTANCE, b"", "No Such Instance currently exists at this OID")]:
+			encoded = fencing_snmp_engine.ber_encode(tag, value)
+			(_, decoded, end) = fencing_snmp_engine.ber_decode(encoded)
+			self.assertEqual(end, len(encoded))
+			self.assertEqual(fencing_snmp_engine.format_value(tag, decoded), output)
+
+	def test_usm_state(self):
+		engine = fencing_snmp_engine.SnmpEngine("localhost", version="3", username="fence")
+		self.assertEqual(engine.usm_state(), None)
+		engine.set_usm_state(bytes.fromhex("80001f8880"), 3, 1000)
+		(engine_id, boots, engine_time) = engine.usm_state()
+		self.assertEqual((engine_id.hex(), boots), ("80001f8880", 3))
+		self.assertTrue(1000 <= engine_time <= 1001)
+
+	def test_unauthenticated_response(self):
+		engine_id = bytes.fromhex("80001f8880")
+		device = fencing_snmp_engine.SnmpEngine("localhost", version="3", username="fence")
+		device.set_usm_state(engine_id, 3, 1000)
+		response = device._encode(device._pdu(fencing_snmp_engine.SNMP_RESPONSE, 42,
+				[(".1.3.6.1.4.1.318.1.1.4.4.2.1.3.1", fencing_snmp_engine.BER_INTEGER, 2)]), 42)
+
+		for (sec_level, valid) in [("noAuthNoPriv", True), ("authNoPriv", False), ("authPriv", False)]:
+			engine = fencing_snmp_engine.SnmpEngine("localhost", version="3", username="fence",
+					sec_level=sec_level, auth_passwd="fencepass", priv_passwd="fencepass")
+			engine.set_usm_state(engine_id, 3, 1000)
+			engine.local.unverified = None
+			self.assertEqual(engine._response(response, 42) is not None, valid)
+
+class Test_cache(unittest.TestCase):
+	def setUp(self):
+		self.tmpdir = tempfile.TemporaryDirectory()
+		fencing_cache.CACHE_DIR = os.path.join(self.tmpdir.name, "cache")
+		self.options = {"--ip": "pdu1", "--community": "private", "--cache-ttl": "60"}
+
+	def tearDown(self):
+		self.tmpdir.cleanup()
+
+	def test_get_set(self):
+		cache = fencing_cache.FencingCache(self.options, "fence_test")
+		self.assertEqual(cache.get("port:node1"), None)
+		cache.set("port:node1", [".1.3.6.1.4.1.318.1.1.4.4.2.1.4.3", [None, 3]])
+		cache.set("sysObjectID", ".1.3.6.1.4.1.318.1.3.4.5")
+
+		cache = fencing_cache.FencingCache(self.options, "fence_test")
+		self.assertEqual(cache.get("port:node1")[1], [None, 3])
+		self.assertEqual(stat.S_IMODE(os.stat(cache.path).st_mode), 0o600)
+		self.assertEqual(stat.S_IMODE(os.stat(fencing_cache.CACHE_DIR).st_mode), 0o700)
+
+		cache.invalidate("port:node1")
+		self.assertEqual(cache.get("port:node1"), None)
+		self.assertEqual(cache.get("sysObjectID"), ".1.3.6.1.4.1.318.1.3.4.5")
+		cache.invalidate()
+		self.assertEqual(cache.get("sysObjectID"), None)
+
+	def test_key(self):
+		fencing_cache.FencingCache(self.options, "fence_test").set("sysObjectID", "1")
+		self.assertEqual(fencing_cache.FencingCache(dict(self.options, **{"--community": "public"}),
+				"fence_test").get("sysObjectID"), None)
+		self.assertEqual(fencing_cache.FencingCache(self.options, "fence_test2").get("sysObjectID"), None)
+
+	def test_ttl(self):
+		cache = fencing_cache.FencingCache(self.options, "fence_test")
+		cache.set("sysObjectID", "1")
+		cache.ttl = -1
+		cache.set("port:node1", 3)
+		self.assertEqual(cache.get("port:node1"), None)
+		self.assertEqual(cache.get("sysObjectID"), "1")
+
+		cache = fencing_cache.FencingCache(dict(self.options, **{"--cache-ttl": "0"}), "fence_test")
+		self.assertEqual(cache.get("sysObjectID"), None)
+
+	def test_credentials(self):
+		logins = []
+		def login():
+			logins.append(len(logins))
+			return ("token%d" % len(logins), 3600)
+
+		def request(token):
+			if token == "token1":
+				raise fencing_cache.LoginExpired()
+			return token
+
+		self.assertEqual(fencing_cache.CredentialCache(self.options, "fence_test", login).get_credentials(), "token1")
+		credentials = fencing_cache.CredentialCache(self.options, "fence_test", login)
+		self.assertEqual(credentials.request(request), "token2")
+		self.assertEqual(len(logins), 2)
+		self.assertEqual(fencing_cache.CredentialCache(self.options, "fence_test", login).request(request), "token2")
+		self.assertEqual(len(logins), 2)
+
+		## login expiring sooner than EXPIRY_MARGIN is not cached
+		credentials = fencing_cache.CredentialCache(self.options, "fence_test2", lambda: ("token", 30))
+		credentials.get_credentials()
+		self.assertEqual(credentials.get("credentials"), None)
+
+class Test_ssh_persist(unittest.TestCase):
+	def setUp(self):
+		self.tmpdir = tempfile.TemporaryDirectory()
+		fencing.SSH_CONTROL_DIR = os.path.join(self.tmpdir.name, "ssh")
+		self.options = {"--ssh": "", "--ip": "pdu1", "--ipport": "22", "--username": "apc",
+				"--password": "apc", "--ssh-path": "/bin/true", "--login-timeout": "5", "--ssh-persist": "60"}
+
+	def tearDown(self):
+		self.tmpdir.cleanup()
+
+	def test_control_options(self):
+		self.assertEqual(fencing._ssh_control_options(dict(self.options, **{"--ssh-persist": "0"})), "")
+
+		control = fencing._ssh_control_options(self.options)
+		self.assertIn("ControlMaster=auto", control)
+		self.assertIn("ControlPersist=60", control)
+		self.assertEqual(stat.S_IMODE(os.stat(fencing.SSH_CONTROL_DIR).st_mode), 0o700)
+		self.assertNotEqual(fencing._ssh_control_path(self.options),
+				fencing._ssh_control_path(dict(self.options, **{"--password": "other"})))
+
+	def test_stop_master(self):
+		self.assertFalse(fencing._ssh_stop_master(self.options))
+
+		path = fencing._ssh_control_path(self.options)
+		open(path, "w").close()
+		self.assertTrue(fencing._ssh_stop_master(self.options))
+		self.assertFalse(os.path.exists(path))
+
+class Test_telnet(unittest.TestCase):
+	def test_negotiation(self):
+		import threading
+		server = socket.socket()
+		server.bind(("127.0.0.1", 0))
+		server.listen(1)
+		received = []
+
+		def device():
+			(conn, _) = server.accept()
+			## WILL ECHO, DO TERMINAL-TYPE (twice), login prompt with escaped IAC
+			conn.sendall(b"\xff\xfb\x01\xff\xfd\x18\xff\xfd\x18Login\xff\xff: ")
+			data = b""
+			while not data.endswith(b"\r\n"):
+				data += conn.recv(100)
+			received.append(data)
+			conn.close()
+
+		thread = threading.Thread(target=device)
+		thread.start()
+		options = {"--ip": "127.0.0.1", "--ipport": str(server.getsockname()[1]),
+				"--login-timeout": "5", "--telnet-engine": "native", "eol": "\r\n"}
+		conn = fencing.ftelnet(options, encoding="latin1")
+		self.assertEqual(conn.log_expect("Login\xff: ", 5), 0)
+		conn.send_eol("admin\r")
+		thread.join()
+		self.assertRaises(fencing.pexpect.EOF, conn.read_nonblocking, 100, 5)
+		conn.close()
+		server.close()
+		self.assertEqual(received, [b"\xff\xfd\x01\xff\xfc\x18admin\r\x00\r\n"])
+
+class Test_http(unittest.TestCase):
+	def test_response(self):
+		response = fencing_http.HttpResponse(200, [("content-type", "application/json"),
+				("set-cookie", "PVEAuthCookie=PVE:root; path=/; secure"), ("set-cookie", "a=b=c")],
+				b'{"data": 1}')
+		self.assertEqual(response.headers["content-type"], "application/json")
+		self.assertEqual(response.cookies, {"PVEAuthCookie": "PVE:root", "a": "b=c"})
+		self.assertEqual(response.json(), {"data": 1})
+
+class Test_daemon_protocol(unittest.TestCase):
+	def test_message_with_fds(self):
+		(client, server) = socket.socketpair()
+		(rfd, wfd) = os.pipe()
+		fencing_daemon._send_message(client, {"argv": ["fence_dummy", "-o", "status"]}, [rfd, wfd, wfd])
+		(message, fds) = fencing_daemon._recv_message(server, 3)
+		self.assertEqual(message, {"argv": ["fence_dummy", "-o", "status"]})
+		self.assertEqual(len(fds), 3)
+		for fd in fds + [rfd, wfd]:
+			os.close(fd)
+		client.close()
+		self.assertEqual(fencing_daemon._recv_message(server), (None, []))
+		server.close()
+
 if __name__ == '__main__':
 	unittest.main()
@@ -3,10 +3,11 @@ AWK_VAL='BEGIN {store=-1} /name=".*_path"/ || /name=".*_file"/ {store=2} {if (st
 
 TEST_TARGET=$(filter-out $(TEST_TARGET_SKIP),$(TARGET))
 
-check: $(TEST_TARGET:%=%.xml-check) $(SYMTARGET:%=%.xml-check) $(TEST_TARGET:%=%.delay-check) $(TEST_TARGET:%=%.rng-check) test-fencing
+check: $(TEST_TARGET:%=%.xml-check) $(SYMTARGET:%=%.xml-check) $(TEST_TARGET:%=%.delay-check) $(TEST_TARGET:%=%.rng-check) $(TEST_TARGET:%=%.import-check) test-fencing
 delay-check: $(TEST_TARGET:%=%.delay-check) $(SYMTARGET:%=%.delay-check)
 xml-check: $(TEST_TARGET:%=%.xml-check) $(SYMTARGET:%=%.xml-check)
 xml-upload: $(TEST_TARGET:%=%.xml-upload) $(SYMTARGET:%=%.xml-upload)
+import-check: $(TEST_TARGET:%=%.import-check)
 
 %.xml-check: %.8
 	$(eval INPUT=$(subst .xml-check,,$(@F)))
@@ -23,6 +24,11 @@ xml-upload: $(TEST_TARGET:%=%.xml-upload) $(SYMTARGET:%=%.xml-upload)
 		PYTHONPATH=$(abs_top_srcdir)/lib:$(abs_top_builddir)/lib $(PYTHON) $(@D)/$$x -o metadata | $(AWK) $(AWK_VAL) > $(DATADIR)/$$x.xml; \
 	done
 
+# Metadata must not load transport modules or SDKs
+%.import-check: %.8
+	$(eval INPUT=$(subst .import-check,,$(@F)))
+	PYTHONPATH=$(abs_top_srcdir)/lib:$(abs_top_builddir)/lib $(PYTHON) $(abs_top_srcdir)/lib/check_imports.py $(@D)/$(INPUT)
+
 # If test will fail, rerun fence agents to show problems
 %.delay-check: %
 	$(eval INPUT=$(subst .delay-check,,$(@F)))
@@ -27,6 +27,7 @@ define gen_agent_from_py
 		-e 's#@''STORE_PATH@#${CLUSTERVARRUN}#g' \
 		-e 's#@''SUDO_PATH@#${SUDO_PATH}#g' \
 		-e 's#@''SNMPWALK_PATH@#${SNMPWALK_PATH}#g' \
+		-e 's#@''SNMPBULKWALK_PATH@#${SNMPBULKWALK_PATH}#g' \
 		-e 's#@''SNMPSET_PATH@#${SNMPSET_PATH}#g' \
 		-e 's#@''SNMPGET_PATH@#${SNMPGET_PATH}#g' \
 		-e 's#@''NOVA_PATH@#${NOVA_PATH}#g' \
@@ -54,7 +55,7 @@ $(TARGET): $(abs_top_builddir)/config.status
 	$(call gen_agent_from_py)
 
 clean-local: clean-man
-	rm -f $(CLEAN_TARGET:%.8=%) $(CLEAN_TARGET_ADDITIONAL) $(mpathdata_SCRIPTS) $(scsidata_SCRIPTS) */*.pyc *.pyc */*.wiki
+	rm -f $(CLEAN_TARGET:%.8=%) $(CLEAN_TARGET_ADDITIONAL) $(mpathdata_SCRIPTS) $(scsidata_SCRIPTS) */*.pyc *.pyc */*.wiki */*.metadata
 
 	if [ "$(abs_builddir)" = "$(abs_top_builddir)/lib" ]; then \
 		rm -rf $(TARGET) __pycache__; \
@@ -74,6 +75,16 @@ install-exec-hook: $(TARGET)
 			$(INSTALL_DATA) "$$dir/$$x.8" "$(DESTDIR)$(man8dir)" || exit $$?; \
 		done; \
 	done
+	for p in $(TARGET); do \
+		dir=`dirname $$p`; \
+		for x in `basename $$p` `PYTHONPATH=$(abs_top_srcdir)/lib:$(abs_top_builddir)/lib $(PYTHON) $$p -o metadata | grep symlink | sed -e "s/.*\(fence.*\)\" .*/\1/g"`; do \
+			if [ -f "$$dir/$$x.metadata" ]; then \
+				$(MKDIR_P) "$(DESTDIR)$(FENCEAGENTSLIBDIR)/metadata" || exit 1; \
+				echo " $(INSTALL_DATA) '$$dir/$$x.metadata' '$(DESTDIR)$(FENCEAGENTSLIBDIR)/metadata/$$x-$(VERSION).xml'"; \
+				$(INSTALL_DATA) "$$dir/$$x.metadata" "$(DESTDIR)$(FENCEAGENTSLIBDIR)/metadata/$$x-$(VERSION).xml" || exit $$?; \
+			fi; \
+		done; \
+	done
 
 uninstall-hook: $(TARGET)
 	files=`for p in $(TARGET); do \
@@ -83,4 +94,8 @@ uninstall-hook: $(TARGET)
 			echo " rm -f '$(DESTDIR)$(man8dir)/$$x.8'"; \
 			rm -f "$(DESTDIR)$(man8dir)/$$x.8"; \
 		done; \
+		for x in \`basename $$p\` \`PYTHONPATH=$(abs_top_srcdir)/lib:$(abs_top_builddir)/lib $(PYTHON) $$p -o metadata | grep symlink | sed -e "s/.*\(fence.*\)\" .*/\1/g"\`; do \
+			echo " rm -f '$(DESTDIR)$(FENCEAGENTSLIBDIR)/metadata/$$x-$(VERSION).xml'"; \
+			rm -f "$(DESTDIR)$(FENCEAGENTSLIBDIR)/metadata/$$x-$(VERSION).xml"; \
+		done; \
 	done`
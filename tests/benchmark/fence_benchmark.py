@@ -0,0 +1,219 @@
+#!/usr/bin/python
+
+""" End-to-end latency benchmark of fence agents against local device simulators
+
+Every scenario starts a simulator from simulators.py and runs the built agent
+(e.g. agents/wti/fence_wti) for the actions off, on, reboot, status, list and
+monitor. Each action is measured as the wall clock time of the whole agent
+process, so startup, login and logout are included. Results are reported as
+p50/p99 per agent and action:
+
+	$ make
+	$ tests/benchmark/fence_benchmark.py -n 20 --latency 0.01 --latency set=0.2
+"""
+
+import sys, os, abc, time, json, shutil, tempfile, subprocess, argparse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import simulators
+
+TOP_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+ACTIONS = ["off", "on", "reboot", "status", "list", "monitor"]
+
+CLIENT = "%s %s client" % (sys.executable, os.path.abspath(simulators.__file__))
+
+class Scenario(abc.ABC):
+	""" Simulator and agent command line for one agent """
+	def __init__(self, name, agent, requires=None, actions=None):
+		self.name = name
+		self.agent = agent
+		self.requires = requires or []
+		self.actions = actions or ACTIONS
+		self.simulator = None
+
+	def missing(self):
+		""" Return name of tool which is not available or None """
+		for tool in self.requires:
+			if shutil.which(tool) is None:
+				return tool
+		return None
+
+	@abc.abstractmethod
+	def start(self, latency, workdir):
+		""" Start the simulator """
+
+	@abc.abstractmethod
+	def arguments(self):
+		""" Return command line of the agent for the running simulator """
+
+	def stop(self):
+		if self.simulator:
+			self.simulator.stop()
+			self.simulator = None
+
+class PDUScenario(Scenario):
+	def __init__(self, name, ssh=False, telnet_engine="native"):
+		Scenario.__init__(self, name, "wti/fence_wti")
+		self.ssh = ssh
+		self.telnet_engine = telnet_engine
+
+	def start(self, latency, workdir):
+		self.simulator = simulators.PDUSimulator(latency=latency).start()
+
+	def arguments(self):
+		args = ["--ip=127.0.0.1", "--ipport=%d" % self.simulator.port, "--password=secret", "--plug=1"]
+		if self.ssh:
+			return args + ["--ssh", "--username=admin", "--ssh-path=%s" % CLIENT]
+		return args + ["--telnet-engine=%s" % self.telnet_engine, "--telnet-path=%s" % CLIENT]
+
+class SNMPScenario(Scenario):
+	def __init__(self, name, agent, profile, actions=None):
+		Scenario.__init__(self, name, agent, actions=actions)
+		self.profile = profile
+
+	def start(self, latency, workdir):
+		self.simulator = simulators.SNMPSimulator(self.profile, latency=latency).start()
+
+	def arguments(self):
+		return ["--ip=127.0.0.1", "--ipport=%d" % self.simulator.port, "--snmp-version=2c",
+				"--community=private", "--plug=1"]
+
+class HTTPScenario(Scenario):
+	def __init__(self, name, agent, simulator, arguments, ssl=True):
+		Scenario.__init__(self, name, agent, ssl and ["openssl"] or [])
+		self.simulator_class = simulator
+		self.extra = arguments
+		self.ssl = ssl
+
+	def start(self, latency, workdir):
+		certificate = None
+		if self.ssl:
+			certificate = os.path.join(workdir, "simulator.pem")
+			if not os.path.exists(certificate):
+				simulators.self_signed_certificate(workdir)
+		self.simulator = self.simulator_class(latency=latency, certificate=certificate).start()
+
+	def arguments(self):
+		return ["--ip=127.0.0.1", "--ipport=%d" % self.simulator.port] + self.extra
+
+SCENARIOS = [
+	PDUScenario("wti-telnet"),
+	PDUScenario("wti-telnet-binary", telnet_engine="telnet"),
+	PDUScenario("wti-ssh", ssh=True),
+	SNMPScenario("apc_snmp", "apc_snmp/fence_apc_snmp", "apc"),
+	## fabric fencing agents have no reboot
+	SNMPScenario("ifmib", "ifmib/fence_ifmib", "ifmib", [a for a in ACTIONS if a != "reboot"]),
+	HTTPScenario("redfish", "redfish/fence_redfish", simulators.RedfishSimulator,
+			["--username=admin", "--password=secret", "--ssl-insecure"]),
+	HTTPScenario("pve", "pve/fence_pve", simulators.PVESimulator,
+			["--username=root@pam", "--password=secret", "--ssl-insecure", "--plug=101", "--pve-node-auto"]),
+	HTTPScenario("docker", "docker/fence_docker", simulators.DockerSimulator,
+			["--disable-ssl", "--plug=c1"], ssl=False),
+]
+
+def percentile(values, percent):
+	""" Nearest-rank percentile of a non-empty list """
+	ordered = sorted(values)
+	rank = max(1, -(-len(ordered) * percent // 100))
+	return ordered[int(rank) - 1]
+
+def run_agent(command, lib_dir, timeout):
+	env = dict(os.environ)
+	env["PYTHONPATH"] = lib_dir + (os.pathsep + env["PYTHONPATH"] if env.get("PYTHONPATH") else "")
+	start = time.monotonic()
+	try:
+		process = subprocess.run(command, env=env, stdin=subprocess.DEVNULL,
+				stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout)
+		returncode = process.returncode
+		output = process.stderr.decode(errors="replace")
+	except subprocess.TimeoutExpired:
+		(returncode, output) = (None, "timed out after %ds" % timeout)
+	return (time.monotonic() - start, returncode, output)
+
+def benchmark(scenario, options, latency, workdir):
+	""" Return {action: {"runs": [seconds], "errors": count}} """
+	results = dict([(action, {"runs": [], "errors": 0}) for action in scenario.actions])
+	agent = os.path.join(options.agents_dir, scenario.agent)
+
+	scenario.start(latency, workdir)
+	try:
+		for _ in range(options.count):
+			for action in scenario.actions:
+				command = [sys.executable, agent, "--action=%s" % action] + scenario.arguments()
+				(duration, returncode, output) = run_agent(command, options.lib_dir, options.timeout)
+				## status returns 2 when the plug is off, which is a valid answer
+				if returncode == 0 or (action == "status" and returncode == 2):
+					results[action]["runs"].append(duration)
+				else:
+					results[action]["errors"] += 1
+					if options.verbose:
+						sys.stderr.write("%s %s failed (%s): %s\n" % (scenario.name, action, returncode, output.strip()))
+	finally:
+		scenario.stop()
+
+	return results
+
+def parse_latency(values):
+	latency = {}
+	for value in values:
+		(command, _, seconds) = value.rpartition("=")
+		latency[command or "default"] = float(seconds)
+	return latency
+
+def main():
+	parser = argparse.ArgumentParser(description="Measure fence agent latency against local device simulators")
+	parser.add_argument("scenarios", nargs="*", metavar="SCENARIO",
+			help="Scenarios to run: %s (default: all)" % ", ".join([s.name for s in SCENARIOS]))
+	parser.add_argument("-n", "--count", type=int, default=10, help="Runs of every action (default: %(default)s)")
+	parser.add_argument("-l", "--latency", action="append", default=[], metavar="[COMMAND=]SECONDS",
+			help="Simulated device latency, per command if COMMAND is given, can be repeated")
+	parser.add_argument("--agents-dir", default=os.path.join(TOP_DIR, "agents"), help="Directory with built agents")
+	parser.add_argument("--lib-dir", default=os.path.join(TOP_DIR, "lib"), help="Directory with built fencing library")
+	parser.add_argument("--timeout", type=int, default=60, help="Timeout of one agent run in seconds")
+	parser.add_argument("--json", action="store_true", help="Print results as JSON")
+	parser.add_argument("-v", "--verbose", action="store_true", help="Print errors of failed runs")
+	options = parser.parse_args()
+
+	selected = [s for s in SCENARIOS if not options.scenarios or s.name in options.scenarios]
+	unknown = set(options.scenarios) - set([s.name for s in SCENARIOS])
+	if unknown:
+		parser.error("unknown scenario: %s" % ", ".join(sorted(unknown)))
+
+	latency = parse_latency(options.latency)
+	report = {}
+	workdir = tempfile.mkdtemp(prefix="fence-benchmark-")
+	try:
+		for scenario in selected:
+			missing = scenario.missing()
+			if missing:
+				sys.stderr.write("Skipping %s: %s not found\n" % (scenario.name, missing))
+				continue
+			if not os.path.exists(os.path.join(options.agents_dir, scenario.agent)):
+				sys.stderr.write("Skipping %s: %s is not built\n" % (scenario.name, scenario.agent))
+				continue
+			report[scenario.name] = {}
+			for (action, result) in benchmark(scenario, options, latency, workdir).items():
+				runs = result["runs"]
+				report[scenario.name][action] = {
+					"runs": len(runs),
+					"errors": result["errors"],
+					"p50": runs and round(percentile(runs, 50) * 1000, 1) or None,
+					"p99": runs and round(percentile(runs, 99) * 1000, 1) or None}
+	finally:
+		shutil.rmtree(workdir)
+
+	if options.json:
+		print(json.dumps(report, indent=2, sort_keys=True))
+	else:
+		print("%-12s %-8s %6s %6s %10s %10s" % ("agent", "action", "runs", "errors", "p50 [ms]", "p99 [ms]"))
+		for (name, actions) in report.items():
+			for action in [a for a in ACTIONS if a in actions]:
+				result = actions[action]
+				print("%-12s %-8s %6d %6d %10s %10s" % (name, action, result["runs"], result["errors"],
+						result["p50"] if result["p50"] is not None else "-",
+						result["p99"] if result["p99"] is not None else "-"))
+
+	return 1 if any([r["errors"] for a in report.values() for r in a.values()]) else 0
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,505 @@
+#!/usr/bin/python
+
+""" Local fence device simulators for benchmarking fence agents
+
+Every simulator listens on localhost, keeps the power state of its outlets in
+memory and sleeps before answering a command. The latency is a dictionary which
+maps the name of a command to seconds, "default" is used for all other
+commands:
+
+	PDUSimulator		login, status, set, logout (telnet/SSH menu like WTI)
+	SNMPSimulator		get, getnext, getbulk, set (SNMP v1/v2c agent)
+	RedfishSimulator	GET, POST
+	PVESimulator		login, GET, POST
+	DockerSimulator		GET, POST
+
+Agents which run external telnet/ssh binaries can use this module as a client:
+"python simulators.py client" speaks to PDUSimulator both as telnet (reads
+"open <host> -<port>" on stdin) and as ssh ("<user>@<host> -p <port>").
+"""
+
+import sys, os, re, time, json, socket, select, ssl, struct, threading, tempfile, subprocess
+import socketserver
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class Outlets(object):
+	""" Power state of simulated outlets (1..count) """
+	def __init__(self, count=8, state=True):
+		self.lock = threading.Lock()
+		self.names = dict([(i, "node%d" % (i)) for i in range(1, count + 1)])
+		self.power = dict([(i, state) for i in range(1, count + 1)])
+
+	def set(self, outlet, state):
+		with self.lock:
+			if outlet not in self.power:
+				return False
+			self.power[outlet] = state
+			return True
+
+	def get(self, outlet):
+		with self.lock:
+			return self.power.get(outlet)
+
+class Simulator(object):
+	""" Common part of simulators: latency, outlets and a server thread """
+	def __init__(self, latency=None, outlets=None):
+		self.latency = latency or {}
+		self.outlets = outlets or Outlets()
+		self.server = None
+		self.thread = None
+
+	def wait(self, command):
+		delay = self.latency.get(command, self.latency.get("default", 0))
+		if delay:
+			time.sleep(delay)
+
+	@property
+	def port(self):
+		return self.server.server_address[1]
+
+	def start(self):
+		self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+		self.thread.start()
+		return self
+
+	def stop(self):
+		self.server.shutdown()
+		self.server.server_close()
+
+	def __enter__(self):
+		return self.start()
+
+	def __exit__(self, *args):
+		self.stop()
+
+##
+## Menu driven PDU (telnet/SSH)
+#####
+IAC = 255
+
+class PDUSimulator(Simulator):
+	""" PDU with WTI like command line: /S, /SG, /on <plug>,y, /off <plug>,y, /X """
+	PROMPT = "IPS> "
+
+	def __init__(self, password="secret", latency=None, outlets=None):
+		Simulator.__init__(self, latency, outlets)
+		self.password = password
+		simulator = self
+
+		class Handler(socketserver.StreamRequestHandler):
+			def handle(self):
+				simulator.session(self.rfile, self.wfile)
+
+		socketserver.ThreadingTCPServer.allow_reuse_address = True
+		self.server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+		self.server.daemon_threads = True
+
+	def session(self, rfile, wfile):
+		def write(text):
+			wfile.write(text.encode())
+			wfile.flush()
+
+		def read_line():
+			line = rfile.readline()
+			if not line:
+				raise EOFError()
+			## drop telnet negotiation, clients in binary mode might send it
+			while IAC in line:
+				i = line.index(IAC)
+				line = line[:i] + line[i + 3:]
+			return line.decode(errors="replace").strip()
+
+		try:
+			write("\r\nPassword: ")
+			if read_line() != self.password:
+				write("\r\nInvalid password\r\n")
+				return
+			self.wait("login")
+			write("\r\n" + self.PROMPT)
+
+			while True:
+				command = read_line()
+				if command.upper() == "/X":
+					self.wait("logout")
+					write("\r\nDisconnected\r\n")
+					return
+				elif command.upper() == "/S":
+					self.wait("status")
+					write(self.listing())
+				elif command.upper() == "/SG":
+					self.wait("status")
+				elif re.match(r"^/(on|off) \d+,y$", command, re.IGNORECASE):
+					self.wait("set")
+					(action, plug) = command[1:-2].split(" ")
+					if not self.outlets.set(int(plug), action.lower() == "on"):
+						write("\r\nInvalid plug\r\n")
+				elif command != "":
+					self.wait("default")
+					write("\r\nInvalid command\r\n")
+				write("\r\n" + self.PROMPT)
+		except (EOFError, OSError):
+			pass
+
+	def listing(self):
+		lines = ["", "Plug | Name             | Status | Boot/Seq. Delay | Default |",
+				"-----+------------------+--------+-----------------+---------+"]
+		for plug in sorted(self.outlets.names):
+			lines.append(" %-3d | %-16s |  %-4s  |     0.5 Secs    |   ON    |" % \
+					(plug, self.outlets.names[plug], self.outlets.get(plug) and "ON" or "OFF"))
+		return "\r\n".join(lines) + "\r\n"
+
+def pdu_client(args):
+	""" Minimal telnet/ssh client connecting stdin/stdout to PDUSimulator """
+	(host, port) = (None, None)
+	for (i, arg) in enumerate(args):
+		if arg == "-p" and i + 1 < len(args):
+			port = int(args[i + 1])
+		elif "@" in arg:
+			host = arg.split("@", 1)[1]
+
+	if host is None:
+		## telnet: wait for "open <host> -<port>"
+		for line in iter(sys.stdin.readline, ""):
+			match = re.match(r"^open (\S+) -?(\d+)", line.strip())
+			if match:
+				(host, port) = (match.group(1), int(match.group(2)))
+				break
+		else:
+			return 1
+
+	sock = socket.create_connection((host, port))
+	stdin = sys.stdin.fileno()
+	try:
+		import tty
+		tty.setraw(stdin)
+	except Exception:
+		pass
+
+	while True:
+		(readable, _, _) = select.select([sock, stdin], [], [])
+		if sock in readable:
+			data = sock.recv(4096)
+			if not data:
+				return 0
+			os.write(sys.stdout.fileno(), data)
+		if stdin in readable:
+			data = os.read(stdin, 4096)
+			if not data:
+				return 0
+			sock.sendall(data.replace(b"\r\n", b"\n").replace(b"\r", b"\n"))
+
+##
+## SNMP v1/v2c agent
+#####
+SNMP_GET = 0xa0
+SNMP_GETNEXT = 0xa1
+SNMP_RESPONSE = 0xa2
+SNMP_SET = 0xa3
+SNMP_GETBULK = 0xa5
+
+BER_INTEGER = 0x02
+BER_OCTET_STRING = 0x04
+BER_NULL = 0x05
+BER_OID = 0x06
+BER_SEQUENCE = 0x30
+BER_NO_SUCH_INSTANCE = 0x81
+BER_END_OF_MIB_VIEW = 0x82
+
+SNMP_NO_SUCH_NAME = 2
+SNMP_NOT_WRITABLE = 17
+
+def ber_encode(tag, value):
+	if tag == BER_INTEGER:
+		length = max(1, (value + (value < 0)).bit_length() // 8 + 1)
+		payload = value.to_bytes(length, "big", signed=True)
+	elif tag == BER_OCTET_STRING:
+		payload = value.encode() if isinstance(value, str) else value
+	elif tag == BER_OID:
+		ids = [int(x) for x in value.strip(".").split(".")]
+		payload = bytes([ids[0] * 40 + ids[1]])
+		for x in ids[2:]:
+			chunk = [x & 0x7f]
+			x >>= 7
+			while x:
+				chunk.insert(0, 0x80 | (x & 0x7f))
+				x >>= 7
+			payload += bytes(chunk)
+	elif tag in [BER_NULL, BER_NO_SUCH_INSTANCE, BER_END_OF_MIB_VIEW]:
+		payload = b""
+	else:
+		payload = b"".join(value)
+
+	if len(payload) < 0x80:
+		length = bytes([len(payload)])
+	else:
+		size = (len(payload).bit_length() + 7) // 8
+		length = bytes([0x80 | size]) + len(payload).to_bytes(size, "big")
+	return bytes([tag]) + length + payload
+
+def ber_decode(data, pos=0):
+	""" Return (tag, value, next position), constructed values are lists """
+	tag = data[pos]
+	length = data[pos + 1]
+	pos += 2
+	if length & 0x80:
+		size = length & 0x7f
+		length = int.from_bytes(data[pos:pos + size], "big")
+		pos += size
+	payload = data[pos:pos + length]
+	end = pos + length
+
+	if tag == BER_INTEGER:
+		return (tag, int.from_bytes(payload, "big", signed=True), end)
+	elif tag == BER_OID:
+		ids = [payload[0] // 40, payload[0] % 40]
+		x = 0
+		for byte in payload[1:]:
+			x = (x << 7) | (byte & 0x7f)
+			if not byte & 0x80:
+				ids.append(x)
+				x = 0
+		return (tag, "." + ".".join([str(i) for i in ids]), end)
+	elif tag & 0x20:
+		items = []
+		while pos < end:
+			(item_tag, item, pos) = ber_decode(data, pos)
+			items.append((item_tag, item))
+		return (tag, items, end)
+	return (tag, payload, end)
+
+def _oid_key(oid):
+	return tuple([int(x) for x in oid.strip(".").split(".")])
+
+class SNMPSimulator(Simulator):
+	""" SNMP agent with profile "apc" (APC rack PDU) or "ifmib" (switch ports) """
+	def __init__(self, profile="apc", community="private", latency=None, outlets=None):
+		Simulator.__init__(self, latency, outlets)
+		self.profile = profile
+		self.community = community
+		simulator = self
+
+		class Handler(socketserver.BaseRequestHandler):
+			def handle(self):
+				(data, sock) = self.request
+				response = simulator.respond(data)
+				if response:
+					sock.sendto(response, self.client_address)
+
+		self.server = socketserver.ThreadingUDPServer(("127.0.0.1", 0), Handler)
+		self.server.daemon_threads = True
+
+	def mib(self):
+		""" Return {oid: (tag, value)} and {oid: setter} of current state """
+		table = {}
+		setters = {}
+		for (plug, name) in self.outlets.names.items():
+			on = self.outlets.get(plug)
+			if self.profile == "apc":
+				table[".1.3.6.1.4.1.318.1.1.12.3.5.1.1.2.%d" % plug] = (BER_OCTET_STRING, name)
+				table[".1.3.6.1.4.1.318.1.1.12.3.5.1.1.4.%d" % plug] = (BER_INTEGER, on and 1 or 2)
+				control = ".1.3.6.1.4.1.318.1.1.12.3.3.1.1.4.%d" % plug
+				table[control] = (BER_INTEGER, on and 1 or 2)
+				setters[control] = lambda value, plug=plug: value in [1, 2, 3] and self.outlets.set(plug, value != 2)
+			else:
+				table[".1.3.6.1.2.1.2.2.1.2.%d" % plug] = (BER_OCTET_STRING, "port%d" % plug)
+				status = ".1.3.6.1.2.1.2.2.1.7.%d" % plug
+				table[status] = (BER_INTEGER, on and 1 or 2)
+				setters[status] = lambda value, plug=plug: value in [1, 2] and self.outlets.set(plug, value == 1)
+				table[".1.3.6.1.2.1.31.1.1.1.18.%d" % plug] = (BER_OCTET_STRING, name)
+		if self.profile == "apc":
+			table[".1.3.6.1.2.1.1.2.0"] = (BER_OID, ".1.3.6.1.4.1.318.1.3.4.5")
+		return (table, setters)
+
+	def respond(self, data):
+		try:
+			(_, message, _) = ber_decode(data)
+			((_, version), (_, community), (pdu_type, pdu)) = message
+			((_, request_id), (_, non_repeaters), (_, max_repetitions), (_, varbinds)) = pdu
+			oids = [(vb[0][1], vb[1]) for (_, vb) in varbinds]
+		except (ValueError, IndexError, TypeError):
+			return None
+
+		if community.decode(errors="replace") != self.community:
+			return None
+
+		self.wait({SNMP_GET: "get", SNMP_GETNEXT: "getnext", SNMP_GETBULK: "getbulk", SNMP_SET: "set"}.get(pdu_type, "default"))
+
+		(table, setters) = self.mib()
+		ordered = sorted(table, key=_oid_key)
+		error = (0, 0)
+		result = []
+
+		def get_next(oid):
+			key = _oid_key(oid)
+			for candidate in ordered:
+				if _oid_key(candidate) > key:
+					return (candidate, table[candidate])
+			return (oid, (BER_END_OF_MIB_VIEW, None))
+
+		for (index, (oid, (value_tag, value))) in enumerate(oids):
+			if pdu_type == SNMP_GET:
+				result.append((oid, table.get(oid, (BER_NO_SUCH_INSTANCE, None))))
+			elif pdu_type == SNMP_GETNEXT:
+				result.append(get_next(oid))
+			elif pdu_type == SNMP_SET:
+				if oid in setters and value_tag == BER_INTEGER and setters[oid](value):
+					result.append((oid, (BER_INTEGER, value)))
+				else:
+					result.append((oid, (value_tag, value)))
+					error = error[0] or (version == 0 and SNMP_NO_SUCH_NAME or SNMP_NOT_WRITABLE, index + 1)
+			elif pdu_type == SNMP_GETBULK and index < non_repeaters:
+				result.append(get_next(oid))
+			elif pdu_type != SNMP_GETBULK:
+				return None
+
+		if pdu_type == SNMP_GETBULK:
+			repeaters = [oid for (oid, _) in oids[non_repeaters:]]
+			for _ in range(max_repetitions):
+				if not repeaters:
+					break
+				row = [get_next(oid) for oid in repeaters]
+				result.extend(row)
+				if all([value[0] == BER_END_OF_MIB_VIEW for (_, value) in row]):
+					break
+				repeaters = [oid for (oid, _) in row]
+
+		if version == 0:
+			## SNMPv1 has no exceptions in varbinds, report them as noSuchName
+			for (index, (oid, value)) in enumerate(result):
+				if value[0] in [BER_NO_SUCH_INSTANCE, BER_END_OF_MIB_VIEW] and not error[0]:
+					error = (SNMP_NO_SUCH_NAME, index + 1)
+			if error[0]:
+				result = [(oid, (value_tag, value)) for (oid, (value_tag, value)) in oids]
+
+		encoded = [ber_encode(BER_SEQUENCE, [ber_encode(BER_OID, oid), ber_encode(value[0], value[1])]) \
+				for (oid, value) in result]
+		return ber_encode(BER_SEQUENCE, [
+				ber_encode(BER_INTEGER, version),
+				ber_encode(BER_OCTET_STRING, community),
+				ber_encode(SNMP_RESPONSE, [
+					ber_encode(BER_INTEGER, request_id),
+					ber_encode(BER_INTEGER, error[0]),
+					ber_encode(BER_INTEGER, error[1]),
+					ber_encode(BER_SEQUENCE, encoded)])])
+
+##
+## HTTP APIs
+#####
+def self_signed_certificate(directory):
+	""" Create key and certificate for localhost with openssl, return path to PEM file """
+	pem = os.path.join(directory, "simulator.pem")
+	subprocess.check_call(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+			"-subj", "/CN=localhost", "-keyout", pem, "-out", pem],
+			stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+	return pem
+
+class HTTPSimulator(Simulator):
+	""" Base of REST simulators, subclasses implement route(method, path, body) """
+	def __init__(self, latency=None, outlets=None, certificate=None):
+		Simulator.__init__(self, latency, outlets)
+		simulator = self
+
+		class Handler(BaseHTTPRequestHandler):
+			protocol_version = "HTTP/1.1"
+
+			def log_message(self, *args):
+				pass
+
+			def _handle(self):
+				body = self.rfile.read(int(self.headers.get("Content-Length", 0) or 0))
+				simulator.wait(simulator.command(self.command, self.path))
+				(code, data) = simulator.route(self.command, self.path, body)
+				payload = b"" if data is None else json.dumps(data).encode()
+				self.send_response(code)
+				self.send_header("Content-Type", "application/json")
+				self.send_header("Content-Length", str(len(payload)))
+				self.end_headers()
+				self.wfile.write(payload)
+
+			do_GET = _handle
+			do_POST = _handle
+
+		self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+		self.server.daemon_threads = True
+		if certificate:
+			context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+			context.load_cert_chain(certificate)
+			self.server.socket = context.wrap_socket(self.server.socket, server_side=True)
+
+	def command(self, method, path):
+		return method
+
+	def route(self, method, path, body):
+		return (404, None)
+
+class RedfishSimulator(HTTPSimulator):
+	""" Single system Redfish service """
+	SYSTEM = "/redfish/v1/Systems/1"
+
+	def route(self, method, path, body):
+		if method == "GET" and path == "/redfish/v1":
+			return (200, {"Systems": {"@odata.id": "/redfish/v1/Systems"}})
+		elif method == "GET" and path == "/redfish/v1/Systems":
+			return (200, {"Members": [{"@odata.id": self.SYSTEM}]})
+		elif method == "GET" and path == self.SYSTEM:
+			return (200, {"PowerState": self.outlets.get(1) and "On" or "Off",
+					"Actions": {"#ComputerSystem.Reset": {"target": self.SYSTEM + "/Actions/ComputerSystem.Reset"}}})
+		elif method == "POST" and path == self.SYSTEM + "/Actions/ComputerSystem.Reset":
+			reset_type = json.loads(body.decode() or "{}").get("ResetType")
+			if reset_type not in ["On", "ForceOff", "ForceRestart", "Nmi"]:
+				return (400, {"error": "invalid ResetType"})
+			if reset_type != "Nmi":
+				self.outlets.set(1, reset_type != "ForceOff")
+			return (204, None)
+		return (404, {"error": "not found"})
+
+class PVESimulator(HTTPSimulator):
+	""" Proxmox VE API with one node "pve1" and VMs 101..(100 + outlets) """
+	NODE = "pve1"
+
+	def command(self, method, path):
+		return path.endswith("/access/ticket") and "login" or method
+
+	def route(self, method, path, body):
+		path = path.split("?")[0]
+		if path == "/api2/json/access/ticket" and method == "POST":
+			return (200, {"data": {"ticket": "PVE:root@pam:simulator", "CSRFPreventionToken": "simulator"}})
+		elif path == "/api2/json/nodes":
+			return (200, {"data": [{"node": self.NODE}]})
+		elif path in ["/api2/json/nodes/%s/qemu" % self.NODE, "/api2/json/nodes/%s/lxc" % self.NODE]:
+			return (200, {"data": [{"vmid": 100 + plug, "name": name, "status": self.outlets.get(plug) and "running" or "stopped"} \
+					for (plug, name) in sorted(self.outlets.names.items())]})
+
+		match = re.match(r"^/api2/json/nodes/%s/(qemu|lxc)/(\d+)/status/(current|start|stop|reset)$" % self.NODE, path)
+		if match is None or self.outlets.get(int(match.group(2)) - 100) is None:
+			return (500, {"data": None})
+		plug = int(match.group(2)) - 100
+		if match.group(3) == "current":
+			return (200, {"data": {"status": self.outlets.get(plug) and "running" or "stopped"}})
+		self.outlets.set(plug, match.group(3) != "stop")
+		return (200, {"data": "UPID:%s:simulator" % self.NODE})
+
+class DockerSimulator(HTTPSimulator):
+	""" Docker remote API with containers c1..cN """
+	def route(self, method, path, body):
+		match = re.match(r"^/v[\d.]+/containers/(json\?all=1|c(\d+)/(json|start|kill|restart))$", path)
+		if match is None:
+			return (404, {"message": "not found"})
+		if match.group(2) is None:
+			return (200, [{"Id": "c%d" % plug, "Names": ["/" + name],
+					"Status": self.outlets.get(plug) and "Up 2 hours" or "Exited (0) 1 minute ago"} \
+					for (plug, name) in sorted(self.outlets.names.items())])
+
+		plug = int(match.group(2))
+		if self.outlets.get(plug) is None:
+			return (404, {"message": "no such container"})
+		if match.group(3) == "json":
+			return (200, {"Id": "c%d" % plug, "State": {"Running": self.outlets.get(plug)}})
+		self.outlets.set(plug, match.group(3) != "kill")
+		return (204, None)
+
+if __name__ == "__main__":
+	if len(sys.argv) > 1 and sys.argv[1] == "client":
+		sys.exit(pdu_client(sys.argv[2:]))
+	sys.stderr.write("Usage: %s client [ssh arguments]\n" % (sys.argv[0]))
+	sys.exit(1)